@@ -10,6 +10,7 @@ import string
 from app.database.database import get_session
 from app.models.user import User
 from app.core.security import admin_required
+from app.cache.cache_manager import cache_manager
 
 router = APIRouter()
 
@@ -37,6 +38,19 @@ class UserUpdate(BaseModel):
     role: Optional[str] = None
     status: Optional[str] = None
 
+class CacheStatsResponse(BaseModel):
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: int
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int
+    expirations: int
+    stale_hits: int
+    coalesced: int
+
 # 辅助函数：生成随机密码
 def generate_random_password(length=10):
     alphabet = string.ascii_letters + string.digits
@@ -186,3 +200,10 @@ def reset_user_password(
         "message": "密码已重置",
         "new_password": new_password
     }
+
+@router.get("/cache/stats", response_model=CacheStatsResponse)
+def get_cache_stats(
+    admin: User = Depends(admin_required)
+):
+    """获取缓存统计信息（仅管理员）"""
+    return cache_manager.stats()
@@ -9,6 +9,7 @@ from typing import Optional
 from app.database.database import get_session
 from app.models.user import User
 from app.core.security import create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.utils.responses import FastJSONResponse
 
 router = APIRouter()
 
@@ -34,7 +35,7 @@ class UserResponse(BaseModel):
     is_first_login: bool
 
 # API路由
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, response_class=FastJSONResponse)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_session)):
     """用户登录获取令牌"""
     # 查询用户
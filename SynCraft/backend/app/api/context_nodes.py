@@ -1,14 +1,9 @@
 # backend/app/api/context_nodes.py
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import Session, select
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel
 
-from app.database import get_session
-from app.models.node import Node
-from app.models.context import Context
-from app.models.context_node import ContextNode
 from app.di.container import get_context_service, get_node_service, get_qa_pair_service
 
 router = APIRouter()
@@ -106,9 +101,7 @@ def get_context_nodes(
     relation_type: Optional[str] = None,
     include_qa: bool = False,
     context_service = Depends(get_context_service),
-    node_service = Depends(get_node_service),
-    qa_pair_service = Depends(get_qa_pair_service),
-    db: Session = Depends(get_session)
+    qa_pair_service = Depends(get_qa_pair_service)
 ):
     """获取上下文下的所有节点"""
     
@@ -117,21 +110,21 @@ def get_context_nodes(
     if not context:
         raise HTTPException(status_code=404, detail="Context not found")
     
-    # 获取上下文中的节点
-    nodes_data = context_service.get_context_nodes(context_id)
+    # 一次联表查询获取节点关系和节点
+    rows = context_service.get_context_node_rows(context_id)
     
     # 过滤指定关系类型的节点
     if relation_type:
-        nodes_data = [node for node in nodes_data if relation_type in node.get("relation_type", "")]
+        rows = [(context_node, node) for context_node, node in rows if relation_type in (context_node.relation_type or "")]
+    
+    # 批量获取所有节点的QA对
+    qa_pairs_map = {}
+    if include_qa:
+        qa_pairs_map = qa_pair_service.get_qa_pairs_for_nodes([node.id for _, node in rows])
     
     # 构建响应
     items = []
-    for node_data in nodes_data:
-        # 获取节点详情
-        node = node_service.get_node(node_data["id"])
-        if not node:
-            continue
-        
+    for context_node, node in rows:
         node_brief = NodeBrief(
             id=node.id,
             session_id=node.session_id,
@@ -139,41 +132,10 @@ def get_context_nodes(
             created_at=node.created_at
         )
         
-        qa_pairs = []
-        # 如果需要包含QA对信息
-        if include_qa:
-            # 获取节点的QA对
-            qa_pairs_data = qa_pair_service.get_node_qa_pairs(node.id)
-            
-            for qa_pair in qa_pairs_data:
-                # 提取问题和回答
-                question = None
-                answer = None
-                
-                for message in qa_pair["messages"]:
-                    if message["role"] == "user":
-                        question = message["content"]
-                    elif message["role"] == "assistant":
-                        answer = message["content"]
-                
-                qa_pairs.append(QAPairBrief(
-                    id=qa_pair["id"],
-                    question=question or "",
-                    answer=answer
-                ))
-        
-        # 查找对应的ContextNode记录
-        query = select(ContextNode).where(
-            ContextNode.context_id == context_id,
-            ContextNode.node_id == node.id
-        )
-        context_node = None
-        result = db.exec(query).first()
-        if result:
-            context_node = result
-        
-        if not context_node:
-            continue
+        qa_pairs = [
+            QAPairBrief(**qa_pair)
+            for qa_pair in qa_pair_service.summarize_qa_pairs(qa_pairs_map.get(node.id, []))
+        ]
         
         items.append(ContextNodeWithNodeResponse(
             id=context_node.id,
@@ -191,7 +153,7 @@ def get_context_nodes(
 def get_node_contexts(
     node_id: str,
     node_service = Depends(get_node_service),
-    db: Session = Depends(get_session)
+    context_service = Depends(get_context_service)
 ):
     """获取节点所属的所有上下文"""
     # 检查节点是否存在
@@ -199,18 +161,12 @@ def get_node_contexts(
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     
-    # 查询关联的ContextNode记录
-    query = select(ContextNode).where(ContextNode.node_id == node_id)
-    context_nodes = db.exec(query).all()
+    # 一次联表查询获取上下文关系和上下文
+    rows = context_service.get_node_context_rows(node_id)
     
     # 构建响应
     items = []
-    for context_node in context_nodes:
-        # 查询上下文
-        context = db.get(Context, context_node.context_id)
-        if not context:
-            continue
-        
+    for context_node, context in rows:
         context_brief = ContextBrief(
             id=context.id,
             context_id=context.context_id,
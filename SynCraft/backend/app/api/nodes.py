@@ -1,17 +1,20 @@
 # backend/app/api/nodes.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
+import json
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel
 
-from app.api.qa_pairs import MessageResponse, QAPairResponse, QAPairDetailResponse, SearchResponse, QuestionRequest
+from app.api.qa_pairs import MessageResponse, QAPairResponse, QAPairDetailResponse, SearchResponse, QuestionRequest, _build_qa_pair_response
 
 from app.database import get_session
 from app.models.node import Node
 from app.models.context import Context
 from app.services.node_service import NodeService
-from app.services.qa_pair_service import QAPairService
+from app.services.qa_pair_service import IdempotencyKeyInProgress, QAPairService
 from app.services.context_service import ContextService
 from app.services.qa_pair_service import QAPairService
 
@@ -178,11 +181,31 @@ def get_node(
     
     # 如果需要包含子节点信息
     if include_children and children_depth > 0:
-        # 获取子节点
-        children = node_service.get_node_children(node_id)
-        
+        # 逐层获取子树，每层一次查询，QA对批量加载
+        response.children = get_node_children_recursive(node_id, include_qa, children_depth, node_service, qa_pair_service)
+    
+    # 查询节点所属的上下文
+    # 这里需要实现一个方法来获取节点所属的上下文
+    # 暂时留空，等待实现
+    
+    return response
+
+def get_node_children_recursive(node_id: str, include_qa: bool, depth: int, node_service: NodeService, qa_pair_service: QAPairService):
+    """
+    获取节点 depth 层内的子节点树
+    
+    子树逐层查询（每层一次），所有子节点的QA对和消息批量加载，查询次数只与层数有关
+    """
+    children_map = node_service.get_children_by_level(node_id, depth)
+    
+    qa_pairs_map = {}
+    if include_qa:
+        descendant_ids = [child.id for children in children_map.values() for child in children]
+        qa_pairs_map = qa_pair_service.get_qa_pairs_for_nodes(descendant_ids)
+    
+    def build(parent_id: str, level: int):
         child_nodes = []
-        for child in children:
+        for child in children_map.get(parent_id, []):
             child_info = {
                 "id": child.id,
                 "template_key": child.template_key,
@@ -190,93 +213,17 @@ def get_node(
             }
             
             # 如果需要包含QA对信息
-            if include_qa:
-                # 获取节点的QA对
-                qa_pairs_data = qa_pair_service.get_node_qa_pairs(child.id)
-                
-                if qa_pairs_data:
-                    # 提取问题和回答
-                    qa_pairs_info = []
-                    for qa_pair in qa_pairs_data:
-                        question = None
-                        answer = None
-                        
-                        for message in qa_pair["messages"]:
-                            if message["role"] == "user":
-                                question = message["content"]
-                            elif message["role"] == "assistant":
-                                answer = message["content"]
-                        
-                        qa_pairs_info.append({
-                            "id": qa_pair["id"],
-                            "question": question or "",
-                            "answer": answer
-                        })
-                    
-                    child_info["qa_pairs"] = qa_pairs_info
+            if qa_pairs_map.get(child.id):
+                child_info["qa_pairs"] = qa_pair_service.summarize_qa_pairs(qa_pairs_map[child.id])
             
-            # 如果需要递归获取子节点的子节点
-            if children_depth > 1:
-                # 递归调用获取子节点的子节点
-                child_info["children"] = get_node_children_recursive(child.id, include_qa, children_depth - 1, node_service, qa_pair_service)
+            # 如果需要包含下一层子节点
+            if level > 1:
+                child_info["children"] = build(child.id, level - 1)
             
             child_nodes.append(child_info)
-        
-        response.children = child_nodes
-    
-    # 查询节点所属的上下文
-    # 这里需要实现一个方法来获取节点所属的上下文
-    # 暂时留空，等待实现
-    
-    return response
-
-def get_node_children_recursive(node_id: str, include_qa: bool, depth: int, node_service: NodeService, qa_pair_service: QAPairService):
-    """递归获取节点的子节点"""
-    # 获取子节点
-    children = node_service.get_node_children(node_id)
-    
-    child_nodes = []
-    for child in children:
-        child_info = {
-            "id": child.id,
-            "template_key": child.template_key,
-            "created_at": child.created_at.isoformat()
-        }
-        
-        # 如果需要包含QA对信息
-        if include_qa:
-            # 获取节点的QA对
-            qa_pairs_data = qa_pair_service.get_node_qa_pairs(child.id)
-            
-            if qa_pairs_data:
-                # 提取问题和回答
-                qa_pairs_info = []
-                for qa_pair in qa_pairs_data:
-                    question = None
-                    answer = None
-                    
-                    for message in qa_pair["messages"]:
-                        if message["role"] == "user":
-                            question = message["content"]
-                        elif message["role"] == "assistant":
-                            answer = message["content"]
-                    
-                    qa_pairs_info.append({
-                        "id": qa_pair["id"],
-                        "question": question or "",
-                        "answer": answer
-                    })
-                
-                child_info["qa_pairs"] = qa_pairs_info
-        
-        # 如果需要递归获取子节点的子节点
-        if depth > 1:
-            # 递归调用获取子节点的子节点
-            child_info["children"] = get_node_children_recursive(child.id, include_qa, depth - 1, node_service, qa_pair_service)
-        
-        child_nodes.append(child_info)
+        return child_nodes
     
-    return child_nodes
+    return build(node_id, depth)
 
 @router.get("/nodes/{node_id}/qa_pairs", response_model=SearchResponse)
 def get_node_qa_pairs(
@@ -341,66 +288,98 @@ def get_node_qa_pairs(
     )
 
 @router.post("/nodes/{node_id}/ask", response_model=QAPairResponse)
-def ask_question(
+async def ask_question(
     node_id: str,
     question_data: QuestionRequest,
-    db: Session = Depends(get_session)
+    db: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """向节点提问并获取回答"""
+    """
+    向节点提问并获取回答
+    
+    异步处理：等待LLM期间不占用线程池线程，数据库读写放到线程中执行。
+    带 Idempotency-Key 请求头的重试请求返回已保存的QA对，不会重复创建。
+    """
     # 使用QAPairService提问
     qa_pair_service = QAPairService(db)
     node_service = NodeService(db)
     
     # 检查节点是否存在
-    node = node_service.get_node(node_id)
+    node = await run_in_threadpool(node_service.get_node, node_id)
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     
     try:
         # 提问并获取回答
-        result = qa_pair_service.ask_question(
+        result = await qa_pair_service.ask_question_async(
             node_id=node_id,
-            question=question_data.question
+            question=question_data.question,
+            idempotency_key=idempotency_key
         )
         
-        # 提取问题和回答
-        question = None
-        answer = None
-        
-        for message in result["messages"]:
-            if message["role"] == "user":
-                question = message["content"]
-            elif message["role"] == "assistant":
-                answer = message["content"]
-        
-        # 构建消息响应
-        message_responses = []
-        for message in result["messages"]:
-            message_responses.append(MessageResponse(
-                id=message["id"],
-                role=message["role"],
-                content=message["content"],
-                timestamp=message["timestamp"],
-                meta_info=message.get("meta_info", {}),
-                qa_pair_id=result["id"]
-            ))
-        
-        return QAPairResponse(
-            id=result["id"],
-            node_id=result["node_id"],
-            session_id=result["session_id"],
-            created_at=result["created_at"],
-            updated_at=result["updated_at"],
-            tags=result.get("tags", []),
-            is_favorite=result.get("is_favorite", False),
-            question=question or "",
-            answer=answer,
-            messages=message_responses
-        )
+        return _build_qa_pair_response(result)
     
+    except IdempotencyKeyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def _format_sse(event: str, data: str) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+@router.post("/nodes/{node_id}/ask/stream")
+async def ask_question_stream(
+    node_id: str,
+    question_data: QuestionRequest,
+    db: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    向节点提问，以Server-Sent Events流式返回回答
+    
+    事件类型：start（QA对已创建）、token（回答片段）、done（完整QA对）、error（生成失败）。
+    带 Idempotency-Key 请求头的重试请求直接以 done 事件返回已成功回答的QA对，
+    之前的请求仍在回答时返回409。
+    """
+    qa_pair_service = QAPairService(db)
+    node_service = NodeService(db)
+    
+    # 检查节点是否存在（流开始后无法再返回404）
+    node = await run_in_threadpool(node_service.get_node, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Node not found")
+    
+    # 幂等键冲突或同一幂等键的请求仍在进行，同样需要在流开始前返回
+    try:
+        await run_in_threadpool(
+            qa_pair_service.get_idempotent_qa_pair, idempotency_key, node_id, question_data.question
+        )
+    except IdempotencyKeyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def event_stream():
+        async for item in qa_pair_service.ask_question_stream(
+            node_id, question_data.question, idempotency_key
+        ):
+            if item["event"] == "done":
+                data = _build_qa_pair_response(item["data"]).model_dump_json()
+            else:
+                data = json.dumps(item["data"], ensure_ascii=False)
+            yield _format_sse(item["event"], data)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 禁止反向代理缓冲，保证token及时到达客户端
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.get("/nodes/{node_id}/children", response_model=NodeChildrenResponse)
 def get_node_children_api(
     node_id: str,
@@ -420,6 +399,11 @@ def get_node_children_api(
     # 获取子节点
     children = node_service.get_node_children(node_id)
     
+    # 批量获取所有子节点的QA对
+    qa_pairs_map = {}
+    if include_qa:
+        qa_pairs_map = qa_pair_service.get_qa_pairs_for_nodes([child.id for child in children])
+    
     child_nodes = []
     for child in children:
         child_info = {
@@ -430,30 +414,8 @@ def get_node_children_api(
         }
         
         # 如果需要包含QA对信息
-        if include_qa:
-            # 获取节点的QA对
-            qa_pairs_data = qa_pair_service.get_node_qa_pairs(child.id)
-            
-            if qa_pairs_data:
-                # 提取问题和回答
-                qa_pairs_info = []
-                for qa_pair in qa_pairs_data:
-                    question = None
-                    answer = None
-                    
-                    for message in qa_pair["messages"]:
-                        if message["role"] == "user":
-                            question = message["content"]
-                        elif message["role"] == "assistant":
-                            answer = message["content"]
-                    
-                    qa_pairs_info.append({
-                        "id": qa_pair["id"],
-                        "question": question or "",
-                        "answer": answer
-                    })
-                
-                child_info["qa_pairs"] = qa_pairs_info
+        if qa_pairs_map.get(child.id):
+            child_info["qa_pairs"] = qa_pair_service.summarize_qa_pairs(qa_pairs_map[child.id])
         
         child_nodes.append(child_info)
     
@@ -1,7 +1,8 @@
 # backend/app/api/qa_pairs.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel
 
@@ -9,7 +10,7 @@ from app.database import get_session
 from app.models.node import Node
 from app.models.qapair import QAPair
 from app.models.message import Message
-from app.services.qa_pair_service import QAPairService
+from app.services.qa_pair_service import IdempotencyKeyInProgress, QAPairService
 from app.services.node_service import NodeService
 from app.services.context_service import ContextService
 
@@ -58,6 +59,43 @@ class SuccessResponse(BaseModel):
     success: bool
     message: str
 
+def _build_qa_pair_response(result: Dict[str, Any]) -> QAPairResponse:
+    """根据QA对详情构建响应"""
+    # 提取问题和回答
+    question = None
+    answer = None
+    
+    for message in result["messages"]:
+        if message["role"] == "user":
+            question = message["content"]
+        elif message["role"] == "assistant":
+            answer = message["content"]
+    
+    # 构建消息响应
+    message_responses = []
+    for message in result["messages"]:
+        message_responses.append(MessageResponse(
+            id=message["id"],
+            role=message["role"],
+            content=message["content"],
+            timestamp=message["timestamp"],
+            meta_info=message.get("meta_info", {}),
+            qa_pair_id=result["id"]
+        ))
+    
+    return QAPairResponse(
+        id=result["id"],
+        node_id=result["node_id"],
+        session_id=result["session_id"],
+        created_at=result["created_at"],
+        updated_at=result["updated_at"],
+        tags=result.get("tags", []),
+        is_favorite=result.get("is_favorite", False),
+        question=question or "",
+        answer=answer,
+        messages=message_responses
+    )
+
 # 搜索QA对API
 class SearchResponse(BaseModel):
     total: int
@@ -68,11 +106,13 @@ class SearchResponse(BaseModel):
 def search_qa_pairs(
     query: Optional[str] = None,
     session_id: Optional[str] = None,
+    sort_by: str = "created_at",
+    sort_order: str = "desc",
     limit: int = 10,
     offset: int = 0,
     db: Session = Depends(get_session)
 ):
-    """搜索QA对"""
+    """搜索QA对，sort_by=relevance 时按全文检索相关度排序"""
     # 使用QAPairService搜索QA对
     qa_pair_service = QAPairService(db)
     
@@ -81,7 +121,9 @@ def search_qa_pairs(
         query=query,
         session_id=session_id,
         limit=limit,
-        offset=offset
+        offset=offset,
+        sort_by=sort_by,
+        sort_order=sort_order
     )
     
     # 构建响应
@@ -420,63 +462,39 @@ class QuestionRequest(BaseModel):
     question: str
 
 @router.post("/nodes/{node_id}/ask", response_model=QAPairResponse)
-def ask_question(
+async def ask_question(
     node_id: str,
     question_data: QuestionRequest,
-    db: Session = Depends(get_session)
+    db: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """向节点提问并获取回答"""
+    """
+    向节点提问并获取回答
+    
+    异步处理：等待LLM期间不占用线程池线程，数据库读写放到线程中执行。
+    带 Idempotency-Key 请求头的重试请求返回已保存的QA对，不会重复创建。
+    """
     # 使用QAPairService提问
     qa_pair_service = QAPairService(db)
     node_service = NodeService(db)
     
     # 检查节点是否存在
-    node = node_service.get_node(node_id)
+    node = await run_in_threadpool(node_service.get_node, node_id)
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
     
     try:
         # 提问并获取回答
-        result = qa_pair_service.ask_question(
+        result = await qa_pair_service.ask_question_async(
             node_id=node_id,
-            question=question_data.question
+            question=question_data.question,
+            idempotency_key=idempotency_key
         )
         
-        # 提取问题和回答
-        question = None
-        answer = None
-        
-        for message in result["messages"]:
-            if message["role"] == "user":
-                question = message["content"]
-            elif message["role"] == "assistant":
-                answer = message["content"]
-        
-        # 构建消息响应
-        message_responses = []
-        for message in result["messages"]:
-            message_responses.append(MessageResponse(
-                id=message["id"],
-                role=message["role"],
-                content=message["content"],
-                timestamp=message["timestamp"],
-                meta_info=message.get("meta_info", {}),
-                qa_pair_id=result["id"]
-            ))
-        
-        return QAPairResponse(
-            id=result["id"],
-            node_id=result["node_id"],
-            session_id=result["session_id"],
-            created_at=result["created_at"],
-            updated_at=result["updated_at"],
-            tags=result.get("tags", []),
-            is_favorite=result.get("is_favorite", False),
-            question=question or "",
-            answer=answer,
-            messages=message_responses
-        )
+        return _build_qa_pair_response(result)
     
+    except IdempotencyKeyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -486,6 +504,15 @@ class MessageRequest(BaseModel):
     content: str
     meta_info: Optional[dict] = None
 
+class MessageImportItem(MessageRequest):
+    timestamp: Optional[datetime] = None
+
+class MessagesImportRequest(BaseModel):
+    messages: List[MessageImportItem]
+
+class MessagesImportResponse(BaseModel):
+    items: List[MessageResponse]
+
 # 添加消息API
 @router.post("/{qa_pair_id}/messages", response_model=MessageResponse)
 def add_message(
@@ -519,6 +546,36 @@ def add_message(
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+# 批量添加消息API，用于导入多轮对话
+@router.post("/{qa_pair_id}/messages/bulk", response_model=MessagesImportResponse)
+def add_messages(
+    qa_pair_id: str,
+    import_data: MessagesImportRequest,
+    db: Session = Depends(get_session)
+):
+    """向QA对批量添加消息，在一个事务中写入"""
+    qa_pair_service = QAPairService(db)
+    
+    try:
+        messages = qa_pair_service.add_messages(
+            qa_pair_id=qa_pair_id,
+            messages=[item.model_dump() for item in import_data.messages]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return MessagesImportResponse(items=[
+        MessageResponse(
+            id=message.id,
+            role=message.role,
+            content=message.content,
+            timestamp=message.timestamp,
+            meta_info=message.meta_info or {},
+            qa_pair_id=qa_pair_id
+        )
+        for message in messages
+    ])
+
 # 增加查看次数API
 @router.post("/{qa_pair_id}/view", response_model=QAPairResponse)
 def increment_view_count(
@@ -1,11 +1,13 @@
 # backend/app/api/search.py
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from datetime import datetime, date
 from pydantic import BaseModel
 
-from app.database import get_session
+from app.database import get_optional_async_session, get_read_session
 from app.models.node import Node
 from app.models.context import Context
 from app.models.context_node import ContextNode
@@ -31,85 +33,78 @@ class QAPairSearchResponse(BaseModel):
 
 # API路由
 @router.get("/search/qa_pairs", response_model=QAPairSearchResponse)
-def search_qa_pairs(
+async def search_qa_pairs(
     query: Optional[str] = None,
     session_id: Optional[str] = None,
     context_id: Optional[str] = None,
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
+    is_favorite: Optional[bool] = None,
+    status: Optional[str] = None,
+    min_rating: Optional[int] = None,
+    max_rating: Optional[int] = None,
     sort_by: str = "created_at",
     sort_order: str = "desc",
     limit: int = 10,
     offset: int = 0,
-    db: Session = Depends(get_session)
+    db: Optional[AsyncSession] = Depends(get_optional_async_session),
+    read_db: Session = Depends(get_read_session)
 ):
-    """搜索QA对"""
-    # 使用QAPairService和ContextService
-    qa_pair_service = QAPairService(db)
-    context_service = ContextService(db)
+    """
+    搜索QA对，所有过滤、排序和分页都在一条SQL语句中完成
     
-    # 如果提供了context_id，获取上下文中的节点ID列表
-    node_ids = None
-    if context_id:
-        # 检查上下文是否存在
-        context = context_service.get_context(context_id)
-        if not context:
-            raise HTTPException(status_code=404, detail="Context not found")
+    使用异步只读会话，查询期间不占用线程池线程；查询逻辑复用同步的服务代码。
+    未安装异步驱动时改用同步只读会话，在线程池中执行
+    """
+    def search(db: Session) -> QAPairSearchResponse:
+        # 使用QAPairService和ContextService
+        qa_pair_service = QAPairService(db)
+        context_service = ContextService(db)
         
-        # 获取上下文中的节点
-        nodes_data = context_service.get_context_nodes(context_id)
+        # 如果提供了context_id，以子查询的形式限定上下文中的节点
+        node_ids = None
+        if context_id:
+            # 检查上下文是否存在
+            context = context_service.get_context(context_id)
+            if not context:
+                raise HTTPException(status_code=404, detail="Context not found")
+            
+            node_ids = select(ContextNode.node_id).where(ContextNode.context_id == context_id)
         
-        # 获取节点ID列表
-        node_ids = [node["id"] for node in nodes_data]
+        # 使用QAPairService搜索QA对
+        search_result = qa_pair_service.search_qa_pairs(
+            query=query,
+            session_id=session_id,
+            limit=limit,
+            offset=offset,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            node_ids=node_ids,
+            date_from=datetime.combine(date_from, datetime.min.time()) if date_from else None,
+            date_to=datetime.combine(date_to, datetime.max.time()) if date_to else None,
+            is_favorite=is_favorite,
+            status=status,
+            min_rating=min_rating,
+            max_rating=max_rating
+        )
         
-        if not node_ids:
-            # 如果上下文没有关联的节点，返回空结果
-            return QAPairSearchResponse(total=0, items=[])
-    
-    # 使用QAPairService搜索QA对
-    search_result = qa_pair_service.search_qa_pairs(
-        query=query,
-        session_id=session_id,
-        limit=limit,
-        offset=offset
-    )
-    
-    # 如果提供了node_ids，过滤结果
-    if node_ids:
-        filtered_items = [item for item in search_result["items"] if item["node_id"] in node_ids]
-        search_result["items"] = filtered_items
-        search_result["total"] = len(filtered_items)
-    
-    # 如果提供了日期范围，过滤结果
-    if date_from or date_to:
-        filtered_items = []
+        # 构建响应
+        items = []
         for item in search_result["items"]:
-            created_at = item["created_at"]
-            
-            if date_from and created_at < datetime.combine(date_from, datetime.min.time()):
-                continue
-            
-            if date_to and created_at > datetime.combine(date_to, datetime.max.time()):
-                continue
-            
-            filtered_items.append(item)
+            items.append(QAPairSearchResult(
+                id=item["id"],
+                node_id=item["node_id"],
+                session_id=item["session_id"],
+                created_at=item["created_at"],
+                question=item.get("question", ""),
+                answer=item.get("answer")
+            ))
         
-        search_result["items"] = filtered_items
-        search_result["total"] = len(filtered_items)
-    
-    # 构建响应
-    items = []
-    for item in search_result["items"]:
-        items.append(QAPairSearchResult(
-            id=item["id"],
-            node_id=item["node_id"],
-            session_id=item["session_id"],
-            created_at=item["created_at"],
-            question=item.get("question", ""),
-            answer=item.get("answer")
-        ))
+        return QAPairSearchResponse(
+            total=search_result["total"],
+            items=items
+        )
     
-    return QAPairSearchResponse(
-        total=search_result["total"],
-        items=items
-    )
+    if db is None:
+        return await run_in_threadpool(search, read_db)
+    return await db.run_sync(search)
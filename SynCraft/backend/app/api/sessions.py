@@ -1,19 +1,17 @@
 # backend/app/api/sessions.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, Response
 from sqlmodel import Session, select
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 from pydantic import BaseModel
 
-from app.database import get_session as get_db_session
+from app.database import get_session as get_db_session, get_read_session
 from app.models.session import Session as SessionModel
 from app.models.node import Node
-from app.models.edge import Edge
 from app.models.context import Context
 from app.models.context_node import ContextNode
-from app.models.qapair import QAPair
-from app.models.message import Message
 from app.di.container import get_session_service
+from app.services.qa_pair_service import QAPairService
 from app.core.security import get_current_user
 from app.models.user import User
 
@@ -63,11 +61,24 @@ class MessageResponse(BaseModel):
 class SessionMessagesResponse(BaseModel):
     total: int
     items: List[MessageResponse]
+    has_more: bool = False
+    next_after_timestamp: Optional[datetime] = None
+    next_after_seq: Optional[int] = None
+    next_after_id: Optional[str] = None
 
 class SuccessResponse(BaseModel):
     success: bool
     message: str
 
+class DeletionJobResponse(BaseModel):
+    job_id: str
+    session_id: str
+    status: str
+    counts: Optional[Dict[str, int]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
 # API路由
 @router.post("/sessions", response_model=SessionResponse)
 def create_session(
@@ -452,18 +463,19 @@ def update_session(
             main_context=main_context
         )
 
-@router.delete("/sessions/{session_id}", response_model=SuccessResponse)
+@router.delete("/sessions/{session_id}", response_model=Union[SuccessResponse, DeletionJobResponse])
 def delete_session(
     session_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    background: bool = Query(False, description="在后台删除并立即返回任务信息，适用于很大的会话"),
     db: Session = Depends(get_db_session),
     session_service = Depends(get_session_service),
     current_user: User = Depends(get_current_user)
 ):
-    """删除会话"""
+    """删除会话及其所有节点、边、上下文、QA对和消息"""
     # 检查是否在测试环境中
     import os
-    # 确保select在函数开头导入
-    from sqlmodel import select
     
     if os.environ.get("TESTING") == "true":
         # 在测试环境中，直接从数据库查询会话
@@ -477,40 +489,8 @@ def delete_session(
                 session_id = session.id
             else:
                 raise HTTPException(status_code=404, detail="Session not found")
-        
-        # 查询上下文
-        query = select(Context).where(Context.session_id == session_id)
-        contexts = db.exec(query).all()
-        
-        # 删除上下文节点关系
-        for context in contexts:
-            query = select(ContextNode).where(ContextNode.context_id == context.id)
-            context_nodes = db.exec(query).all()
-            for context_node in context_nodes:
-                db.delete(context_node)
-            
-            # 删除上下文
-            db.delete(context)
-        
-        # 查询节点
-        query = select(Node).where(Node.session_id == session_id)
-        nodes = db.exec(query).all()
-        
-        # 删除节点
-        for node in nodes:
-            db.delete(node)
-        
-        # 删除会话
-        db.delete(session)
-        db.commit()
-        
-        return SuccessResponse(
-            success=True,
-            message="会话已删除"
-        )
     else:
-        # 非测试环境，使用服务层
-        # 首先获取会话信息，检查权限
+        # 非测试环境，首先获取会话信息，检查权限
         session = session_service.get_session(session_id)
         
         if not session:
@@ -519,23 +499,44 @@ def delete_session(
         # 检查会话是否属于当前用户
         if session["user_id"] != current_user.username:
             raise HTTPException(status_code=403, detail="You don't have permission to delete this session")
-        
-        # 删除会话
-        success = session_service.delete_session(session_id)
-        
-        if not success:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        return SuccessResponse(
-            success=True,
-            message="会话已删除"
-        )
+    
+    if background:
+        # 后台删除，返回202和任务信息，通过 /sessions/deletion_jobs/{job_id} 查询结果
+        job = session_service.start_delete_session_job(session_id, user_id=current_user.username)
+        background_tasks.add_task(session_service.run_delete_session_job, job["job_id"])
+        response.status_code = 202
+        return DeletionJobResponse(**job)
+    
+    # 删除会话
+    success = session_service.delete_session(session_id)
+    
+    if not success:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return SuccessResponse(
+        success=True,
+        message="会话已删除"
+    )
+
+@router.get("/sessions/deletion_jobs/{job_id}", response_model=DeletionJobResponse)
+def get_session_deletion_job(
+    job_id: str,
+    session_service = Depends(get_session_service),
+    current_user: User = Depends(get_current_user)
+):
+    """查询后台删除会话任务的状态"""
+    job = session_service.get_delete_session_job(job_id)
+    if not job or job["user_id"] != current_user.username:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    
+    return DeletionJobResponse(**job)
 
 @router.get("/sessions/{session_id}/tree")
 def get_session_tree(
     session_id: str,
     include_qa: bool = False,
     db: Session = Depends(get_db_session),
+    session_service = Depends(get_session_service),
     current_user: User = Depends(get_current_user)
 ):
     """获取会话树"""
@@ -566,81 +567,25 @@ def get_session_tree(
         if session.user_id != current_user.username:
             raise HTTPException(status_code=403, detail="You don't have permission to access this session")
     
-    # 查询节点
-    query = select(Node).where(Node.session_id == session_id)
-    nodes = db.exec(query).all()
-    
-    # 查询边
-    query = select(Edge).where(Edge.session_id == session_id)
-    edges = db.exec(query).all()
-    
-    # 构建节点数据
-    node_data = []
-    for node in nodes:
-        node_info = {
-            "id": node.id,
-            "template_key": node.template_key,
-            "created_at": node.created_at.isoformat()
-        }
-        
-        # 如果有父节点，添加parent_id字段
-        if node.parent_id:
-            node_info["parent_id"] = node.parent_id
-        
-        # 如果需要包含QA内容
-        if include_qa:
-            # 查询节点的QA对
-            query = select(QAPair).where(QAPair.node_id == node.id).order_by(QAPair.created_at)
-            qa_pairs = db.exec(query).all()
-            
-            if qa_pairs:
-                # 获取第一个QA对
-                qa_pair = qa_pairs[0]
-                
-                # 查询消息
-                query = select(Message).where(Message.qa_pair_id == qa_pair.id)
-                messages = db.exec(query).all()
-                
-                question = None
-                answer = None
-                
-                for message in messages:
-                    if message.role == "user":
-                        question = message.content
-                    elif message.role == "assistant":
-                        answer = message.content
-                
-                # 生成预览
-                if question or answer:
-                    node_info["qa_summary"] = {}
-                    if question:
-                        node_info["qa_summary"]["question_preview"] = question[:100] + ("..." if len(question) > 100 else "")
-                    if answer:
-                        node_info["qa_summary"]["answer_preview"] = answer[:100] + ("..." if len(answer) > 100 else "")
-        
-        node_data.append(node_info)
-    
-    # 构建边数据
-    edge_data = []
-    for edge in edges:
-        edge_data.append({
-            "id": edge.id,
-            "source": edge.source,
-            "target": edge.target
-        })
-    
-    return {
-        "nodes": node_data,
-        "edges": edge_data
-    }
+    # 使用服务层一次性组装节点、边和QA预览
+    return session_service.get_session_tree(session_id, include_qa=include_qa)
 
 @router.get("/sessions/{session_id}/messages", response_model=SessionMessagesResponse)
 def get_session_messages(
     session_id: str,
-    db: Session = Depends(get_db_session),
+    after_timestamp: Optional[datetime] = None,
+    after_seq: Optional[int] = None,
+    after_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_read_session),
     current_user: User = Depends(get_current_user)
 ):
-    """获取会话的所有消息"""
+    """
+    获取会话的所有消息
+    
+    按时间戳升序返回，提供limit时按页返回，下一页以next_after_timestamp、next_after_seq、next_after_id
+    作为after_timestamp、after_seq、after_id
+    """
     # 检查会话是否存在
     session = db.get(SessionModel, session_id)
     if not session:
@@ -650,75 +595,27 @@ def get_session_messages(
     if session.user_id != current_user.username:
         raise HTTPException(status_code=403, detail="You don't have permission to access this session")
     
-    # 获取会话的所有上下文
-    query = select(Context).where(Context.session_id == session_id)
-    contexts = db.exec(query).all()
-    
-    # 收集所有节点ID
-    node_ids = set()
-    
-    # 首先添加会话的根节点
-    if session.root_node_id:
-        node_ids.add(session.root_node_id)
-    
-    # 添加每个上下文的根节点和活动节点
-    for context in contexts:
-        if context.context_root_node_id:
-            node_ids.add(context.context_root_node_id)
-        if context.active_node_id:
-            node_ids.add(context.active_node_id)
-    
-    # 获取上下文中的所有节点
-    for context in contexts:
-        query = select(ContextNode).where(ContextNode.context_id == context.id)
-        context_nodes = db.exec(query).all()
-        for context_node in context_nodes:
-            node_ids.add(context_node.node_id)
-    
-    # 获取会话的所有节点
-    query = select(Node).where(Node.session_id == session_id)
-    nodes = db.exec(query).all()
-    for node in nodes:
-        node_ids.add(node.id)
-    
-    # 获取所有节点的QA对
-    all_messages = []
-    
-    for node_id in node_ids:
-        # 获取节点的QA对
-        query = select(QAPair).where(QAPair.node_id == node_id)
-        qa_pairs = db.exec(query).all()
-        
-        for qa_pair in qa_pairs:
-            # 获取QA对的消息
-            query = select(Message).where(Message.qa_pair_id == qa_pair.id)
-            messages = db.exec(query).all()
-            
-            for message in messages:
-                all_messages.append(MessageResponse(
-                    id=message.id,
-                    session_id=session_id,
-                    parent_id=node_id,
-                    role=message.role,
-                    content=message.content,
-                    timestamp=message.timestamp,
-                    qa_pair_id=qa_pair.id,
-                    tags=qa_pair.tags
-                ))
-    
-    # 按时间戳排序
-    all_messages.sort(key=lambda x: x.timestamp)
-    
-    return SessionMessagesResponse(
-        total=len(all_messages),
-        items=all_messages
+    # 上下文中的节点都属于同一会话，因此直接按会话过滤
+    qa_pair_service = QAPairService(db)
+    timeline = qa_pair_service.get_message_timeline(
+        session_id=session_id,
+        after_timestamp=after_timestamp,
+        after_seq=after_seq,
+        after_id=after_id,
+        limit=limit
     )
+    
+    return _build_messages_response(session_id, timeline)
 
 @router.get("/sessions/{session_id}/context_messages", response_model=SessionMessagesResponse)
 def get_session_context_messages(
     session_id: str,
     context_id: Optional[str] = None,
-    db: Session = Depends(get_db_session),
+    after_timestamp: Optional[datetime] = None,
+    after_seq: Optional[int] = None,
+    after_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_read_session),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -726,6 +623,8 @@ def get_session_context_messages(
     
     如果提供了context_id，则只返回该context的消息
     否则，返回主context（mode='chat'）的消息
+    提供limit时按页返回，下一页以next_after_timestamp、next_after_seq、next_after_id
+    作为after_timestamp、after_seq、after_id
     """
     # 检查会话是否存在
     session = db.get(SessionModel, session_id)
@@ -766,15 +665,12 @@ def get_session_context_messages(
     
     # 获取从根节点到活动节点的路径上的所有节点
     if target_context.context_root_node_id and target_context.active_node_id:
-        # 获取会话的所有节点
-        query = select(Node).where(Node.session_id == session_id)
-        all_nodes = db.exec(query).all()
-        
-        # 创建节点的父节点映射
-        parent_map = {}
-        for node in all_nodes:
-            if node.parent_id:
-                parent_map[node.id] = node.parent_id
+        # 只加载构建父节点映射所需的列
+        query = select(Node.id, Node.parent_id).where(
+            Node.session_id == session_id,
+            Node.parent_id.is_not(None)
+        )
+        parent_map = {node_id: parent_id for node_id, parent_id in db.exec(query).all()}
         
         # 从活动节点开始，向上查找到根节点
         current_id = target_context.active_node_id
@@ -786,37 +682,39 @@ def get_session_context_messages(
             if not current_id:
                 break
     
-    # 获取所有节点的QA对
-    all_messages = []
-    
-    for node_id in node_ids:
-        # 获取节点的QA对
-        query = select(QAPair).where(QAPair.node_id == node_id)
-        qa_pairs = db.exec(query).all()
-        
-        for qa_pair in qa_pairs:
-            # 获取QA对的消息
-            query = select(Message).where(Message.qa_pair_id == qa_pair.id)
-            messages = db.exec(query).all()
-            
-            for message in messages:
-                all_messages.append(MessageResponse(
-                    id=message.id,
-                    session_id=session_id,
-                    parent_id=node_id,
-                    role=message.role,
-                    content=message.content,
-                    timestamp=message.timestamp,
-                    qa_pair_id=qa_pair.id,
-                    tags=qa_pair.tags
-                ))
-    
-    # 按时间戳排序
-    all_messages.sort(key=lambda x: x.timestamp)
+    # 一次查询获取所有节点的消息
+    qa_pair_service = QAPairService(db)
+    timeline = qa_pair_service.get_message_timeline(
+        node_ids=list(node_ids),
+        after_timestamp=after_timestamp,
+        after_seq=after_seq,
+        after_id=after_id,
+        limit=limit
+    )
     
+    return _build_messages_response(session_id, timeline)
+
+def _build_messages_response(session_id: str, timeline: Dict[str, Any]) -> SessionMessagesResponse:
+    """将消息时间线转换为响应模型"""
     return SessionMessagesResponse(
-        total=len(all_messages),
-        items=all_messages
+        total=timeline["total"],
+        items=[
+            MessageResponse(
+                id=item["id"],
+                session_id=session_id,
+                parent_id=item["node_id"],
+                role=item["role"],
+                content=item["content"],
+                timestamp=item["timestamp"],
+                qa_pair_id=item["qa_pair_id"],
+                tags=item["tags"]
+            )
+            for item in timeline["items"]
+        ],
+        has_more=timeline["has_more"],
+        next_after_timestamp=timeline["next_after_timestamp"],
+        next_after_seq=timeline["next_after_seq"],
+        next_after_id=timeline["next_after_id"]
     )
 
 @router.get("/sessions/{session_id}/main_context", response_model=Context)
@@ -1,36 +1,113 @@
 # backend/app/cache/cache_manager.py
-from typing import Dict, Any, Optional, Callable, TypeVar, Generic, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, TypeVar, Generic, List, Tuple, Iterable, Set, Awaitable
+from collections import OrderedDict
+from concurrent.futures import Future
+from os import getenv
+import asyncio
+import functools
+import hashlib
+import heapq
+import inspect
+import json
+import sys
 import threading
 import time
 import logging
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
 T = TypeVar('T')
 
+# 默认容量上限，可通过环境变量调整
+DEFAULT_MAX_ENTRIES = int(getenv("CACHE_MAX_ENTRIES", "10000"))
+DEFAULT_MAX_BYTES = int(getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 数据库会话info中等待提交后失效的标签
+PENDING_TAGS_KEY = "cache_pending_tags"
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    估算对象占用的内存（字节）
+    
+    递归统计常见容器和对象属性，深度有限，只用于容量控制而非精确计量
+    """
+    size = sys.getsizeof(value)
+    if _depth >= 4:
+        return size
+    
+    if isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+            for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, _depth + 1) for item in value)
+    if hasattr(value, "__dict__"):
+        return size + estimate_size(vars(value), _depth + 1)
+    return size
+
 class CacheEntry(Generic[T]):
     """
     缓存条目
     """
-    def __init__(self, value: T, ttl: int = 300):
+    __slots__ = ("value", "expires_at", "stale_until", "size", "tags")
+    
+    def __init__(self, value: T, ttl: int = 300, size: int = 0, tags: Tuple[str, ...] = (),
+                 stale_ttl: int = 0):
         """
         初始化缓存条目
         
         Args:
             value: 缓存值
             ttl: 过期时间（秒）
+            size: 估算的占用字节数
+            tags: 用于批量失效的标签
+            stale_ttl: 过期后仍可作为旧值返回的时间（秒）
         """
         self.value = value
-        self.expires_at = datetime.now() + timedelta(seconds=ttl)
+        self.expires_at = time.monotonic() + ttl
+        self.stale_until = self.expires_at + stale_ttl
+        self.size = size
+        self.tags = tags
     
-    def is_expired(self) -> bool:
+    def is_expired(self, now: Optional[float] = None) -> bool:
         """
         检查缓存是否过期
         """
-        return datetime.now() > self.expires_at
+        return (now if now is not None else time.monotonic()) > self.expires_at
+    
+    def is_stale_expired(self, now: Optional[float] = None) -> bool:
+        """
+        检查旧值保留期是否也已结束
+        """
+        return (now if now is not None else time.monotonic()) > self.stale_until
+
+class _Computation:
+    """
+    get_or_compute 中进行中的一次计算
+    
+    计算期间键被删除或标签被失效时标记为已失效，计算结果仍返回给调用方但不写入缓存
+    """
+    __slots__ = ("tags", "invalidated")
+    
+    def __init__(self, tags: Tuple[str, ...]):
+        self.tags = tags
+        self.invalidated = False
 
 class CacheManager:
     """
     缓存管理器
+    
+    有容量上限（条目数和估算字节数）的LRU缓存。过期时间记录在最小堆中，
+    每次写入时只弹出已到期的堆顶元素，不再需要周期性全量扫描。
+    
+    get_or_compute/aget_or_compute 提供单飞（single-flight）语义：同一个键同时未命中时
+    只有第一个调用方执行计算，其余调用方等待同一结果；设置了stale_ttl时，
+    其余调用方直接拿到过期的旧值而无需等待。计算期间该键被删除或其标签被失效时，
+    计算结果只返回给调用方，不写入缓存。
     """
     _instance = None
     _lock = threading.Lock()
@@ -52,14 +129,41 @@ class CacheManager:
         if self._initialized:
             return
         
-        self._cache: Dict[str, CacheEntry] = {}
+        # 按访问顺序排列，最久未使用的在最前
+        self._cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # (过期时间, 键) 最小堆；键被覆盖或删除后堆中的旧记录在弹出时校验并丢弃
+        self._expiry_heap: List[Tuple[float, str]] = []
+        # 标签 -> 键集合，用于按标签失效
+        self._tag_index: Dict[str, Set[str]] = {}
+        # 正在计算中的键 -> Future（同步和异步调用分开记录）
+        self._inflight: Dict[str, Future] = {}
+        self._async_inflight: Dict[str, asyncio.Future] = {}
+        # 正在计算中的键 -> 计算列表，用于在计算期间发生失效时放弃写入
+        self._computations: Dict[str, List[_Computation]] = {}
         self._lock = threading.Lock()
-        self._cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
-        self._cleanup_thread.start()
+        self._max_entries = DEFAULT_MAX_ENTRIES
+        self._max_bytes = DEFAULT_MAX_BYTES
+        self._current_bytes = 0
+        self._reset_stats()
         self._initialized = True
         
         logging.info("Cache manager initialized")
     
+    def configure(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        """
+        调整容量上限，超出部分立即按LRU淘汰
+        
+        Args:
+            max_entries: 最大条目数
+            max_bytes: 最大估算字节数
+        """
+        with self._lock:
+            if max_entries is not None:
+                self._max_entries = max_entries
+            if max_bytes is not None:
+                self._max_bytes = max_bytes
+            self._evict_overflow()
+    
     def get(self, key: str) -> Optional[Any]:
         """
         获取缓存值
@@ -71,17 +175,120 @@ class CacheManager:
             缓存值，如果不存在或已过期则返回None
         """
         with self._lock:
-            if key not in self._cache:
-                return None
+            value, fresh = self._lookup(key)
+            if fresh:
+                self._hits += 1
+                return value
+            
+            self._misses += 1
+            return None
+    
+    def get_or_compute(self, key: str, compute: Callable[[], T], ttl: int = 300,
+                       tags: Optional[Iterable[str]] = None, stale_ttl: int = 0) -> T:
+        """
+        获取缓存值，未命中时由第一个调用方计算，并发的其他调用方共享该结果
+        
+        Args:
+            key: 缓存键
+            compute: 计算缓存值的函数，返回None时不缓存
+            ttl: 过期时间（秒）
+            tags: 标签列表
+            stale_ttl: 过期后仍可返回旧值的时间（秒），刷新期间其他调用方直接得到旧值
+        
+        Returns:
+            缓存值或计算结果
+        """
+        with self._lock:
+            value, fresh = self._lookup(key)
+            if fresh:
+                self._hits += 1
+                return value
             
-            entry = self._cache[key]
-            if entry.is_expired():
-                del self._cache[key]
-                return None
+            future = self._inflight.get(key)
+            if future is not None and value is not None:
+                # 已有调用方在刷新，直接返回旧值
+                self._stale_hits += 1
+                return value
             
-            return entry.value
+            self._misses += 1
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                computation = self._begin_compute(key, tags)
+            else:
+                self._coalesced += 1
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            result = compute()
+            if result is not None:
+                self._set_computed(key, computation, result, ttl, stale_ttl)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._end_compute(key, computation)
     
-    def set(self, key: str, value: Any, ttl: int = 300) -> None:
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[T]], ttl: int = 300,
+                              tags: Optional[Iterable[str]] = None, stale_ttl: int = 0) -> T:
+        """
+        get_or_compute 的异步版本，compute 返回可等待对象
+        """
+        loop = asyncio.get_running_loop()
+        
+        with self._lock:
+            value, fresh = self._lookup(key)
+            if fresh:
+                self._hits += 1
+                return value
+            
+            future = self._async_inflight.get(key)
+            if future is not None and future.get_loop() is not loop:
+                # 其他事件循环中的计算无法在这里等待
+                future = None
+            if future is not None and value is not None:
+                self._stale_hits += 1
+                return value
+            
+            self._misses += 1
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self._async_inflight[key] = future
+                computation = self._begin_compute(key, tags)
+            else:
+                self._coalesced += 1
+        
+        if not leader:
+            # shield：某个等待方被取消时不影响共享的计算结果
+            return await asyncio.shield(future)
+        
+        try:
+            result = await compute()
+            if result is not None:
+                self._set_computed(key, computation, result, ttl, stale_ttl)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待方时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                if self._async_inflight.get(key) is future:
+                    del self._async_inflight[key]
+                self._end_compute(key, computation)
+    
+    def set(self, key: str, value: Any, ttl: int = 300, tags: Optional[Iterable[str]] = None,
+            stale_ttl: int = 0) -> None:
         """
         设置缓存值
         
@@ -89,9 +296,13 @@ class CacheManager:
             key: 缓存键
             value: 缓存值
             ttl: 过期时间（秒）
+            tags: 标签列表，可通过invalidate_tags批量删除
+            stale_ttl: 过期后仍可作为旧值返回的时间（秒），仅用于get_or_compute
         """
+        size = estimate_size(key) + estimate_size(value)
+        
         with self._lock:
-            self._cache[key] = CacheEntry(value, ttl)
+            self._store(key, value, ttl, size, tuple(tags or ()), stale_ttl)
     
     def delete(self, key: str) -> None:
         """
@@ -101,59 +312,270 @@ class CacheManager:
             key: 缓存键
         """
         with self._lock:
+            self._invalidate_computations(lambda computation_key, computation: computation_key == key)
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
+    
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        删除带有任一指定标签的缓存值
+        
+        Args:
+            tags: 标签，如 session:{id}、user:{username}:sessions
+        
+        Returns:
+            删除的条目数
+        """
+        with self._lock:
+            tag_set = set(tags)
+            self._invalidate_computations(lambda _, computation: not tag_set.isdisjoint(computation.tags))
+            keys = set()
+            for tag in tags:
+                keys.update(self._tag_index.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+    
+    def invalidate_tags_after_commit(self, db: OrmSession, *tags: str) -> None:
+        """
+        在数据库会话提交后删除带有任一指定标签的缓存值，会话回滚时不删除
+        
+        用于只flush不提交的写操作：提交前就失效的话，并发请求可能读到未提交前的数据并重新写入缓存
+        
+        Args:
+            db: 数据库会话
+            tags: 标签
+        """
+        db.info.setdefault(PENDING_TAGS_KEY, set()).update(tags)
     
     def clear(self) -> None:
         """
         清空缓存
         """
         with self._lock:
+            self._invalidate_computations(lambda _, computation: True)
             self._cache.clear()
+            self._expiry_heap.clear()
+            self._tag_index.clear()
+            self._current_bytes = 0
     
-    def _cleanup_expired(self) -> None:
+    def stats(self) -> Dict[str, Any]:
         """
-        清理过期缓存
+        获取缓存统计信息，用于监控
         """
-        while True:
-            time.sleep(60)  # 每分钟清理一次
-            with self._lock:
-                expired_keys = [key for key, entry in self._cache.items() if entry.is_expired()]
-                for key in expired_keys:
-                    del self._cache[key]
-                
-                if expired_keys:
-                    logging.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._cache),
+                "bytes": self._current_bytes,
+                "max_entries": self._max_entries,
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "stale_hits": self._stale_hits,
+                "coalesced": self._coalesced
+            }
+    
+    def reset_stats(self) -> None:
+        """
+        重置统计计数
+        """
+        with self._lock:
+            self._reset_stats()
+    
+    def _reset_stats(self) -> None:
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._stale_hits = 0
+        self._coalesced = 0
+    
+    def _lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        查找条目（调用方需持有锁）
+        
+        Returns:
+            (值, 是否未过期)；过期但仍在旧值保留期内时返回旧值和False
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None, False
+        
+        now = time.monotonic()
+        if not entry.is_expired(now):
+            self._cache.move_to_end(key)
+            return entry.value, True
+        
+        if entry.is_stale_expired(now):
+            self._remove(key)
+            self._expirations += 1
+            return None, False
+        
+        return entry.value, False
+    
+    def _store(self, key: str, value: Any, ttl: int, size: int, tags: Tuple[str, ...],
+               stale_ttl: int) -> None:
+        """写入条目（调用方需持有锁）"""
+        self._purge_expired()
+        
+        if key in self._cache:
+            self._remove(key)
+        
+        # 单个值超过总容量时不缓存
+        if size > self._max_bytes:
+            return
+        
+        entry = CacheEntry(value, ttl, size, tags, stale_ttl)
+        self._cache[key] = entry
+        self._current_bytes += size
+        for tag in entry.tags:
+            self._tag_index.setdefault(tag, set()).add(key)
+        heapq.heappush(self._expiry_heap, (entry.stale_until, key))
+        
+        self._evict_overflow()
+    
+    def _set_computed(self, key: str, computation: _Computation, value: Any, ttl: int,
+                      stale_ttl: int) -> None:
+        """写入计算结果；计算期间发生过失效时不写入，避免用失效前读到的数据覆盖缓存"""
+        size = estimate_size(key) + estimate_size(value)
+        
+        with self._lock:
+            self._end_compute(key, computation)
+            if not computation.invalidated:
+                self._store(key, value, ttl, size, computation.tags, stale_ttl)
+    
+    def _begin_compute(self, key: str, tags: Optional[Iterable[str]]) -> _Computation:
+        """登记一次计算（调用方需持有锁）"""
+        computation = _Computation(tuple(tags or ()))
+        self._computations.setdefault(key, []).append(computation)
+        return computation
+    
+    def _end_compute(self, key: str, computation: _Computation) -> None:
+        """移除计算的登记，可重复调用（调用方需持有锁）"""
+        computations = self._computations.get(key)
+        if computations is None or computation not in computations:
+            return
+        computations.remove(computation)
+        if not computations:
+            del self._computations[key]
+    
+    def _invalidate_computations(self, predicate: Callable[[str, _Computation], bool]) -> None:
+        """把满足条件的进行中计算标记为已失效（调用方需持有锁）"""
+        for key, computations in self._computations.items():
+            for computation in computations:
+                if predicate(key, computation):
+                    computation.invalidated = True
+    
+    def _remove(self, key: str) -> None:
+        """删除条目并更新字节计数和标签索引（调用方需持有锁）"""
+        entry = self._cache.pop(key)
+        self._current_bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+    
+    def _purge_expired(self) -> None:
+        """
+        弹出堆顶所有已过期的条目（调用方需持有锁）
+        
+        堆中可能残留已被覆盖或删除的键，只有过期时间一致时才删除
+        """
+        now = time.monotonic()
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            stale_until, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            if entry is not None and entry.stale_until == stale_until:
+                self._remove(key)
+                self._expirations += 1
+        
+        # 残留记录过多时重建堆，避免无限增长
+        if len(heap) > 2 * len(self._cache) + 64:
+            self._expiry_heap = [(entry.stale_until, key) for key, entry in self._cache.items()]
+            heapq.heapify(self._expiry_heap)
+    
+    def _evict_overflow(self) -> None:
+        """按LRU顺序淘汰超出容量的条目（调用方需持有锁）"""
+        while self._cache and (len(self._cache) > self._max_entries or self._current_bytes > self._max_bytes):
+            key = next(iter(self._cache))
+            self._remove(key)
+            self._evictions += 1
 
 # 创建全局缓存管理器
 cache_manager = CacheManager()
 
-def cached(ttl: int = 300):
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_pending_tags(session: OrmSession) -> None:
+    """会话提交后失效 invalidate_tags_after_commit 登记的标签"""
+    tags = session.info.pop(PENDING_TAGS_KEY, None)
+    if tags:
+        cache_manager.invalidate_tags(*tags)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_pending_tags(session: OrmSession) -> None:
+    """会话回滚后数据未变，丢弃登记的标签"""
+    session.info.pop(PENDING_TAGS_KEY, None)
+
+def make_cache_key(func: Callable, arguments: Dict[str, Any]) -> str:
+    """
+    根据函数和参数生成稳定的缓存键
+    
+    参数以排序后的JSON序列化再取哈希，与调用方式（位置参数或关键字参数）无关
+    """
+    payload = json.dumps(arguments, sort_keys=True, default=str, ensure_ascii=False)
+    digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    return f"{func.__module__}.{func.__qualname__}:{digest}"
+
+def cached(ttl: int = 300, tags: Iterable[str] = (), stale_ttl: int = 0):
     """
     缓存装饰器
     
+    生成缓存键时忽略self/cls，因此每个请求新建的服务实例可以共享缓存。
+    被装饰的函数应返回可序列化的普通数据（dict、list等），而不是绑定到数据库会话的ORM对象。
+    返回None的结果不缓存。同步和异步函数都支持，并发未命中时只计算一次。
+    
     Args:
         ttl: 过期时间（秒）
+        tags: 标签模板，使用函数参数格式化，如 "session:{session_id}"
+        stale_ttl: 过期后仍可返回旧值的时间（秒），刷新期间并发调用方直接得到旧值
     
     Returns:
         装饰器函数
     """
     def decorator(func: Callable):
+        signature = inspect.signature(func)
+        
+        def resolve(args, kwargs) -> Tuple[str, List[str]]:
+            # 绑定参数并补全默认值，忽略self/cls
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                name: value for name, value in bound.arguments.items()
+                if name not in ("self", "cls")
+            }
+            return make_cache_key(func, arguments), [tag.format(**arguments) for tag in tags]
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key, key_tags = resolve(args, kwargs)
+                return await cache_manager.aget_or_compute(
+                    key, lambda: func(*args, **kwargs), ttl, tags=key_tags, stale_ttl=stale_ttl
+                )
+            return async_wrapper
+        
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # 生成缓存键
-            key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
-            
-            # 尝试从缓存获取
-            cached_value = cache_manager.get(key)
-            if cached_value is not None:
-                return cached_value
-            
-            # 调用原函数
-            result = func(*args, **kwargs)
-            
-            # 缓存结果
-            cache_manager.set(key, result, ttl)
-            
-            return result
+            key, key_tags = resolve(args, kwargs)
+            return cache_manager.get_or_compute(
+                key, lambda: func(*args, **kwargs), ttl, tags=key_tags, stale_ttl=stale_ttl
+            )
         return wrapper
     return decorator
@@ -1 +1,3 @@
-from .database import engine, init_db, get_session
+from .database import engine, read_engine, init_db, get_session, get_read_session
+from .async_database import get_async_session, get_optional_async_session, get_async_engine, dispose_async_engine
+from .fts import ensure_message_fts, rebuild_message_fts, vacuum_database
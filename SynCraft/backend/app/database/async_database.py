@@ -0,0 +1,101 @@
+# backend/app/database/async_database.py
+"""
+可选的异步数据库引擎
+
+供读多写少的路由使用：查询在事件循环中等待数据库，不占用线程池线程。
+异步驱动是可选依赖（SQLite 使用 aiosqlite，PostgreSQL 使用 asyncpg）。
+使用 get_optional_async_session 的路由在驱动未安装时退回同步只读会话，
+直接使用 get_async_session 的路由才必须安装。
+"""
+import os
+from importlib.util import find_spec
+from typing import AsyncGenerator, Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import READ_DATABASE_URL, configure_engine, engine_options
+
+# 同步驱动到异步驱动的映射
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    """把同步连接URL转换为对应的异步驱动URL，已经是异步驱动时原样返回"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"不支持的异步数据库类型: {backend}")
+    
+    driver = parsed.get_driver_name()
+    if driver in ("aiosqlite", "asyncpg", "psycopg"):
+        return url
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+# 异步连接URL，未设置时由只读连接URL推导
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+_async_engine: Optional[AsyncEngine] = None
+
+def async_driver_available() -> bool:
+    """异步连接URL对应的驱动是否已安装"""
+    try:
+        url = ASYNC_DATABASE_URL or to_async_url(READ_DATABASE_URL)
+    except ValueError:
+        return False
+    return find_spec(make_url(url).get_driver_name()) is not None
+
+def create_db_async_engine(url: str, read_only: bool = True, **pool_options) -> AsyncEngine:
+    """
+    创建异步引擎，连接初始化逻辑（PRAGMA、只读）与同步引擎一致
+    
+    Args:
+        url: 异步驱动的连接URL
+        read_only: 是否为只读引擎
+        pool_options: 连接池参数（pool_size、max_overflow、pool_timeout）
+    """
+    try:
+        async_engine = create_async_engine(url, **engine_options(url, **pool_options))
+    except ImportError as e:
+        raise RuntimeError(f"异步数据库驱动未安装（{url.split(':', 1)[0]}）: {e}")
+    configure_engine(async_engine.sync_engine, read_only=read_only)
+    return async_engine
+
+def get_async_engine() -> AsyncEngine:
+    """获取全局异步引擎，首次使用时创建"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_db_async_engine(ASYNC_DATABASE_URL or to_async_url(READ_DATABASE_URL))
+    return _async_engine
+
+async def dispose_async_engine() -> None:
+    """关闭异步引擎的连接池（应用关闭时调用）"""
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    异步只读会话依赖项
+    
+    复用同步服务代码时可以使用 await session.run_sync(...)，
+    传入的是普通的 sqlmodel Session
+    """
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+async def get_optional_async_session() -> AsyncGenerator[Optional[AsyncSession], None]:
+    """
+    异步只读会话依赖项，异步驱动未安装时返回None
+    
+    路由收到None时应改用 get_read_session 提供的同步只读会话
+    """
+    if not async_driver_available():
+        yield None
+        return
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,154 @@
+# backend/app/database/fts.py
+"""
+消息内容全文索引（SQLite FTS5）
+
+message_fts 是以 message 表为外部内容的 FTS5 虚拟表，使用 trigram 分词器，
+因此中文等不以空格分词的文本也能按子串检索。索引通过触发器与 message 表保持同步，
+无论是服务层逐条写入还是批量 DELETE 都不会遗漏。
+
+索引行通过 message 表的隐式 rowid 关联到消息。message 的主键是字符串，没有 INTEGER PRIMARY KEY
+别名列，SQLite 不保证 VACUUM 前后隐式 rowid 不变；rowid 变化后索引会指向错误的消息。
+因此整理数据库时应使用 vacuum_database，它在 VACUUM 之后重建全文索引；
+用其他工具执行过 VACUUM 的数据库，可以调用 rebuild_message_fts 修复。
+"""
+from sqlalchemy import DDL, event, text, func, literal_column, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select, table, column
+
+from app.models.message import Message
+
+FTS_TABLE = "message_fts"
+
+# trigram 分词器要求检索词至少包含3个字符
+FTS_MIN_QUERY_LENGTH = 3
+
+_CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content,
+        content='message',
+        content_rowid='rowid',
+        tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content);
+    END
+    """,
+]
+
+_DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS message_fts_ai",
+    "DROP TRIGGER IF EXISTS message_fts_ad",
+    "DROP TRIGGER IF EXISTS message_fts_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# 供查询使用的虚拟表结构
+message_fts = table(FTS_TABLE, column("rowid"), column("content"), column("rank"))
+
+# message 表随 metadata.create_all/drop_all 创建或删除时，同步维护全文索引
+for _statement in _CREATE_STATEMENTS:
+    event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+for _statement in _DROP_STATEMENTS:
+    event.listen(Message.__table__, "before_drop", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def fts_available(bind) -> bool:
+    """检查当前连接是否可以使用消息全文索引"""
+    if bind.dialect.name != "sqlite":
+        return False
+
+    result = bind.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE}
+    ).first()
+    return result is not None
+
+
+def ensure_message_fts(engine: Engine) -> None:
+    """
+    为已有数据库补建全文索引
+
+    message 表已存在时 create_all 不会触发 after_create，这里补建虚拟表和触发器，
+    并在首次创建时根据现有消息重建索引。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    with engine.begin() as conn:
+        existed = fts_available(conn)
+        for statement in _CREATE_STATEMENTS:
+            conn.execute(text(statement))
+        if not existed:
+            rebuild_message_fts(conn)
+
+
+def rebuild_message_fts(bind) -> None:
+    """根据 message 表的当前内容和 rowid 重建全文索引"""
+    if bind.dialect.name != "sqlite":
+        return
+
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            rebuild_message_fts(conn)
+        return
+
+    if fts_available(bind):
+        bind.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def vacuum_database(engine: Engine) -> None:
+    """
+    整理SQLite数据库文件（VACUUM）
+
+    VACUUM 可能重新编号没有 INTEGER PRIMARY KEY 的表的隐式 rowid，之后重建依赖 rowid 的全文索引
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    # VACUUM 不能在事务中执行
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+    rebuild_message_fts(engine)
+
+
+def build_match_query(query: str) -> str:
+    """将用户输入转换为FTS5短语查询，避免特殊字符被解析为查询语法"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def match_qa_pairs(query: str) -> Select:
+    """
+    构建全文检索子查询
+
+    返回每个命中的QA对ID及其最佳BM25得分（得分越小越相关）
+    """
+    fts = literal_column(FTS_TABLE)
+    # 隐藏列 rank 默认即 bm25() 得分，且可以在子查询和聚合中使用
+    scored = (
+        select(message_fts.c.rowid.label("rowid"), message_fts.c.rank.label("score"))
+        .where(fts.op("MATCH")(build_match_query(query)))
+        .subquery()
+    )
+    return (
+        select(
+            Message.qa_pair_id.label("qa_pair_id"),
+            func.min(scored.c.score).label("rank")
+        )
+        .select_from(Message)
+        .join(scored, scored.c.rowid == literal_column("message.rowid"))
+        .group_by(Message.qa_pair_id)
+    )
@@ -1,8 +1,9 @@
 # backend/app/di/container.py
-from typing import Dict, Type, TypeVar, Generic, Optional, Callable, Any
+from typing import Dict, Type, TypeVar, Generic, Optional, Callable, Any, Tuple
+from enum import Enum
+import threading
 from sqlmodel import Session
 
-from app.database import get_session
 from app.services.session_service import SessionService
 from app.services.node_service import NodeService
 from app.services.context_service import ContextService
@@ -12,37 +13,101 @@ from app.services.llm.llm_interface import LLMServiceInterface
 
 T = TypeVar('T')
 
+class Lifetime(str, Enum):
+    """
+    服务生命周期
+    """
+    # 整个进程共享一个实例，不能依赖请求的数据库会话
+    SINGLETON = "singleton"
+    # 每个请求（作用域）一个实例，使用该请求的数据库会话
+    SCOPED = "scoped"
+    # 每次解析都创建新实例
+    TRANSIENT = "transient"
+
+class Scope:
+    """
+    服务作用域，对应一次请求，持有该请求的数据库会话和作用域内的服务实例
+    """
+    def __init__(self, container: "Container", db: Optional[Session] = None):
+        self.container = container
+        self.db = db
+        self._instances: Dict[Type[Any], Any] = {}
+    
+    def resolve(self, service_type: Type[T]) -> T:
+        """
+        在当前作用域中解析服务实例
+        """
+        factory, lifetime = self.container.get_registration(service_type)
+        
+        if lifetime == Lifetime.SINGLETON:
+            return self.container.resolve(service_type)
+        
+        if lifetime == Lifetime.TRANSIENT:
+            return factory(self)
+        
+        # 作用域内复用同一个实例
+        if service_type not in self._instances:
+            self._instances[service_type] = factory(self)
+        return self._instances[service_type]
+    
+    def close(self) -> None:
+        """
+        结束作用域，释放作用域内的服务实例
+        """
+        self._instances.clear()
+        self.db = None
+
 class Container:
     """
     依赖注入容器，用于管理服务实例
+    
+    工厂函数接收当前作用域（Scope），作用域内和临时服务通过 scope.db 获取本次请求的数据库会话；
+    单例服务的工厂函数在没有作用域时调用，会收到None。
     """
     def __init__(self):
-        self._services: Dict[Type[T], Callable[[], T]] = {}
-        self._instances: Dict[Type[T], T] = {}
+        self._services: Dict[Type[Any], Tuple[Callable[[Optional[Scope]], Any], Lifetime]] = {}
+        self._instances: Dict[Type[Any], Any] = {}
+        self._lock = threading.Lock()
     
-    def register(self, service_type: Type[T], factory: Callable[[], T]) -> None:
+    def register(self, service_type: Type[T], factory: Callable[[Optional[Scope]], T],
+                 lifetime: Lifetime = Lifetime.SINGLETON) -> None:
         """
         注册服务工厂函数
         """
-        self._services[service_type] = factory
+        self._services[service_type] = (factory, lifetime)
+        self._instances.pop(service_type, None)
     
-    def resolve(self, service_type: Type[T]) -> T:
+    def get_registration(self, service_type: Type[T]) -> Tuple[Callable[[Optional[Scope]], T], Lifetime]:
         """
-        解析服务实例
+        获取服务的工厂函数和生命周期
         """
-        # 如果已经有实例，直接返回
-        if service_type in self._instances:
-            return self._instances[service_type]
-        
         # 如果没有注册工厂函数，抛出异常
         if service_type not in self._services:
             raise ValueError(f"Service {service_type.__name__} not registered")
+        return self._services[service_type]
+    
+    def resolve(self, service_type: Type[T]) -> T:
+        """
+        解析单例服务实例；作用域内服务需要通过 Scope.resolve 解析
+        """
+        factory, lifetime = self.get_registration(service_type)
         
-        # 创建实例
-        instance = self._services[service_type]()
-        self._instances[service_type] = instance
+        if lifetime != Lifetime.SINGLETON:
+            raise ValueError(f"Service {service_type.__name__} is {lifetime.value}, resolve it from a scope")
         
-        return instance
+        # 如果已经有实例，直接返回
+        if service_type not in self._instances:
+            with self._lock:
+                if service_type not in self._instances:
+                    self._instances[service_type] = factory(None)
+        
+        return self._instances[service_type]
+    
+    def create_scope(self, db: Optional[Session] = None) -> Scope:
+        """
+        创建服务作用域
+        """
+        return Scope(self, db)
     
     def reset(self) -> None:
         """
@@ -54,47 +119,55 @@ class Container:
 container = Container()
 
 # 注册服务
-def register_services(db_session: Optional[Session] = None) -> None:
+def register_services() -> None:
     """
     注册服务
     """
-    # 获取数据库会话
-    session = db_session or next(get_session())
-    
-    # 注册服务
-    container.register(SessionService, lambda: SessionService(session))
-    container.register(NodeService, lambda: NodeService(session))
-    container.register(ContextService, lambda: ContextService(session))
-    container.register(QAPairService, lambda: QAPairService(session))
-    container.register(LLMServiceInterface, get_llm_service)
+    # 数据库相关服务每个请求一个实例，使用请求自己的数据库会话
+    container.register(SessionService, lambda scope: SessionService(scope.db), Lifetime.SCOPED)
+    container.register(NodeService, lambda scope: NodeService(scope.db), Lifetime.SCOPED)
+    container.register(ContextService, lambda scope: ContextService(scope.db), Lifetime.SCOPED)
+    container.register(QAPairService, lambda scope: QAPairService(scope.db), Lifetime.SCOPED)
+    # LLM服务无状态，持有共享的HTTP连接池
+    container.register(LLMServiceInterface, lambda scope: get_llm_service(), Lifetime.SINGLETON)
 
 # 服务依赖项
 from fastapi import Depends
 from app.database import get_session as get_db_session
 
-def get_session_service(db: Session = Depends(get_db_session)) -> SessionService:
+def get_scope(db: Session = Depends(get_db_session)):
+    """
+    获取当前请求的服务作用域（同一请求内的依赖项共享同一个作用域和数据库会话）
+    """
+    scope = container.create_scope(db)
+    try:
+        yield scope
+    finally:
+        scope.close()
+
+def get_session_service(scope: Scope = Depends(get_scope)) -> SessionService:
     """
     获取会话服务（每次请求独立的 session）
     """
-    return SessionService(db)
+    return scope.resolve(SessionService)
 
-def get_node_service() -> NodeService:
+def get_node_service(scope: Scope = Depends(get_scope)) -> NodeService:
     """
     获取节点服务
     """
-    return container.resolve(NodeService)
+    return scope.resolve(NodeService)
 
-def get_context_service() -> ContextService:
+def get_context_service(scope: Scope = Depends(get_scope)) -> ContextService:
     """
     获取上下文服务
     """
-    return container.resolve(ContextService)
+    return scope.resolve(ContextService)
 
-def get_qa_pair_service() -> QAPairService:
+def get_qa_pair_service(scope: Scope = Depends(get_scope)) -> QAPairService:
     """
     获取问答对服务
     """
-    return container.resolve(QAPairService)
+    return scope.resolve(QAPairService)
 
 def get_llm_service_instance() -> LLMServiceInterface:
     """
@@ -3,12 +3,12 @@ from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
-import json
-from starlette.middleware.base import BaseHTTPMiddleware
 # backend/app/main.py
 
 # 导入API路由
 from app.api import api_router
+from app.utils.responses import EnvelopeJSONResponse
+from app.services.llm.response_cache import LLMCacheBypassMiddleware
 
 # 初始化数据库
 from app.database import init_db
@@ -33,39 +33,8 @@ with SQLSession(engine) as db:
         print("已自动初始化默认会话")
 
 # 创建FastAPI应用
-app = FastAPI(title="SynCraft API")
-
-# 统一响应格式中间件
-class UnifiedResponseMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # 调用下一个中间件或路由处理函数
-        response = await call_next(request)
-        
-        # 如果响应已经是JSONResponse
-        if isinstance(response, JSONResponse):
-            # 获取响应内容
-            content = response.body
-            
-            # 解析JSON内容
-            try:
-                data = json.loads(content)
-                
-                # 如果已经是统一格式，直接返回
-                if isinstance(data, dict) and "success" in data and ("data" in data or "error" in data):
-                    return response
-                
-                # 否则包装为统一格式
-                return JSONResponse(
-                    content={"success": True, "data": data},
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                )
-            except:
-                # 如果不是有效的JSON，直接返回原响应
-                return response
-        
-        # 如果不是JSONResponse，直接返回原响应
-        return response
+# 统一响应格式在序列化时生成（见 EnvelopeJSONResponse），不再通过中间件重新解析响应体
+app = FastAPI(title="SynCraft API", default_response_class=EnvelopeJSONResponse)
 
 # 配置CORS
 app.add_middleware(
@@ -76,11 +45,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 添加统一响应格式中间件 - 确保在所有其他中间件之后添加，这样它会最先执行
-app.add_middleware(UnifiedResponseMiddleware)
-
-# 打印日志，确认中间件已添加
-print("已添加统一响应格式中间件")
+# 请求头 X-LLM-Cache: bypass 时本次请求跳过LLM回答缓存
+app.add_middleware(LLMCacheBypassMiddleware)
 
 # 注册API路由
 app.include_router(api_router)  # 所有API路由，包括新的LLM路由
@@ -101,6 +67,17 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"success": False, "error": str(exc)},
     )
 
+# 应用关闭时释放LLM服务和异步数据库引擎的连接池
+@app.on_event("shutdown")
+async def shutdown_connection_pools():
+    from app.services.llm import LLMServiceFactory
+    from app.database import dispose_async_engine
+    from app.services.summary_service import summary_worker
+    # 等待已入队的摘要任务完成
+    summary_worker.stop()
+    await LLMServiceFactory.shutdown()
+    await dispose_async_engine()
+
 # 健康检查
 @app.get("/health", tags=["health"])
 def health():
@@ -1,4 +1,5 @@
 from .node import Node
+from .node_closure import NodeClosure
 from .session import Session
 from .edge import Edge
 from .context import Context
@@ -1,10 +1,15 @@
 # backend/app/models/message.py
 from datetime import datetime
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, JSON, Index
 from nanoid import generate
 
 class Message(SQLModel, table=True):
+    # 复合索引：按QA对获取消息并按顺序号排序
+    __table_args__ = (
+        Index("ix_message_qa_pair_id_seq", "qa_pair_id", "seq"),
+    )
+    
     # 消息的唯一标识符
     id: str = Field(default_factory=generate, primary_key=True, index=True)
     
@@ -17,6 +22,9 @@ class Message(SQLModel, table=True):
     # 消息内容
     content: str
     
+    # 消息在QA对中的顺序号，从0开始；同一事务中写入的消息时间戳可能相同，按顺序号排序
+    seq: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    
     # 消息创建时间
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     
@@ -0,0 +1,19 @@
+# backend/app/models/node_closure.py
+from sqlmodel import SQLModel, Field
+
+class NodeClosure(SQLModel, table=True):
+    """
+    节点祖先关系闭包表
+    
+    每个节点与它自身及每个祖先各有一行，祖先、后代、深度和子树大小都可以用一次索引查询得到。
+    """
+    __tablename__ = "node_closure"
+    
+    # 祖先节点ID（包括节点自身）
+    ancestor_id: str = Field(foreign_key="node.id", primary_key=True)
+    
+    # 后代节点ID
+    descendant_id: str = Field(foreign_key="node.id", primary_key=True, index=True)
+    
+    # 后代相对祖先的层数，节点自身为0
+    depth: int = 0
@@ -1,10 +1,16 @@
 # backend/app/models/qapair.py
 from datetime import datetime
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, JSON, Index
 from nanoid import generate
 
 class QAPair(SQLModel, table=True):
+    # 复合索引：按会话/节点过滤并按创建时间排序的搜索和列表查询
+    __table_args__ = (
+        Index("ix_qapair_session_id_created_at", "session_id", "created_at"),
+        Index("ix_qapair_node_id_created_at", "node_id", "created_at"),
+    )
+    
     # QA对的唯一标识符
     id: str = Field(default_factory=generate, primary_key=True, index=True)
     
@@ -15,7 +21,7 @@ class QAPair(SQLModel, table=True):
     session_id: str = Field(foreign_key="session.id", index=True)
     
     # QA对的创建时间
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     
     # QA对的更新时间
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -35,5 +41,8 @@ class QAPair(SQLModel, table=True):
     # 查看次数
     view_count: int = 0
     
+    # 提问请求的幂等键（请求头 Idempotency-Key），重试的请求返回已保存的QA对
+    idempotency_key: str | None = Field(default=None, index=True, unique=True)
+    
     # 扩展字段，JSON格式，用于存储额外信息
     ext: dict = Field(sa_column=Column(JSON, default=dict))
@@ -0,0 +1,36 @@
+# backend/app/scripts/backfill_node_closure.py
+"""
+为已有数据库补建节点祖先关系闭包表
+
+闭包表在创建节点时维护；在引入闭包表之前创建的节点需要运行一次本脚本。
+脚本会清空闭包表后根据父节点指针重新生成，可以重复运行。
+
+用法: python -m app.scripts.backfill_node_closure
+"""
+import argparse
+
+from sqlmodel import SQLModel, Session, select, func
+
+from app.database.database import engine
+from app.models.node import Node
+from app.models.node_closure import NodeClosure
+from app.services.node_service import NodeService
+
+def backfill_node_closure(max_depth=10000):
+    """重建闭包表"""
+    print("开始重建节点闭包表...")
+    
+    # 确保闭包表存在
+    SQLModel.metadata.create_all(engine, tables=[NodeClosure.__table__])
+    
+    with Session(engine) as db:
+        node_count = db.exec(select(func.count()).select_from(Node)).one()
+        row_count = NodeService(db).rebuild_node_closure(max_depth)
+        print(f"节点数: {node_count}, 闭包表记录数: {row_count}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为已有数据库补建节点闭包表")
+    parser.add_argument("--max-depth", type=int, default=10000, help="最大深度，防止父节点指针成环时无限递归")
+    
+    args = parser.parse_args()
+    backfill_node_closure(args.max_depth)
@@ -0,0 +1,101 @@
+# backend/app/scripts/bench_llm_client.py
+"""
+LLM客户端连接复用基准测试
+
+在本地启动一个模拟OpenRouter接口的HTTP服务器，分别测量：
+- 每次请求新建 httpx.Client（旧实现）
+- RealLLMService 复用的连接池
+
+本地服务器没有TLS，测得的只是TCP建连和客户端构造的开销，真实环境中省下的TLS握手会更多。
+
+用法: python -m app.scripts.bench_llm_client --requests 200
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+RESPONSE_BODY = json.dumps({
+    "choices": [{"message": {"role": "assistant", "content": "ok"}}]
+}).encode("utf-8")
+
+class StubHandler(BaseHTTPRequestHandler):
+    """返回固定补全结果的处理器，支持keep-alive"""
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭Nagle算法避免延迟确认带来的固定等待
+    disable_nagle_algorithm = True
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_server():
+    """在后台线程启动模拟服务器，返回(server, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+
+def bench_fresh_client(url, payload, count):
+    """每次请求都新建客户端（旧实现）"""
+    start = time.perf_counter()
+    for _ in range(count):
+        with httpx.Client(timeout=60) as client:
+            resp = client.post(url, json=payload)
+            resp.raise_for_status()
+            resp.json()
+    return time.perf_counter() - start
+
+def bench_pooled_service(url, count):
+    """使用RealLLMService复用的连接池"""
+    from app.services.llm.real_llm_service import RealLLMService
+    
+    service = RealLLMService()
+    service.llm_config["api_url"] = url
+    try:
+        start = time.perf_counter()
+        for _ in range(count):
+            service.call_llm("ping")
+        return time.perf_counter() - start
+    finally:
+        if service._client is not None:
+            service._client.close()
+
+def main(count):
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench-key")
+    server, url = start_server()
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "ping"}]}
+    
+    try:
+        # 预热，避免首次导入和DNS等开销影响结果
+        bench_fresh_client(url, payload, 5)
+        bench_pooled_service(url, 5)
+        
+        fresh = bench_fresh_client(url, payload, count)
+        pooled = bench_pooled_service(url, count)
+    finally:
+        server.shutdown()
+    
+    print(f"请求数: {count}")
+    print(f"每次新建客户端: 总计 {fresh:.3f}s, 平均 {fresh / count * 1000:.2f}ms/请求")
+    print(f"复用连接池:     总计 {pooled:.3f}s, 平均 {pooled / count * 1000:.2f}ms/请求")
+    print(f"每请求节省: {(fresh - pooled) / count * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM客户端连接复用基准测试")
+    parser.add_argument("--requests", type=int, default=200, help="每种方式的请求数")
+    
+    args = parser.parse_args()
+    main(args.requests)
@@ -0,0 +1,129 @@
+# backend/app/scripts/bench_sqlite.py
+"""
+SQLite 连接配置并发读写基准测试
+
+在临时数据库上分别使用 default（SQLite默认设置）和 tuned（WAL等PRAGMA）配置，
+多个读线程持续查询消息、一个写线程持续插入消息，统计固定时间内完成的读写次数和延迟。
+
+用法: python -m app.scripts.bench_sqlite --readers 8 --seconds 5
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from nanoid import generate
+from sqlmodel import SQLModel, Session, select, func
+
+from app.database.database import create_sqlite_engine
+from app.models.message import Message
+from app.models.qapair import QAPair
+from app.models.node import Node
+from app.models.session import Session as SessionModel
+
+def seed(engine, qa_pairs=200, messages_per_pair=10):
+    """写入初始数据"""
+    with Session(engine) as db:
+        session = SessionModel(name="bench")
+        db.add(session)
+        db.commit()
+        node = Node(id=generate(), session_id=session.id)
+        db.add(node)
+        db.commit()
+        pair_ids = []
+        for _ in range(qa_pairs):
+            pair = QAPair(node_id=node.id, session_id=session.id)
+            db.add(pair)
+            pair_ids.append(pair.id)
+        db.commit()
+        for pair_id in pair_ids:
+            for i in range(messages_per_pair):
+                db.add(Message(qa_pair_id=pair_id, role="user" if i % 2 == 0 else "assistant",
+                               content=f"benchmark message {i} " * 20))
+        db.commit()
+        return pair_ids
+
+def run_profile(profile, readers, seconds):
+    """在新的临时数据库上运行一次基准测试"""
+    directory = tempfile.mkdtemp(prefix="syncraft-bench-")
+    path = os.path.join(directory, "bench.db")
+    engine = create_sqlite_engine(path, profile=profile, pool_size=readers + 2, max_overflow=0)
+    SQLModel.metadata.create_all(engine)
+    pair_ids = seed(engine)
+    
+    stop = threading.Event()
+    read_latencies = []
+    write_latencies = []
+    errors = []
+    lock = threading.Lock()
+    
+    def reader(index):
+        latencies = []
+        i = index
+        while not stop.is_set():
+            pair_id = pair_ids[i % len(pair_ids)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                with Session(engine) as db:
+                    db.exec(select(Message).where(Message.qa_pair_id == pair_id)).all()
+                    db.exec(select(func.count()).select_from(Message)).one()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+        with lock:
+            read_latencies.extend(latencies)
+    
+    def writer():
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with Session(engine) as db:
+                    db.add(Message(qa_pair_id=pair_ids[i % len(pair_ids)], role="user", content=f"new {i}"))
+                    db.commit()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            i += 1
+            write_latencies.append(time.perf_counter() - start)
+    
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    
+    return {
+        "reads": len(read_latencies),
+        "writes": len(write_latencies),
+        "read_p50_ms": statistics.median(read_latencies) * 1000 if read_latencies else 0,
+        "write_p50_ms": statistics.median(write_latencies) * 1000 if write_latencies else 0,
+        "write_max_ms": max(write_latencies) * 1000 if write_latencies else 0,
+        "errors": len(errors),
+    }
+
+def main(readers, seconds):
+    print(f"读线程: {readers}, 写线程: 1, 时长: {seconds}s")
+    for profile in ("default", "tuned"):
+        result = run_profile(profile, readers, seconds)
+        print(
+            f"{profile:8s} 读 {result['reads'] / seconds:8.0f}/s (p50 {result['read_p50_ms']:.2f}ms)  "
+            f"写 {result['writes'] / seconds:7.0f}/s (p50 {result['write_p50_ms']:.2f}ms, "
+            f"max {result['write_max_ms']:.1f}ms)  错误 {result['errors']}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite 连接配置并发读写基准测试")
+    parser.add_argument("--readers", type=int, default=8, help="读线程数")
+    parser.add_argument("--seconds", type=float, default=5, help="每种配置的运行时长（秒）")
+    
+    args = parser.parse_args()
+    main(args.readers, args.seconds)
@@ -5,9 +5,10 @@ from app.models.context import Context
 from app.models.context_node import ContextNode
 from app.models.node import Node
 from app.models.session import Session as SessionModel
+from app.cache.cache_manager import cache_manager
 from nanoid import generate
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 import time
 
 class ContextService:
@@ -65,6 +66,8 @@ class ContextService:
                 
                 # 获取行级锁，防止并发问题
                 # 注意：这里使用了FOR UPDATE子句，它会锁定查询返回的行，直到事务结束
+                # SQLite会忽略该子句；PostgreSQL无法锁定尚不存在的行，
+                # 并发创建时由context_id的唯一约束兜底（见下方IntegrityError处理）
                 existing_contexts = self.db.exec(
                     select(Context).where(Context.context_id == context_id).with_for_update()
                 ).all()
@@ -106,8 +109,11 @@ class ContextService:
                 self.db.add(context_node)
                 self.db.commit()
                 
-                return context
+                # 会话详情中缓存了上下文列表
+                cache_manager.invalidate_tags(f"session:{session_id}")
                 
+                return context
+            
             except IntegrityError as e:
                 # 回滚事务
                 self.db.rollback()
@@ -154,23 +160,8 @@ class ContextService:
         if not context:
             return None
         
-        # 查询上下文节点关系
-        query = select(ContextNode).where(ContextNode.context_id == context_id)
-        context_nodes = self.db.exec(query).all()
-        
-        # 获取节点详情
-        nodes_data = []
-        for context_node in context_nodes:
-            node = self.db.get(Node, context_node.node_id)
-            if node:
-                nodes_data.append({
-                    "id": node.id,
-                    "parent_id": node.parent_id,
-                    "template_key": node.template_key,
-                    "created_at": node.created_at,
-                    "relation_type": context_node.relation_type,
-                    "node_metadata": context_node.node_metadata
-                })
+        # 一次联表查询获取节点
+        nodes_data = self.get_context_nodes(context_id)
         
         return {
             "id": context.id,
@@ -227,6 +218,9 @@ class ContextService:
         self.db.add(context)
         self.db.flush()  # 刷新会话，但不提交
         
+        # 会话详情和主上下文中缓存了活动节点，由调用方提交后再失效
+        cache_manager.invalidate_tags_after_commit(self.db, f"session:{context.session_id}")
+        
         print(f"上下文更新成功（未提交），当前active_node_id: {context.active_node_id}")
         return context
     
@@ -259,11 +253,16 @@ class ContextService:
         context_nodes = self.db.exec(query).all()
         for context_node in context_nodes:
             self.db.delete(context_node)
+        # 外键约束下先删除上下文节点关系
+        self.db.flush()
         
         # 删除上下文
+        session_id = context.session_id
         self.db.delete(context)
         self.db.commit()
         
+        cache_manager.invalidate_tags(f"session:{session_id}")
+        
         return True
     
     def add_node_to_context(self, context_id: str, node_id: str, relation_type: str = "member", 
@@ -336,27 +335,48 @@ class ContextService:
         
         return True
     
+    def get_context_node_rows(self, context_id: str,
+                              relation_type: Optional[str] = None) -> List[Tuple[ContextNode, Node]]:
+        """
+        用一次ContextNode⋈Node查询获取上下文中的节点关系和节点
+        
+        Args:
+            context_id: 上下文ID
+            relation_type: 只返回指定关系类型的节点
+        """
+        query = (
+            select(ContextNode, Node)
+            .join(Node, Node.id == ContextNode.node_id)
+            .where(ContextNode.context_id == context_id)
+            .order_by(ContextNode.created_at)
+        )
+        if relation_type:
+            query = query.where(ContextNode.relation_type == relation_type)
+        return self.db.exec(query).all()
+    
+    def get_node_context_rows(self, node_id: str) -> List[Tuple[ContextNode, Context]]:
+        """用一次ContextNode⋈Context查询获取节点所属的上下文关系和上下文"""
+        query = (
+            select(ContextNode, Context)
+            .join(Context, Context.id == ContextNode.context_id)
+            .where(ContextNode.node_id == node_id)
+            .order_by(ContextNode.created_at)
+        )
+        return self.db.exec(query).all()
+    
     def get_context_nodes(self, context_id: str) -> List[Dict[str, Any]]:
         """获取上下文中的所有节点"""
-        # 查询上下文节点关系
-        query = select(ContextNode).where(ContextNode.context_id == context_id)
-        context_nodes = self.db.exec(query).all()
-        
-        # 获取节点详情
-        nodes_data = []
-        for context_node in context_nodes:
-            node = self.db.get(Node, context_node.node_id)
-            if node:
-                nodes_data.append({
-                    "id": node.id,
-                    "parent_id": node.parent_id,
-                    "template_key": node.template_key,
-                    "created_at": node.created_at,
-                    "relation_type": context_node.relation_type,
-                    "node_metadata": context_node.node_metadata
-                })
-        
-        return nodes_data
+        return [
+            {
+                "id": node.id,
+                "parent_id": node.parent_id,
+                "template_key": node.template_key,
+                "created_at": node.created_at,
+                "relation_type": context_node.relation_type,
+                "node_metadata": context_node.node_metadata
+            }
+            for context_node, node in self.get_context_node_rows(context_id)
+        ]
     
     def get_session_contexts(self, session_id: str) -> List[Context]:
         """获取会话的所有上下文"""
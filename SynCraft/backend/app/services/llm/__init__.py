@@ -1,5 +1,6 @@
 # backend/app/services/llm/__init__.py
 from .llm_factory import LLMServiceFactory
+from .response_cache import BYPASS_HEADER, BYPASS_VALUES, bypass_llm_cache, get_llm_call_info, set_llm_call_info
 
 # 导出工厂方法，方便其他模块使用
 get_llm_service = LLMServiceFactory.get_instance
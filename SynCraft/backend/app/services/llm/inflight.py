@@ -0,0 +1,89 @@
+# backend/app/services/llm/inflight.py
+"""
+进行中的LLM请求登记表
+
+相同指纹（模型、参数、消息列表）的并发请求只向上游发送一次，所有调用方得到同一个回答或同一个异常。
+"""
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+import asyncio
+import threading
+
+T = TypeVar('T')
+
+class InflightRegistry:
+    """
+    按指纹合并并发的同步和异步调用
+    
+    同步调用由第一个调用方在自己的线程中执行，其余调用方等待结果；
+    异步调用在独立的任务中执行，某个调用方被取消（如客户端断开）不会影响其他调用方。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._async_inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self.coalesced = 0
+    
+    def run(self, key: str, func: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        执行同步调用，相同指纹的调用正在进行时等待它的结果
+        
+        Returns:
+            (结果, 是否与其他调用共享)
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = func()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+    
+    async def arun(self, key: str, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        run 的异步版本，func 返回可等待对象
+        
+        Returns:
+            (结果, 是否与其他调用共享)
+        """
+        loop = asyncio.get_running_loop()
+        
+        with self._lock:
+            task = self._async_inflight.get(key)
+            if task is not None and task.get_loop() is not loop:
+                # 其他事件循环中的任务无法在这里等待
+                task = None
+            shared = task is not None
+            if shared:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(func())
+                self._async_inflight[key] = task
+                task.add_done_callback(lambda _: self._forget(key, task))
+        
+        # shield：单个调用方被取消时上游请求继续，其他调用方仍能拿到结果
+        return await asyncio.shield(task), shared
+    
+    def _forget(self, key: str, task: "asyncio.Task[Any]") -> None:
+        with self._lock:
+            if self._async_inflight.get(key) is task:
+                del self._async_inflight[key]
+        # 所有调用方都已取消时避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
@@ -26,3 +26,9 @@ class LLMServiceFactory:
                 cls._instance = RealLLMService()
         
         return cls._instance
+    
+    @classmethod
+    async def shutdown(cls) -> None:
+        """关闭LLM服务实例持有的资源（应用关闭时调用）"""
+        if cls._instance is not None:
+            await cls._instance.aclose()
@@ -1,6 +1,6 @@
 # backend/app/services/llm/llm_interface.py
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, AsyncIterator
 
 class LLMServiceInterface(ABC):
     """LLM服务接口，定义了与大语言模型交互的方法"""
@@ -14,3 +14,15 @@ class LLMServiceInterface(ABC):
     async def ask(self, msg: str, context: Optional[List[Dict]] = None) -> str:
         """异步调用LLM获取回答"""
         pass
+    
+    async def stream(self, msg: str, context: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """
+        流式调用LLM，逐段返回回答内容
+        
+        默认实现一次性返回完整回答，支持流式接口的服务应覆盖此方法
+        """
+        yield await self.ask(msg, context)
+    
+    async def aclose(self) -> None:
+        """释放服务持有的资源（如HTTP连接池），默认无需处理"""
+        pass
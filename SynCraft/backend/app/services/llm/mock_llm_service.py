@@ -1,10 +1,14 @@
 # backend/app/services/llm/mock_llm_service.py
-from typing import List, Optional, Dict
+import asyncio
+from typing import List, Optional, Dict, AsyncIterator
 from .llm_interface import LLMServiceInterface
 
 class MockLLMService(LLMServiceInterface):
     """模拟LLM服务，用于测试环境"""
     
+    # 流式回答每段的字符数
+    STREAM_CHUNK_SIZE = 4
+    
     def __init__(self):
         """初始化模拟LLM服务"""
         self.auth_key = "dev-secret"
@@ -19,3 +23,11 @@ class MockLLMService(LLMServiceInterface):
         if context and len(context) > 0:
             return f"这是一个测试回答，针对问题：{msg}，考虑了{len(context)}条上下文信息"
         return f"这是一个测试回答，针对问题：{msg}"
+    
+    async def stream(self, msg: str, context: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """模拟流式回答，将完整回答按固定长度分段返回"""
+        answer = await self.ask(msg, context)
+        for start in range(0, len(answer), self.STREAM_CHUNK_SIZE):
+            # 让出事件循环，模拟逐段到达
+            await asyncio.sleep(0)
+            yield answer[start:start + self.STREAM_CHUNK_SIZE]
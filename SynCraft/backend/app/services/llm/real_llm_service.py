@@ -1,26 +1,72 @@
 # backend/app/services/llm/real_llm_service.py
 from os import getenv, path
+import asyncio
 import json
+import sqlite3
+import threading
+import time
 import httpx
 from fastapi import HTTPException
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterator, Tuple
 
 from .llm_interface import LLMServiceInterface
+from .inflight import InflightRegistry
+from .resilience import (
+    RETRYABLE_STATUS_CODES, CircuitBreaker, DeadlineExceeded, ResiliencePolicy, RetryableError, parse_retry_after
+)
+from .response_cache import LLMResponseCache, cache_bypassed, cache_key, set_llm_call_info, update_llm_call_info
+
+# 默认HTTP连接设置，config.json 中的 llm.http 会覆盖对应字段
+DEFAULT_HTTP_CONFIG = {
+    "http2": False,
+    "timeouts": {"connect": 5.0, "read": 60.0, "write": 10.0, "pool": 5.0},
+    "limits": {"max_connections": 20, "max_keepalive_connections": 10, "keepalive_expiry": 30.0}
+}
 
 class RealLLMService(LLMServiceInterface):
-    """真实LLM服务，调用OpenRouter API获取回答"""
+    """
+    真实LLM服务，调用OpenRouter API获取回答
+    
+    每个服务实例持有长期复用的连接池（同步和异步各一个），
+    避免每次提问都重新建立TCP和TLS连接。连接池在应用关闭时通过 aclose 释放。
+    
+    启用回答缓存（config.json 中的 llm.cache.enabled 或环境变量 LLM_CACHE_ENABLED）后，
+    相同模型、参数和消息列表的请求直接返回缓存的回答。未命中缓存的相同请求并发时只请求上游一次。
+    """
     
-    def __init__(self):
-        """初始化真实LLM服务"""
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None,
+                 async_transport: Optional[httpx.AsyncBaseTransport] = None,
+                 response_cache: Optional[LLMResponseCache] = None):
+        """
+        初始化真实LLM服务
+        
+        Args:
+            transport: 同步客户端使用的传输层，测试时可替换
+            async_transport: 异步客户端使用的传输层，测试时可替换
+            response_cache: 回答缓存，未传入时按配置创建
+        """
         # 加载配置
         self._load_config()
+        self.response_cache = response_cache or self._create_response_cache()
+        # 进行中的请求，相同请求并发时只请求上游一次
+        self._inflight = InflightRegistry()
+        # 重试、熔断和降级策略，每个模型一个熔断器
+        self.resilience = ResiliencePolicy(self.llm_config.get("resilience"))
+        self._breakers: Dict[str, CircuitBreaker] = {}
         
         # 获取API密钥
         self.api_key = getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise RuntimeError("OPENROUTER_API_KEY missing")
-            
+        
         self.auth_key = getenv("BACKEND_AUTH_KEY", "dev-secret")
+        
+        # 连接池在首次请求时创建
+        self._transport = transport
+        self._async_transport = async_transport
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._client_lock = threading.Lock()
     
     def _load_config(self):
         """加载配置文件"""
@@ -53,6 +99,151 @@ class RealLLMService(LLMServiceInterface):
                 }
             }
     
+    def _create_response_cache(self) -> Optional[LLMResponseCache]:
+        """按配置创建回答缓存，未启用时返回None"""
+        cache_config = self.llm_config.get("cache", {})
+        enabled = getenv("LLM_CACHE_ENABLED")
+        if enabled is None:
+            enabled = cache_config.get("enabled", False)
+        else:
+            enabled = enabled.lower() == "true"
+        if not enabled:
+            return None
+        
+        # 相对路径相对于后端根目录（config.json 所在目录）
+        base_dir = path.dirname(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+        try:
+            return LLMResponseCache.from_config(cache_config, base_dir)
+        except sqlite3.Error as e:
+            print(f"打开LLM缓存文件失败，只使用内存缓存: {e}")
+            return LLMResponseCache.from_config({**cache_config, "disk_path": None}, base_dir)
+    
+    def _lookup_cache(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        查找缓存的回答
+        
+        Returns:
+            (缓存值, 命中的层)；未启用缓存、未命中或跳过查找时缓存值为None
+        """
+        if self.response_cache is None or cache_bypassed():
+            return None, None
+        try:
+            return self.response_cache.get(key)
+        except sqlite3.Error as e:
+            print(f"读取LLM缓存失败: {e}")
+            return None, None
+    
+    async def _alookup_cache(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """_lookup_cache 的异步版本，读取磁盘缓存时不阻塞事件循环"""
+        if self.response_cache is None:
+            return None, None
+        return await asyncio.to_thread(self._lookup_cache, key)
+    
+    def _record_cache_result(self, value: Optional[Dict[str, Any]], tier: Optional[str]) -> Optional[str]:
+        """记录本次调用是否命中缓存，命中时返回缓存的回答"""
+        if self.response_cache is None:
+            return None
+        if value is None:
+            set_llm_call_info({"cache_hit": False, "cache_bypassed": cache_bypassed()})
+            return None
+        set_llm_call_info({
+            "cache_hit": True,
+            "cache_tier": tier,
+            # 原始调用的耗时和token用量，即本次节省的部分
+            "saved_latency_ms": value.get("latency_ms"),
+            "saved_usage": value.get("usage")
+        })
+        return value["content"]
+    
+    def _store_cache(self, key: str, model: str, content: str, started: float,
+                     usage: Optional[Dict[str, Any]] = None) -> None:
+        """
+        把回答写入缓存，同时记录原始调用的耗时和token用量
+        
+        缓存键按默认模型计算，备选模型的回答不缓存，默认模型恢复后重新请求
+        """
+        if not self._cacheable(model, content):
+            return
+        value = {
+            "content": content,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "usage": usage
+        }
+        try:
+            self.response_cache.set(key, value)
+        except sqlite3.Error as e:
+            print(f"写入LLM缓存失败: {e}")
+    
+    async def _astore_cache(self, key: str, model: str, content: str, started: float,
+                            usage: Optional[Dict[str, Any]] = None) -> None:
+        """_store_cache 的异步版本"""
+        if self._cacheable(model, content):
+            await asyncio.to_thread(self._store_cache, key, model, content, started, usage)
+    
+    def _cacheable(self, model: str, content: str) -> bool:
+        """缓存已启用、回答非空且由默认模型给出时才写入缓存"""
+        return (self.response_cache is not None and bool(content)
+                and model == self.llm_config["models"]["default"])
+    
+    def _client_options(self) -> Dict[str, Any]:
+        """根据配置生成httpx客户端参数（超时、连接数限制、HTTP/2）"""
+        http_config = self.llm_config.get("http", {})
+        timeouts = {**DEFAULT_HTTP_CONFIG["timeouts"], **http_config.get("timeouts", {})}
+        limits = {**DEFAULT_HTTP_CONFIG["limits"], **http_config.get("limits", {})}
+        
+        http2 = bool(http_config.get("http2", DEFAULT_HTTP_CONFIG["http2"]))
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("未安装h2，LLM客户端回退到HTTP/1.1")
+                http2 = False
+        
+        return {
+            "timeout": httpx.Timeout(**timeouts),
+            "limits": httpx.Limits(**limits),
+            "http2": http2,
+            "headers": self._build_headers()
+        }
+    
+    def _build_headers(self) -> Dict[str, str]:
+        """构建请求头"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        
+        # 添加配置文件中的自定义请求头
+        for key, value in self.llm_config["headers"].items():
+            headers[key] = value
+        return headers
+    
+    @property
+    def client(self) -> httpx.Client:
+        """获取复用的同步HTTP客户端"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.Client(transport=self._transport, **self._client_options())
+        return self._client
+    
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """获取复用的异步HTTP客户端"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(transport=self._async_transport, **self._client_options())
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """关闭连接池和缓存文件"""
+        if self.response_cache is not None:
+            self.response_cache.close()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
     def call_llm(self, prompt: str) -> str:
         """调用LLM获取回答"""
         # 从配置文件获取模型和参数
@@ -68,21 +259,59 @@ class RealLLMService(LLMServiceInterface):
             "temperature": temperature,
             "max_tokens": max_tokens
         }
-
-        # 构建请求头
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-        }
         
-        # 添加配置文件中的自定义请求头
-        for key, value in self.llm_config["headers"].items():
-            headers[key] = value
-
+        key = cache_key(payload)
+        cached = self._record_cache_result(*self._lookup_cache(key))
+        if cached is not None:
+            return cached
+        
+        # 相同请求正在进行时等待它的结果，不重复请求上游
+        (content, meta), shared = self._inflight.run(key, lambda: self._complete(api_url, payload, key))
+        update_llm_call_info(**meta)
+        if shared:
+            update_llm_call_info(coalesced=True)
+        return content
+    
+    def _complete(self, api_url: str, payload: Dict[str, Any], key: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        向上游发送同步补全请求，失败时按容错策略重试并依次改用备选模型
+        
+        Returns:
+            (回答, 调用信息：实际使用的模型、尝试次数)
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.resilience.deadline
+        attempts = 0
+        last_error: Optional[RetryableError] = None
+        
         try:
-            with httpx.Client(timeout=60) as client:
-                resp = client.post(api_url, json=payload, headers=headers)
-                resp.raise_for_status()
-                return resp.json()["choices"][0]["message"]["content"]
+            for model in self._candidate_models():
+                breaker = self._breaker(model)
+                for attempt in range(1, self.resilience.max_attempts + 1):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"LLM服务在{self.resilience.deadline}秒内没有返回")
+                    
+                    attempts += 1
+                    try:
+                        data = self._post(api_url, {**payload, "model": model}, remaining)
+                    except RetryableError as e:
+                        breaker.record_failure()
+                        last_error = e
+                        print(f"LLM服务请求失败 (模型: {model}, 第{attempt}次): {e}")
+                        delay = self._next_delay(attempt, e, breaker, deadline - time.monotonic())
+                        if delay is None:
+                            break
+                        time.sleep(delay)
+                        continue
+                    
+                    breaker.record_success()
+                    content = data["choices"][0]["message"]["content"]
+                    self._store_cache(key, model, content, started, data.get("usage"))
+                    return content, self._call_meta(model, attempts)
+        except DeadlineExceeded as e:
+            print(str(e))
+            raise ValueError(str(e))
         except httpx.HTTPStatusError as e:
             # HTTP状态错误（如401、403、500等）
             error_message = f"LLM服务返回错误 (状态码: {e.response.status_code}): {e.response.text}"
@@ -103,12 +332,14 @@ class RealLLMService(LLMServiceInterface):
             error_message = f"LLM服务调用过程中发生未知错误: {str(e)}"
             print(error_message)  # 在实际应用中应该使用日志记录
             raise ValueError(error_message)
+        
+        raise ValueError(self._exhausted_message(last_error))
     
     async def ask(self, msg: str, context: Optional[List[Dict]] = None) -> str:
         """异步调用LLM获取回答"""
-        messages = context or []
+        messages = list(context or [])
         messages.append({"role": "user", "content": msg})
-
+        
         # 从配置文件获取模型和参数
         model = self.llm_config["models"]["default"]
         temperature = self.llm_config["parameters"]["temperature"]
@@ -122,22 +353,310 @@ class RealLLMService(LLMServiceInterface):
             "temperature": temperature,
             "max_tokens": max_tokens
         }
-
-        # 构建请求头
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-        }
         
-        # 添加配置文件中的自定义请求头
-        for key, value in self.llm_config["headers"].items():
-            headers[key] = value
-
+        key = cache_key(payload)
+        cached = self._record_cache_result(*(await self._alookup_cache(key)))
+        if cached is not None:
+            return cached
+        
+        # 相同请求正在进行时共享它的结果，不重复请求上游
+        (content, meta), shared = await self._inflight.arun(key, lambda: self._acomplete(api_url, payload, key))
+        update_llm_call_info(**meta)
+        if shared:
+            update_llm_call_info(coalesced=True)
+        return content
+    
+    async def _acomplete(self, api_url: str, payload: Dict[str, Any], key: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        向上游发送异步补全请求
+        
+        每个模型在自己的任务中按容错策略重试；当前模型失败或熔断时改用下一个模型，
+        当前模型超过 hedge_after 秒仍未返回时并行请求下一个模型，先成功的结果生效，其余请求取消。
+        
+        Returns:
+            (回答, 调用信息：实际使用的模型、尝试次数、是否对冲)
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.resilience.deadline
+        models = iter(self._candidate_models())
+        pending: Dict["asyncio.Task[Tuple[Dict[str, Any], int]]", str] = {}
+        last_error: Optional[RetryableError] = None
+        hedged = False
+        
+        def launch() -> bool:
+            """为下一个可用的模型启动请求任务"""
+            model = next(models, None)
+            if model is None:
+                return False
+            pending[loop.create_task(self._amodel_attempts(api_url, {**payload, "model": model}, deadline))] = model
+            return True
+        
         try:
-            async with httpx.AsyncClient(timeout=60) as client:
-                resp = await client.post(api_url, json=payload, headers=headers)
-                resp.raise_for_status()
-                return resp.json()["choices"][0]["message"]["content"]
+            launch()
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise HTTPException(
+                        status_code=504, detail=f"LLM服务在{self.resilience.deadline}秒内没有返回"
+                    )
+                
+                hedge_after = self.resilience.hedge_after
+                timeout = min(remaining, hedge_after) if hedge_after > 0 else remaining
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 当前请求迟迟没有返回，向下一个模型发出对冲请求
+                    if hedge_after > 0 and launch():
+                        hedged = True
+                    continue
+                
+                for task in done:
+                    model = pending.pop(task)
+                    try:
+                        data, attempts = task.result()
+                    except RetryableError as e:
+                        last_error = e
+                        continue
+                    
+                    content = data["choices"][0]["message"]["content"]
+                    await self._astore_cache(key, model, content, started, data.get("usage"))
+                    meta = self._call_meta(model, attempts)
+                    if hedged:
+                        meta["hedged"] = True
+                    return content, meta
+                
+                # 所有进行中的请求都失败了，改用下一个模型
+                if not pending:
+                    launch()
         except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=e.response.status_code, detail=f"OpenRouter error: {e.response.text}")
         except httpx.RequestError as e:
             raise HTTPException(status_code=500, detail=f"Request error: {e}")
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        status_code = last_error.status_code if last_error is not None and last_error.status_code else 503
+        raise HTTPException(status_code=status_code, detail=self._exhausted_message(last_error))
+    
+    async def _amodel_attempts(self, api_url: str, payload: Dict[str, Any],
+                               deadline: float) -> Tuple[Dict[str, Any], int]:
+        """
+        按容错策略向单个模型发送请求
+        
+        Returns:
+            (响应JSON, 尝试次数)
+        
+        Raises:
+            RetryableError: 重试次数用完、熔断或剩余时间不足
+        """
+        loop = asyncio.get_running_loop()
+        breaker = self._breaker(payload["model"])
+        for attempt in range(1, self.resilience.max_attempts + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                data = await self._apost(api_url, payload, remaining)
+            except RetryableError as e:
+                breaker.record_failure()
+                print(f"LLM服务请求失败 (模型: {payload['model']}, 第{attempt}次): {e}")
+                delay = self._next_delay(attempt, e, breaker, deadline - loop.time())
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            
+            breaker.record_success()
+            return data, attempt
+        raise RetryableError(f"LLM服务 (模型: {payload['model']}) 在截止时间内没有返回")
+    
+    def _post(self, api_url: str, payload: Dict[str, Any], remaining: float) -> Dict[str, Any]:
+        """发送一次同步请求，可重试的错误转换为RetryableError"""
+        try:
+            resp = self.client.post(api_url, json=payload, timeout=self._attempt_timeout(self.client, remaining))
+        except httpx.TransportError as e:
+            raise RetryableError(str(e) or type(e).__name__)
+        return self._check_response(resp, resp.text)
+    
+    async def _apost(self, api_url: str, payload: Dict[str, Any], remaining: float) -> Dict[str, Any]:
+        """发送一次异步请求，可重试的错误转换为RetryableError"""
+        try:
+            resp = await self.async_client.post(
+                api_url, json=payload, timeout=self._attempt_timeout(self.async_client, remaining)
+            )
+        except httpx.TransportError as e:
+            raise RetryableError(str(e) or type(e).__name__)
+        return self._check_response(resp, resp.text)
+    
+    @staticmethod
+    def _check_response(resp: httpx.Response, body: str) -> Dict[str, Any]:
+        """检查响应状态：可重试的状态码抛出RetryableError，其他错误状态抛出HTTPStatusError"""
+        if resp.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableError(
+                f"LLM服务返回错误 (状态码: {resp.status_code}): {body}",
+                status_code=resp.status_code,
+                retry_after=parse_retry_after(resp.headers.get("Retry-After"))
+            )
+        resp.raise_for_status()
+        return resp.json()
+    
+    @staticmethod
+    def _attempt_timeout(client: Any, remaining: float) -> httpx.Timeout:
+        """单次请求的超时不超过剩余的截止时间"""
+        timeout = client.timeout
+        
+        def cap(value: Optional[float]) -> float:
+            return remaining if value is None else min(value, remaining)
+        
+        return httpx.Timeout(
+            connect=cap(timeout.connect), read=cap(timeout.read), write=cap(timeout.write), pool=cap(timeout.pool)
+        )
+    
+    def _next_delay(self, attempt: int, error: RetryableError, breaker: CircuitBreaker,
+                    remaining: float) -> Optional[float]:
+        """计算重试前的等待时间，不应再重试当前模型时返回None"""
+        if attempt >= self.resilience.max_attempts or breaker.state == "open":
+            return None
+        delay = self.resilience.retry_delay(attempt, error.retry_after)
+        if delay is None or delay >= remaining:
+            return None
+        return delay
+    
+    def _candidate_models(self) -> Iterator[str]:
+        """
+        按顺序产生本次可以请求的模型：默认模型在前，备选模型在后，跳过熔断中的模型
+        
+        熔断器在轮到该模型时才检查，半开状态的试探名额不会被没有用到的模型占用
+        """
+        models = [self.llm_config["models"]["default"]]
+        for model in self.llm_config["models"].get("alternatives", []):
+            if model not in models:
+                models.append(model)
+        for model in models:
+            if self._breaker(model).allow():
+                yield model
+    
+    def _breaker(self, model: str) -> CircuitBreaker:
+        """获取模型的熔断器"""
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            with self._client_lock:
+                breaker = self._breakers.setdefault(model, CircuitBreaker(
+                    self.resilience.breaker_failure_threshold, self.resilience.breaker_reset_timeout
+                ))
+        return breaker
+    
+    def _call_meta(self, model: str, attempts: int) -> Dict[str, Any]:
+        """生成调用信息，使用备选模型时标记 fallback"""
+        meta: Dict[str, Any] = {"model": model, "attempts": attempts}
+        if model != self.llm_config["models"]["default"]:
+            meta["fallback"] = True
+        return meta
+    
+    @staticmethod
+    def _exhausted_message(last_error: Optional[RetryableError]) -> str:
+        if last_error is None:
+            return "所有LLM模型都处于熔断状态，请稍后再试"
+        return f"所有LLM模型都请求失败: {last_error}"
+    
+    async def stream(self, msg: str, context: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """
+        流式调用LLM，解析OpenAI兼容的SSE响应并逐段返回内容
+        
+        收到第一段内容之前的可重试错误按容错策略重试或改用备选模型；
+        流已开始后无法再返回HTTP错误码，也不能换模型，失败时抛出ValueError，由调用方转换为错误事件
+        """
+        messages = list(context or [])
+        messages.append({"role": "user", "content": msg})
+        
+        payload = {
+            "model": self.llm_config["models"]["default"],
+            "messages": messages,
+            "temperature": self.llm_config["parameters"]["temperature"],
+            "max_tokens": self.llm_config["parameters"]["max_tokens"],
+            "stream": True
+        }
+        
+        key = cache_key(payload)
+        cached = self._record_cache_result(*(await self._alookup_cache(key)))
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks: List[str] = []
+        usage = None
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.resilience.deadline
+        last_error: Optional[RetryableError] = None
+        
+        for model in self._candidate_models():
+            breaker = self._breaker(model)
+            for attempt in range(1, self.resilience.max_attempts + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise ValueError(f"LLM服务在{self.resilience.deadline}秒内没有返回")
+                
+                try:
+                    async with self.async_client.stream(
+                        "POST", self.llm_config["api_url"], json={**payload, "model": model},
+                        timeout=self._attempt_timeout(self.async_client, remaining)
+                    ) as resp:
+                        if resp.status_code >= 400:
+                            body = (await resp.aread()).decode("utf-8", "replace")
+                            if resp.status_code in RETRYABLE_STATUS_CODES:
+                                self._check_response(resp, body)
+                            raise ValueError(f"LLM服务返回错误 (状态码: {resp.status_code}): {body}")
+                        
+                        async for line in resp.aiter_lines():
+                            # 忽略空行和注释行（如 ": OPENROUTER PROCESSING"）
+                            if not line.startswith("data:"):
+                                continue
+                            
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            
+                            chunk = json.loads(data)
+                            if "error" in chunk:
+                                raise ValueError(f"LLM服务返回错误: {chunk['error']}")
+                            
+                            usage = chunk.get("usage") or usage
+                            choices = chunk.get("choices") or []
+                            content = choices[0].get("delta", {}).get("content") if choices else None
+                            if content:
+                                chunks.append(content)
+                                yield content
+                except (RetryableError, httpx.TransportError) as e:
+                    if chunks:
+                        # 已经返回了部分内容，不能再重试
+                        error_message = f"LLM服务请求失败: {str(e)}"
+                        print(error_message)
+                        raise ValueError(error_message)
+                    if not isinstance(e, RetryableError):
+                        e = RetryableError(str(e) or type(e).__name__)
+                    breaker.record_failure()
+                    last_error = e
+                    print(f"LLM服务请求失败 (模型: {model}, 第{attempt}次): {e}")
+                    delay = self._next_delay(attempt, e, breaker, deadline - loop.time())
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    continue
+                except httpx.RequestError as e:
+                    error_message = f"LLM服务请求失败: {str(e)}"
+                    print(error_message)
+                    raise ValueError(error_message)
+                except json.JSONDecodeError as e:
+                    error_message = f"LLM服务响应格式错误: {str(e)}"
+                    print(error_message)
+                    raise ValueError(error_message)
+                
+                breaker.record_success()
+                update_llm_call_info(**self._call_meta(model, attempt))
+                # 只缓存完整结束的回答
+                await self._astore_cache(key, model, "".join(chunks), started, usage)
+                return
+        
+        raise ValueError(self._exhausted_message(last_error))
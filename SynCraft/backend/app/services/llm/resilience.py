@@ -0,0 +1,147 @@
+# backend/app/services/llm/resilience.py
+"""
+LLM请求的容错策略
+
+- 重试：可重试的错误（429、5xx、超时、连接失败）按指数退避加随机抖动重试，响应带 Retry-After 时按它等待
+- 熔断：每个模型一个熔断器，连续失败达到阈值后一段时间内不再请求该模型，之后放行一个试探请求
+- 降级：默认模型失败或熔断时依次改用 models.alternatives 中的模型；异步调用在默认模型迟迟没有返回时
+  并行请求下一个模型（对冲请求），先成功的结果生效
+- 截止时间：一次调用（含重试和降级）的总耗时上限
+"""
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+import random
+import threading
+import time
+
+# 默认容错设置，config.json 中的 llm.resilience 会覆盖对应字段
+DEFAULT_RESILIENCE_CONFIG = {
+    # 每个模型的最大尝试次数（含第一次）
+    "max_attempts": 3,
+    # 指数退避的基础等待和最大等待（秒）
+    "base_delay": 0.5,
+    "max_delay": 8.0,
+    # Retry-After 超过这个值（秒）时不再等待，直接换下一个模型
+    "max_retry_after": 30.0,
+    # 一次调用的总耗时上限（秒）
+    "deadline": 90.0,
+    # 异步调用等待多久（秒）仍未返回时向下一个模型发出对冲请求，0表示不对冲
+    "hedge_after": 20.0,
+    # 连续失败多少次后熔断，熔断持续多久（秒）
+    "breaker_failure_threshold": 5,
+    "breaker_reset_timeout": 30.0,
+}
+
+# 可以重试或换模型的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class RetryableError(Exception):
+    """可以重试或换模型的上游错误"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class DeadlineExceeded(Exception):
+    """在截止时间内没有得到回答"""
+
+class ResiliencePolicy:
+    """重试间隔的计算"""
+    
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        options = {**DEFAULT_RESILIENCE_CONFIG, **(config or {})}
+        self.max_attempts = max(1, int(options["max_attempts"]))
+        self.base_delay = float(options["base_delay"])
+        self.max_delay = float(options["max_delay"])
+        self.max_retry_after = float(options["max_retry_after"])
+        self.deadline = float(options["deadline"])
+        self.hedge_after = float(options["hedge_after"])
+        self.breaker_failure_threshold = int(options["breaker_failure_threshold"])
+        self.breaker_reset_timeout = float(options["breaker_reset_timeout"])
+    
+    def retry_delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        计算第 attempt 次失败（从1开始）后的等待时间
+        
+        Returns:
+            等待秒数；Retry-After 超过上限时返回None，表示应换下一个模型
+        """
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        # 全抖动：在 [0, min(max_delay, base * 2^(n-1))] 中随机取值，避免客户端同时重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期）"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器
+    
+    closed：正常请求；连续失败达到阈值后进入 open，期间拒绝请求；
+    reset_timeout 之后进入 half_open，只放行一个试探请求，成功则恢复 closed，失败则重新 open。
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        # 正在进行的试探请求的开始时间；试探请求被取消而没有结果时，超过 reset_timeout 后允许新的试探
+        self._probe_started: Optional[float] = None
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+    
+    def allow(self) -> bool:
+        """是否可以向该模型发出请求"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "closed":
+                return True
+            if state == "half_open" and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                return True
+            return False
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probe_started is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probe_started = None
+    
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
@@ -0,0 +1,272 @@
+# backend/app/services/llm/response_cache.py
+"""
+LLM回答缓存
+
+以模型、生成参数和规范化后的消息列表的哈希为键，相同上下文的相同问题（重新生成分支、重试、演示会话）
+直接返回之前的回答。分两层：进程内LRU和磁盘上的SQLite文件，均有过期时间和容量上限。
+
+请求头 X-LLM-Cache: bypass 可以跳过本次请求的缓存查找（回答仍会写入缓存，用于刷新）。
+命中信息通过 get_llm_call_info 取出，写入助手消息的 meta_info。
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# 跳过缓存查找的请求头
+BYPASS_HEADER = "X-LLM-Cache"
+BYPASS_VALUES = ("bypass", "no-cache")
+
+# 默认缓存设置，config.json 中的 llm.cache 会覆盖对应字段
+DEFAULT_CACHE_CONFIG = {
+    "enabled": False,
+    "ttl": 24 * 3600,
+    "memory_max_entries": 1000,
+    "disk_path": "llm_cache.db",
+    "disk_max_entries": 50000,
+    "disk_max_bytes": 256 * 1024 * 1024,
+}
+
+# 当前请求是否跳过缓存查找
+_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+# 最近一次LLM调用的信息（是否命中缓存、节省的耗时和用量）
+_call_info: ContextVar[Optional[Dict[str, Any]]] = ContextVar("llm_call_info", default=None)
+
+@contextmanager
+def bypass_llm_cache(enabled: bool = True) -> Iterator[None]:
+    """在代码块内跳过LLM缓存查找"""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+def cache_bypassed() -> bool:
+    """当前请求是否跳过缓存查找"""
+    return _bypass.get()
+
+def set_llm_call_info(info: Optional[Dict[str, Any]]) -> None:
+    """记录最近一次LLM调用的信息"""
+    _call_info.set(info)
+
+def update_llm_call_info(**fields: Any) -> None:
+    """在最近一次LLM调用的信息中补充字段"""
+    _call_info.set({**(_call_info.get() or {}), **fields})
+
+def get_llm_call_info() -> Optional[Dict[str, Any]]:
+    """取出并清除最近一次LLM调用的信息"""
+    info = _call_info.get()
+    _call_info.set(None)
+    return info
+
+class LLMCacheBypassMiddleware:
+    """
+    ASGI中间件：请求带有 X-LLM-Cache: bypass 时，在整个请求处理期间跳过LLM缓存查找
+    
+    不使用 BaseHTTPMiddleware，避免每个请求额外创建任务和包装响应流
+    """
+    
+    def __init__(self, app: Any):
+        self.app = app
+    
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        header = BYPASS_HEADER.lower().encode("latin-1")
+        bypass = any(
+            name == header and value.decode("latin-1").strip().lower() in BYPASS_VALUES
+            for name, value in scope.get("headers", [])
+        )
+        with bypass_llm_cache(bypass):
+            await self.app(scope, receive, send)
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """规范化消息列表：只保留角色和内容，统一换行并去掉首尾空白"""
+    return [
+        {
+            "role": str(message.get("role", "")).strip().lower(),
+            "content": str(message.get("content") or "").replace("\r\n", "\n").strip(),
+        }
+        for message in messages
+    ]
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """根据请求负载（模型、参数、消息）计算缓存键，与是否流式无关"""
+    key_data = {name: value for name, value in payload.items() if name not in ("messages", "stream")}
+    key_data["messages"] = normalize_messages(payload.get("messages") or [])
+    encoded = json.dumps(key_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """
+    两层LLM回答缓存
+    
+    缓存值是字典：content（回答）、latency_ms（原始调用耗时）、usage（原始调用的token用量）。
+    磁盘层命中时提升到内存层。
+    """
+    
+    def __init__(self, ttl: int = DEFAULT_CACHE_CONFIG["ttl"],
+                 memory_max_entries: int = DEFAULT_CACHE_CONFIG["memory_max_entries"],
+                 disk_path: Optional[str] = DEFAULT_CACHE_CONFIG["disk_path"],
+                 disk_max_entries: int = DEFAULT_CACHE_CONFIG["disk_max_entries"],
+                 disk_max_bytes: int = DEFAULT_CACHE_CONFIG["disk_max_bytes"]):
+        """
+        Args:
+            ttl: 过期时间（秒）
+            memory_max_entries: 内存层最大条目数
+            disk_path: SQLite文件路径，为None时只使用内存层
+            disk_max_entries: 磁盘层最大条目数
+            disk_max_bytes: 磁盘层缓存值的最大总字节数
+        """
+        self.ttl = ttl
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._disk = self._open_disk(disk_path)
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], base_dir: str) -> "LLMResponseCache":
+        """根据 llm.cache 配置创建缓存，相对路径相对于 base_dir"""
+        options = {**DEFAULT_CACHE_CONFIG, **config}
+        disk_path = options["disk_path"]
+        if disk_path and disk_path != ":memory:" and not path.isabs(disk_path):
+            disk_path = path.join(base_dir, disk_path)
+        return cls(
+            ttl=int(options["ttl"]),
+            memory_max_entries=int(options["memory_max_entries"]),
+            disk_path=disk_path,
+            disk_max_entries=int(options["disk_max_entries"]),
+            disk_max_bytes=int(options["disk_max_bytes"]),
+        )
+    
+    def _open_disk(self, disk_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_llm_response_cache_accessed_at "
+            "ON llm_response_cache (accessed_at)"
+        )
+        return conn
+    
+    def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        查找缓存
+        
+        Returns:
+            (缓存值, 命中的层 "memory"/"disk")，未命中时返回 (None, None)
+        """
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return value, "memory"
+                del self._memory[key]
+            
+            if self._disk is None:
+                return None, None
+            row = self._disk.execute(
+                "SELECT value, expires_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            if row[1] <= now:
+                self._disk.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                return None, None
+            
+            self._disk.execute("UPDATE llm_response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            value = json.loads(row[0])
+            self._set_memory(key, row[1], value)
+            return value, "disk"
+    
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """写入两层缓存，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        expires_at = now + self.ttl
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._set_memory(key, expires_at, value)
+            if self._disk is None or len(encoded) > self.disk_max_bytes:
+                return
+            self._disk.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, len(encoded), expires_at, now)
+            )
+            self._prune_disk(now)
+    
+    def clear(self) -> None:
+        """清空两层缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM llm_response_cache")
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存条目数和磁盘占用，用于监控"""
+        with self._lock:
+            stats = {"memory_entries": len(self._memory), "disk_entries": 0, "disk_bytes": 0}
+            if self._disk is not None:
+                count, size = self._disk.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_response_cache"
+                ).fetchone()
+                stats.update({"disk_entries": count, "disk_bytes": size})
+            return stats
+    
+    def close(self) -> None:
+        """关闭磁盘层连接"""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+    
+    def _set_memory(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        """写入内存层（调用方需持有锁）"""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+    
+    def _prune_disk(self, now: float) -> None:
+        """删除磁盘层的过期条目，并按最近访问时间淘汰超出容量的条目（调用方需持有锁）"""
+        self._disk.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+        count, size = self._disk.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_response_cache"
+        ).fetchone()
+        if count <= self.disk_max_entries and size <= self.disk_max_bytes:
+            return
+        
+        # 从最久未访问的条目开始删除，直到条目数和总字节数都不超过上限
+        excess_count = count - self.disk_max_entries
+        excess_bytes = size - self.disk_max_bytes
+        keys = []
+        for key, entry_size in self._disk.execute(
+            "SELECT key, size FROM llm_response_cache ORDER BY accessed_at"
+        ):
+            if excess_count <= 0 and excess_bytes <= 0:
+                break
+            keys.append((key,))
+            excess_count -= 1
+            excess_bytes -= entry_size
+        self._disk.executemany("DELETE FROM llm_response_cache WHERE key = ?", keys)
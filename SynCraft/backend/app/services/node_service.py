@@ -1,10 +1,15 @@
 # backend/app/services/node_service.py
 from sqlmodel import Session, select
+from sqlalchemy import delete, func, insert, literal, update
 from app.models.node import Node
+from app.models.node_closure import NodeClosure
 from app.models.edge import Edge
+from app.models.context import Context
+from app.models.context_node import ContextNode
 from app.models.qapair import QAPair
 from app.models.message import Message
 from app.models.session import Session as SessionModel
+from app.cache.cache_manager import cache_manager
 from nanoid import generate
 from datetime import datetime
 from typing import List, Dict, Optional, Any
@@ -47,6 +52,9 @@ class NodeService:
         
         print(f"节点创建成功（未提交）: id={node.id}")
         
+        # 维护祖先关系闭包表
+        self._add_closure_rows(node.id, parent_id)
+        
         # 如果有父节点，创建边
         if parent_id:
             edge = Edge(
@@ -60,6 +68,21 @@ class NodeService:
         
         return node
     
+    def _add_closure_rows(self, node_id: str, parent_id: Optional[str] = None) -> None:
+        """为新节点写入闭包表：自身一行，并在父节点的每个祖先下各加一行"""
+        self.db.execute(
+            insert(NodeClosure).values(ancestor_id=node_id, descendant_id=node_id, depth=0)
+        )
+        if parent_id:
+            ancestors = select(
+                NodeClosure.ancestor_id,
+                literal(node_id),
+                NodeClosure.depth + 1
+            ).where(NodeClosure.descendant_id == parent_id)
+            self.db.execute(
+                insert(NodeClosure).from_select(["ancestor_id", "descendant_id", "depth"], ancestors)
+            )
+    
     def create_node(self, session_id: str, parent_id: Optional[str] = None, template_key: Optional[str] = None, label: Optional[str] = None, type: str = "normal") -> Node:
         """创建一个新节点"""
         # 使用不提交版本的方法创建节点
@@ -93,7 +116,7 @@ class NodeService:
         qa_data = []
         for qa_pair in qa_pairs:
             # 查询消息
-            query = select(Message).where(Message.qa_pair_id == qa_pair.id).order_by(Message.timestamp)
+            query = select(Message).where(Message.qa_pair_id == qa_pair.id).order_by(Message.seq, Message.timestamp)
             messages = self.db.exec(query).all()
             
             qa_data.append({
@@ -160,52 +183,95 @@ class NodeService:
     
     def delete_node(self, node_id: str) -> bool:
         """删除节点及其子节点"""
+        return self.delete_subtree(node_id) is not None
+    
+    def _subtree_ids(self, node_id: str):
+        """以节点为根的子树中所有节点ID的递归CTE查询"""
+        subtree = select(Node.id).where(Node.id == node_id).cte("subtree", recursive=True)
+        # UNION 去重，父节点指针成环时也能结束
+        subtree = subtree.union(
+            select(Node.id).join(subtree, Node.parent_id == subtree.c.id)
+        )
+        return select(subtree.c.id)
+    
+    def delete_subtree(self, node_id: str) -> Optional[Dict[str, int]]:
+        """
+        批量删除节点及其所有后代节点
+        
+        用递归CTE找出子树，按依赖顺序对每张表执行一条 DELETE ... WHERE ... IN (子查询)，
+        全部在一个事务中完成，失败时整体回滚。
+        
+        Returns:
+            各类记录的删除数量，节点不存在时返回None
+        """
         node = self.db.get(Node, node_id)
         if not node:
-            return False
-        
-        # 递归删除子节点
-        self._delete_node_recursive(node_id)
+            return None
+        session_id = node.session_id
         
-        return True
-    
-    def _delete_node_recursive(self, node_id: str) -> None:
-        """递归删除节点及其子节点"""
-        # 查询子节点
-        query = select(Node).where(Node.parent_id == node_id)
-        children = self.db.exec(query).all()
+        parent_id = node.parent_id
         
-        # 递归删除子节点
-        for child in children:
-            self._delete_node_recursive(child.id)
+        subtree_ids = self._subtree_ids(node_id)
+        qa_pair_ids = select(QAPair.id).where(QAPair.node_id.in_(subtree_ids))
+        # 以子树中节点为根的上下文随子树一起删除
+        context_ids = select(Context.id).where(Context.context_root_node_id.in_(subtree_ids))
         
-        # 删除关联的边
-        query = select(Edge).where((Edge.source == node_id) | (Edge.target == node_id))
-        edges = self.db.exec(query).all()
-        for edge in edges:
-            self.db.delete(edge)
+        # 外键约束下不能留下引用子树节点的记录：其余上下文的活动节点退回到子树的父节点，
+        # 根节点被删除的会话不再指向它
+        references = [
+            update(Context).where(Context.active_node_id.in_(subtree_ids)).values(active_node_id=parent_id),
+            update(SessionModel).where(SessionModel.root_node_id.in_(subtree_ids)).values(root_node_id=None),
+        ]
         
-        # 删除关联的QA对
-        query = select(QAPair).where(QAPair.node_id == node_id)
-        qa_pairs = self.db.exec(query).all()
-        for qa_pair in qa_pairs:
-            # 删除关联的消息
-            query = select(Message).where(Message.qa_pair_id == qa_pair.id)
-            messages = self.db.exec(query).all()
-            for message in messages:
-                self.db.delete(message)
-            
-            self.db.delete(qa_pair)
+        # 先删除引用节点的记录，最后删除节点本身
+        statements = [
+            ("messages", delete(Message).where(Message.qa_pair_id.in_(qa_pair_ids))),
+            ("qa_pairs", delete(QAPair).where(QAPair.node_id.in_(subtree_ids))),
+            ("edges", delete(Edge).where(Edge.source.in_(subtree_ids) | Edge.target.in_(subtree_ids))),
+            ("context_nodes", delete(ContextNode).where(
+                ContextNode.node_id.in_(subtree_ids) | ContextNode.context_id.in_(context_ids)
+            )),
+            ("contexts", delete(Context).where(Context.id.in_(context_ids))),
+            ("closure_rows", delete(NodeClosure).where(NodeClosure.descendant_id.in_(subtree_ids))),
+            ("nodes", delete(Node).where(Node.id.in_(subtree_ids))),
+        ]
         
-        # 删除节点
-        node = self.db.get(Node, node_id)
-        if node:
-            self.db.delete(node)
+        counts = {}
+        try:
+            for statement in references:
+                self.db.execute(statement.execution_options(synchronize_session=False))
+            for name, statement in statements:
+                # synchronize_session="fetch" 会把会话中已加载的对应对象标记为已删除
+                result = self.db.execute(statement.execution_options(synchronize_session="fetch"))
+                counts[name] = result.rowcount
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print(f"删除子树失败: node_id={node_id}, error={e}")
+            raise
         
-        self.db.commit()
+        cache_manager.invalidate_tags(f"session:{session_id}")
+        print(f"子树删除成功: node_id={node_id}, counts={counts}")
+        return counts
     
     def get_node_path(self, node_id: str) -> List[Node]:
         """获取从根节点到指定节点的路径"""
+        query = (
+            select(Node)
+            .join(NodeClosure, NodeClosure.ancestor_id == Node.id)
+            .where(NodeClosure.descendant_id == node_id)
+            .order_by(NodeClosure.depth.desc())
+        )
+        path = list(self.db.exec(query).all())
+        
+        # 闭包表中没有完整路径（建立索引前创建的节点），沿父节点指针查找
+        if not path or path[0].parent_id:
+            return self._get_node_path_by_parent(node_id)
+        
+        return path
+    
+    def _get_node_path_by_parent(self, node_id: str) -> List[Node]:
+        """沿父节点指针逐级获取路径"""
         path = []
         current_node = self.db.get(Node, node_id)
         
@@ -217,16 +283,67 @@ class NodeService:
         
         return path
     
+    def get_node_depth(self, node_id: str) -> Optional[int]:
+        """获取节点深度，根节点为0，节点不存在时返回None"""
+        node = self.db.get(Node, node_id)
+        if not node:
+            return None
+        if not node.parent_id:
+            return 0
+        
+        query = select(func.max(NodeClosure.depth)).where(NodeClosure.descendant_id == node_id)
+        depth = self.db.exec(query).one()
+        if not depth:
+            # 闭包表中没有该节点的祖先记录
+            return len(self._get_node_path_by_parent(node_id)) - 1
+        return depth
+    
     def get_node_children(self, node_id: str) -> List[Node]:
         """获取节点的直接子节点"""
         query = select(Node).where(Node.parent_id == node_id).order_by(Node.created_at)
         return self.db.exec(query).all()
     
+    def get_children_by_level(self, node_id: str, depth: int) -> Dict[str, List[Node]]:
+        """
+        逐层（广度优先）获取节点下 depth 层内的后代节点，每层一次查询
+        
+        Returns:
+            父节点ID到其直接子节点列表（按创建时间排序）的映射
+        """
+        children_map: Dict[str, List[Node]] = {}
+        frontier = [node_id]
+        
+        for _ in range(depth):
+            if not frontier:
+                break
+            for parent_id in frontier:
+                children_map[parent_id] = []
+            
+            query = select(Node).where(Node.parent_id.in_(frontier)).order_by(Node.created_at)
+            children = self.db.exec(query).all()
+            for child in children:
+                children_map[child.parent_id].append(child)
+            frontier = [child.id for child in children]
+        
+        return children_map
+    
     def get_node_descendants(self, node_id: str) -> List[Node]:
-        """获取节点的所有后代节点"""
-        descendants = []
-        self._get_descendants_recursive(node_id, descendants)
-        return descendants
+        """获取节点的所有后代节点，按层级和创建时间排序"""
+        query = (
+            select(Node, NodeClosure.depth)
+            .join(NodeClosure, NodeClosure.descendant_id == Node.id)
+            .where(NodeClosure.ancestor_id == node_id)
+            .order_by(NodeClosure.depth, Node.created_at)
+        )
+        rows = self.db.exec(query).all()
+        
+        # 闭包表中没有该节点（建立索引前创建的节点），逐级查询
+        if not rows:
+            descendants = []
+            self._get_descendants_recursive(node_id, descendants)
+            return descendants
+        
+        return [node for node, depth in rows if depth > 0]
     
     def _get_descendants_recursive(self, node_id: str, descendants: List[Node]) -> None:
         """递归获取节点的所有后代节点"""
@@ -234,3 +351,52 @@ class NodeService:
         for child in children:
             descendants.append(child)
             self._get_descendants_recursive(child.id, descendants)
+    
+    def get_subtree_count(self, node_id: str) -> int:
+        """获取以节点为根的子树中的节点数（包括节点自身），节点不存在时返回0"""
+        query = select(func.count()).select_from(NodeClosure).where(NodeClosure.ancestor_id == node_id)
+        count = self.db.exec(query).one()
+        if count:
+            return count
+        
+        if not self.db.get(Node, node_id):
+            return 0
+        return len(self.get_node_descendants(node_id)) + 1
+    
+    def rebuild_node_closure(self, max_depth: int = 10000) -> int:
+        """
+        根据父节点指针重建闭包表，用于为已有数据库补建索引
+        
+        Args:
+            max_depth: 最大深度，防止父节点指针成环时无限递归
+        
+        Returns:
+            写入的闭包表记录数
+        """
+        closure = select(
+            Node.id.label("ancestor_id"),
+            Node.id.label("descendant_id"),
+            literal(0).label("depth")
+        ).cte("closure", recursive=True)
+        closure = closure.union_all(
+            select(closure.c.ancestor_id, Node.id, closure.c.depth + 1)
+            .join(Node, Node.parent_id == closure.c.descendant_id)
+            .where(closure.c.depth < max_depth)
+        )
+        
+        try:
+            self.db.execute(delete(NodeClosure))
+            self.db.execute(
+                insert(NodeClosure).from_select(
+                    ["ancestor_id", "descendant_id", "depth"],
+                    select(closure.c.ancestor_id, closure.c.descendant_id, closure.c.depth)
+                )
+            )
+            count = self.db.exec(select(func.count()).select_from(NodeClosure)).one()
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        print(f"节点闭包表重建完成: {count} 条记录")
+        return count
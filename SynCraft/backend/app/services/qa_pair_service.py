@@ -1,14 +1,31 @@
 # backend/app/services/qa_pair_service.py
 from sqlmodel import Session, select
+from sqlalchemy import func, literal, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import Select
 from app.models.qapair import QAPair
 from app.models.message import Message
 from app.models.node import Node
 from app.models.session import Session as SessionModel
-from app.services.llm import get_llm_service
-from app.utils.prompt import build_prompt
+from app.database.fts import FTS_MIN_QUERY_LENGTH, fts_available, match_qa_pairs
+from app.services.llm import get_llm_service, get_llm_call_info, set_llm_call_info
+from app.services.summary_service import schedule_summary
+from app.utils.prompt import PromptBuilder, render_prompt
 from nanoid import generate
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Any, Iterable, Tuple, AsyncIterator, Callable, Set
+from os import getenv
+import asyncio
+import time
+
+# 流式提问预留幂等键后多久（秒）仍没有回答时，视为请求已中断（如进程退出），允许重试
+IDEMPOTENCY_PENDING_TIMEOUT = int(getenv("IDEMPOTENCY_PENDING_TIMEOUT", "600"))
+
+class IdempotencyKeyInProgress(ValueError):
+    """使用该幂等键的请求仍在生成回答"""
+
+# 客户端断开后仍在保存回答的后台任务，保留引用以免任务被垃圾回收
+_background_tasks: Set["asyncio.Task[Any]"] = set()
 
 class QAPairService:
     def __init__(self, db: Session):
@@ -16,45 +33,120 @@ class QAPairService:
         self.llm_service = get_llm_service()
     
     def create_qa_pair(self, node_id: str, question: str, answer: Optional[str] = None, 
-                      status: Optional[str] = None) -> Dict[str, Any]:
-        """创建一个新的QA对"""
+                      status: Optional[str] = None, answer_meta_info: Optional[Dict] = None,
+                      idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """创建一个新的QA对，answer_meta_info 写入助手消息的 meta_info"""
         # 验证节点存在
         node = self.db.get(Node, node_id)
         if not node:
             raise ValueError(f"Node with id {node_id} not found")
         
-        # 创建QA对
+        # QA对和消息在一个事务中写入
         qa_pair = QAPair(
             node_id=node_id,
             session_id=node.session_id,
-            status=status
+            status=status,
+            idempotency_key=idempotency_key
         )
-        self.db.add(qa_pair)
-        self.db.commit()
-        self.db.refresh(qa_pair)
-        
-        # 创建用户消息
-        user_message = Message(
-            qa_pair_id=qa_pair.id,
-            role="user",
-            content=question
-        )
-        self.db.add(user_message)
-        self.db.commit()
-        
-        # 如果提供了回答，创建助手消息
-        if answer:
-            assistant_message = Message(
+        try:
+            self.db.add(qa_pair)
+            # 消息外键引用QA对，先写入QA对
+            self.db.flush()
+            
+            # 创建用户消息
+            self.db.add(Message(
                 qa_pair_id=qa_pair.id,
-                role="assistant",
-                content=answer
-            )
-            self.db.add(assistant_message)
+                role="user",
+                content=question,
+                seq=0
+            ))
+            
+            # 如果提供了回答，创建助手消息
+            if answer:
+                self.db.add(Message(
+                    qa_pair_id=qa_pair.id,
+                    role="assistant",
+                    content=answer,
+                    meta_info=answer_meta_info or {},
+                    seq=1
+                ))
+            
             self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
         
         # 返回QA对信息，包括消息
         return self.get_qa_pair_with_messages(qa_pair.id)
     
+    def get_idempotent_qa_pair(self, idempotency_key: Optional[str], node_id: str,
+                               question: str) -> Optional[Dict[str, Any]]:
+        """
+        按幂等键查找已保存的提问结果
+        
+        只有成功回答的QA对会被重放；回答失败或中途取消的QA对释放幂等键，重试时重新生成。
+        
+        Returns:
+            QA对详情，没有使用过该幂等键（或之前的请求没有成功）时返回None
+        
+        Raises:
+            IdempotencyKeyInProgress: 使用该幂等键的流式提问还没有完成
+            ValueError: 幂等键已用于其他节点或其他问题
+        """
+        if not idempotency_key:
+            return None
+        qa_pair_id = self.db.exec(
+            select(QAPair.id).where(QAPair.idempotency_key == idempotency_key)
+        ).first()
+        if qa_pair_id is None:
+            return None
+        
+        result = self.get_qa_pair_with_messages(qa_pair_id)
+        saved_question = next((m["content"] for m in result["messages"] if m["role"] == "user"), None)
+        if result["node_id"] != node_id or saved_question != question:
+            raise ValueError(f"Idempotency-Key {idempotency_key} has been used for a different question")
+        
+        answer = next((m for m in reversed(result["messages"]) if m["role"] == "assistant"), None)
+        if answer is None:
+            if datetime.utcnow() - result["created_at"] < timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT):
+                raise IdempotencyKeyInProgress(f"Request with Idempotency-Key {idempotency_key} is still in progress")
+        else:
+            meta_info = answer["meta_info"] or {}
+            if not meta_info.get("error") and not meta_info.get("cancelled"):
+                return result
+        
+        self._release_idempotency_key(qa_pair_id)
+        return None
+    
+    def _release_idempotency_key(self, qa_pair_id: str) -> None:
+        """解除QA对与幂等键的绑定，QA对本身保留"""
+        qa_pair = self.db.get(QAPair, qa_pair_id)
+        if qa_pair is None or qa_pair.idempotency_key is None:
+            return
+        qa_pair.idempotency_key = None
+        self.db.add(qa_pair)
+        self.db.commit()
+    
+    def _save_answer(self, node_id: str, question: str, answer: Optional[str],
+                     answer_meta_info: Optional[Dict], idempotency_key: Optional[str]) -> Tuple[Dict[str, Any], bool]:
+        """
+        保存提问结果
+        
+        带相同幂等键的并发重试请求先保存时，返回已保存的QA对
+        
+        Returns:
+            (QA对详情, 是否新建)
+        """
+        try:
+            return self.create_qa_pair(
+                node_id, question, answer, answer_meta_info=answer_meta_info, idempotency_key=idempotency_key
+            ), True
+        except IntegrityError:
+            existing = self.get_idempotent_qa_pair(idempotency_key, node_id, question)
+            if existing is None:
+                raise
+            return existing, False
+    
     def get_qa_pair(self, qa_pair_id: str) -> Optional[QAPair]:
         """获取QA对详情"""
         return self.db.get(QAPair, qa_pair_id)
@@ -66,7 +158,7 @@ class QAPairService:
             return None
         
         # 查询消息
-        query = select(Message).where(Message.qa_pair_id == qa_pair_id).order_by(Message.timestamp)
+        query = select(Message).where(Message.qa_pair_id == qa_pair_id).order_by(Message.seq, Message.timestamp)
         messages = self.db.exec(query).all()
         
         return {
@@ -125,6 +217,8 @@ class QAPairService:
         messages = self.db.exec(query).all()
         for message in messages:
             self.db.delete(message)
+        # 外键约束下先删除消息
+        self.db.flush()
         
         # 删除QA对
         self.db.delete(qa_pair)
@@ -135,50 +229,93 @@ class QAPairService:
     def add_message(self, qa_pair_id: str, role: str, content: str, 
                    meta_info: Optional[Dict] = None) -> Message:
         """向QA对添加消息"""
+        return self.add_messages(qa_pair_id, [{"role": role, "content": content, "meta_info": meta_info}])[0]
+    
+    def add_messages(self, qa_pair_id: str, messages: List[Dict[str, Any]]) -> List[Message]:
+        """
+        向QA对批量添加消息，用于导入多轮对话
+        
+        所有消息和QA对的更新时间在一个事务中写入，顺序号按列表顺序连续递增
+        
+        Args:
+            qa_pair_id: QA对ID
+            messages: 消息列表，每项包含 role、content，可选 meta_info、timestamp
+        """
         # 验证QA对存在
         qa_pair = self.db.get(QAPair, qa_pair_id)
         if not qa_pair:
             raise ValueError(f"QA pair with id {qa_pair_id} not found")
-        
-        # 保存原始更新时间
-        original_updated_at = qa_pair.updated_at
-        
-        # 创建消息
-        message = Message(
-            qa_pair_id=qa_pair_id,
-            role=role,
-            content=content,
-            meta_info=meta_info or {}
-        )
-        self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
-        
-        # 确保更新时间有变化
-        import time
-        time.sleep(0.001)  # 添加小延迟确保时间戳不同
-        
-        # 更新QA对的更新时间 - 在单独的事务中更新
-        qa_pair = self.db.get(QAPair, qa_pair_id)  # 重新获取QA对
-        qa_pair.updated_at = datetime.utcnow()
+        if not messages:
+            return []
+        
+        # 接在已有消息之后
+        query = select(func.max(Message.seq)).where(Message.qa_pair_id == qa_pair_id)
+        last_seq = self.db.exec(query).one()
+        next_seq = 0 if last_seq is None else last_seq + 1
+        
+        created = []
+        for offset, data in enumerate(messages):
+            message = Message(
+                qa_pair_id=qa_pair_id,
+                role=data["role"],
+                content=data["content"],
+                meta_info=data.get("meta_info") or {},
+                seq=next_seq + offset
+            )
+            if data.get("timestamp"):
+                message.timestamp = data["timestamp"]
+            self.db.add(message)
+            created.append(message)
+        
+        # 更新QA对的更新时间，时钟精度不足时也保证严格递增
+        now = datetime.utcnow()
+        qa_pair.updated_at = max(now, qa_pair.updated_at + timedelta(microseconds=1))
         self.db.add(qa_pair)
-        self.db.commit()
         
-        return message
+        message_ids = [message.id for message in created]
+        try:
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        # 提交后对象已过期，一次查询重新加载
+        query = select(Message).where(Message.id.in_(message_ids)).order_by(Message.seq)
+        return list(self.db.exec(query).all())
     
     def get_node_qa_pairs(self, node_id: str) -> List[Dict[str, Any]]:
         """获取节点的所有QA对"""
+        return self.get_qa_pairs_for_nodes([node_id]).get(node_id, [])
+    
+    def get_qa_pairs_for_nodes(self, node_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量获取一组节点的QA对及消息，查询次数与节点和QA对数量无关
+        
+        Returns:
+            节点ID到QA对列表的映射，每个节点都有对应的键，没有QA对时为空列表
+        """
+        result: Dict[str, List[Dict[str, Any]]] = {node_id: [] for node_id in node_ids}
+        if not node_ids:
+            return result
+        
         # 查询QA对
-        query = select(QAPair).where(QAPair.node_id == node_id).order_by(QAPair.created_at)
+        query = select(QAPair).where(QAPair.node_id.in_(node_ids)).order_by(QAPair.created_at)
         qa_pairs = self.db.exec(query).all()
+        if not qa_pairs:
+            return result
+        
+        # 一次查询所有QA对的消息
+        query = (
+            select(Message)
+            .where(Message.qa_pair_id.in_([qa_pair.id for qa_pair in qa_pairs]))
+            .order_by(Message.seq, Message.timestamp)
+        )
+        messages_by_pair: Dict[str, List[Message]] = {}
+        for msg in self.db.exec(query).all():
+            messages_by_pair.setdefault(msg.qa_pair_id, []).append(msg)
         
-        result = []
         for qa_pair in qa_pairs:
-            # 查询消息
-            query = select(Message).where(Message.qa_pair_id == qa_pair.id).order_by(Message.timestamp)
-            messages = self.db.exec(query).all()
-            
-            result.append({
+            result[qa_pair.node_id].append({
                 "id": qa_pair.id,
                 "created_at": qa_pair.created_at,
                 "updated_at": qa_pair.updated_at,
@@ -192,12 +329,116 @@ class QAPairService:
                         "content": msg.content,
                         "timestamp": msg.timestamp
                     }
-                    for msg in messages
+                    for msg in messages_by_pair.get(qa_pair.id, [])
                 ]
             })
         
         return result
     
+    @staticmethod
+    def summarize_qa_pairs(qa_pairs_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """从QA对数据中提取问题和回答（取最后一条用户消息和最后一条助手消息）"""
+        qa_pairs_info = []
+        for qa_pair in qa_pairs_data:
+            question = None
+            answer = None
+            
+            for message in qa_pair["messages"]:
+                if message["role"] == "user":
+                    question = message["content"]
+                elif message["role"] == "assistant":
+                    answer = message["content"]
+            
+            qa_pairs_info.append({
+                "id": qa_pair["id"],
+                "question": question or "",
+                "answer": answer
+            })
+        return qa_pairs_info
+    
+    def get_message_timeline(self, node_ids: Optional[List[str]] = None, session_id: Optional[str] = None,
+                             after_timestamp: Optional[datetime] = None,
+                             limit: Optional[int] = None, after_seq: Optional[int] = None,
+                             after_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        按时间顺序获取一组节点（或整个会话）的消息
+        
+        使用单个Message⋈QAPair查询并在数据库中排序，支持基于 (timestamp, seq, id) 的游标分页，
+        时间戳相同的消息跨页时不会被跳过
+        
+        Args:
+            node_ids: 节点ID集合，为None时不按节点过滤
+            session_id: 会话ID，按节点所属会话过滤
+            after_timestamp: 游标，只返回排在该位置之后的消息
+            limit: 每页数量，为None时返回全部
+            after_seq: 游标中的消息顺序号，与after_id一起提供
+            after_id: 游标中的消息ID；未提供after_seq和after_id时只按时间戳比较
+        
+        Returns:
+            包含total、items、has_more和下一页游标（next_after_timestamp、next_after_seq、next_after_id）的字典
+        """
+        if node_ids is not None and not node_ids:
+            return {"total": 0, "items": [], "has_more": False, "next_after_timestamp": None,
+                    "next_after_seq": None, "next_after_id": None}
+        
+        # 构建过滤条件
+        conditions = []
+        if node_ids is not None:
+            conditions.append(QAPair.node_id.in_(list(node_ids)))
+        if session_id:
+            conditions.append(QAPair.node_id.in_(select(Node.id).where(Node.session_id == session_id)))
+        
+        # 总数不受游标影响
+        count_query = select(func.count(Message.id)).join(QAPair, Message.qa_pair_id == QAPair.id).where(*conditions)
+        total = self.db.exec(count_query).one()
+        
+        query = (
+            select(Message, QAPair.node_id, QAPair.tags)
+            .join(QAPair, Message.qa_pair_id == QAPair.id)
+            .where(*conditions)
+        )
+        if after_timestamp is not None:
+            if after_seq is not None and after_id is not None:
+                # 复合游标与排序键一致
+                query = query.where(
+                    tuple_(Message.timestamp, Message.seq, Message.id) > tuple_(after_timestamp, after_seq, after_id)
+                )
+            else:
+                query = query.where(Message.timestamp > after_timestamp)
+        query = query.order_by(Message.timestamp, Message.seq, Message.id)
+        
+        # 多取一条用于判断是否还有下一页
+        if limit is not None:
+            query = query.limit(limit + 1)
+        rows = self.db.exec(query).all()
+        
+        has_more = limit is not None and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
+        
+        items = [
+            {
+                "id": message.id,
+                "qa_pair_id": message.qa_pair_id,
+                "node_id": node_id,
+                "role": message.role,
+                "content": message.content,
+                "timestamp": message.timestamp,
+                "tags": tags
+            }
+            for message, node_id, tags in rows
+        ]
+        last = rows[-1][0] if has_more else None
+        
+        return {
+            "total": total,
+            "items": items,
+            "has_more": has_more,
+            "next_after_timestamp": last.timestamp if last else None,
+            "next_after_seq": last.seq if last else None,
+            "next_after_id": last.id if last else None
+        }
+    
     def increment_view_count(self, qa_pair_id: str) -> Optional[QAPair]:
         """增加QA对的查看次数"""
         qa_pair = self.db.get(QAPair, qa_pair_id)
@@ -212,75 +453,331 @@ class QAPairService:
         
         return qa_pair
     
-    def ask_question(self, node_id: str, question: str) -> Dict[str, Any]:
-        """提问并获取回答"""
+    def ask_question(self, node_id: str, question: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        提问并获取回答
+        
+        带幂等键的请求如果已经保存过，直接返回之前的QA对，不再调用LLM
+        """
+        replay = self.get_idempotent_qa_pair(idempotency_key, node_id, question)
+        if replay is not None:
+            return replay
+        
+        messages = self._prepare_messages(node_id, question)
+        
+        # 调用LLM获取回答，同步接口只接受文本，把消息列表渲染为提示词
+        set_llm_call_info(None)
+        answer = self._fallback_answer(self.llm_service.call_llm(render_prompt(messages)), question)
+        
+        # 创建QA对和消息，记录是否命中LLM缓存
+        result, created = self._save_answer(node_id, question, answer, get_llm_call_info(), idempotency_key)
+        if created:
+            self._schedule_summary(node_id, result["id"])
+        return result
+    
+    async def ask_question_async(self, node_id: str, question: str,
+                                 idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        异步提问并获取回答
+        
+        等待LLM期间不占用线程池线程；前后的数据库读写都很短，交给线程执行以免阻塞事件循环。
+        同一个服务实例（数据库会话）不应被多个并发任务共享。
+        带幂等键的请求如果已经保存过，直接返回之前的QA对。
+        """
+        replay = await asyncio.to_thread(self.get_idempotent_qa_pair, idempotency_key, node_id, question)
+        if replay is not None:
+            return replay
+        
+        messages = await asyncio.to_thread(self._release_after, self._prepare_messages, node_id, question)
+        
+        # 调用LLM获取回答，历史问答作为上下文消息传入；相同的并发请求由LLM服务合并为一次上游调用
+        set_llm_call_info(None)
+        answer = self._fallback_answer(await self.llm_service.ask(question, messages[:-1]), question)
+        
+        # 创建QA对和消息，记录是否命中LLM缓存
+        result, created = await asyncio.to_thread(
+            self._save_answer, node_id, question, answer, get_llm_call_info(), idempotency_key
+        )
+        if created:
+            self._schedule_summary(node_id, result["id"])
+        return result
+    
+    def _prepare_messages(self, node_id: str, question: str) -> List[Dict[str, str]]:
+        """
+        验证节点并构建发给LLM的消息列表
+        
+        历史上下文取自根节点到当前节点的祖先链，一次查询获取，按token预算截取，最后一条是当前问题
+        """
         # 验证节点存在
         node = self.db.get(Node, node_id)
         if not node:
             raise ValueError(f"Node with id {node_id} not found")
         
-        # 获取父节点（如果有）
-        parent = None
-        if node.parent_id:
-            parent = self.db.get(Node, node.parent_id)
-        
-        # 构建提示词
-        prompt = build_prompt(parent, question)
-        
-        # 调用LLM获取回答
-        answer = self.llm_service.call_llm(prompt)
+        return PromptBuilder(self.db).build_messages(node_id, question)
+    
+    def _schedule_summary(self, node_id: str, qa_pair_id: str) -> None:
+        """回答保存后，在后台队列中增量更新节点摘要，不阻塞当前请求"""
+        schedule_summary(self.db.get_bind(), node_id, qa_pair_id)
+    
+    def _release_after(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        执行一段数据库操作后结束当前事务，把连接归还连接池
+        
+        在等待LLM之前调用：否则读操作开启的事务会让每个进行中的提问一直占用一个连接，
+        并发提问数会被连接池大小限制。
+        """
+        result = func(*args)
+        self.db.commit()
+        return result
+    
+    @staticmethod
+    def _fallback_answer(answer: Any, question: str) -> str:
+        """LLM返回空内容时使用默认回复"""
         if not answer or not isinstance(answer, str) or not answer.strip():
             # 兜底：LLM异常时给出默认回复
-            answer = "AI暂时无法回答，请稍后再试。"
-            print(f"[QAPairService.ask_question] LLM返回内容为空，已用默认回复。prompt={prompt}")
-
-        # 创建QA对和消息
-        return self.create_qa_pair(node_id, question, answer)
+            print(f"[QAPairService] LLM返回内容为空，已用默认回复。question={question}")
+            return "AI暂时无法回答，请稍后再试。"
+        return answer
+    
+    async def ask_question_stream(self, node_id: str, question: str,
+                                  idempotency_key: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式提问
+        
+        先保存QA对和用户消息（同时预留幂等键），再逐段转发LLM回答，结束时一次性保存助手消息。
+        依次产生以下事件：
+        - {"event": "start", "data": {"qa_pair_id": ...}}
+        - {"event": "token", "data": {"content": ...}}（多次）
+        - {"event": "done", "data": QA对详情} 或 {"event": "error", "data": {"detail": ...}}
+        
+        助手消息的 meta_info 记录首个token延迟和总耗时（毫秒）。
+        带幂等键的请求如果已经成功回答过，只产生 start 和 done 事件，返回之前的QA对；
+        仍在回答时产生 error 事件。回答失败或客户端断开时释放幂等键，重试时重新生成。
+        """
+        try:
+            replay = await asyncio.to_thread(self.get_idempotent_qa_pair, idempotency_key, node_id, question)
+            if replay is None:
+                messages = await asyncio.to_thread(self._prepare_messages, node_id, question)
+                qa_pair, created = await asyncio.to_thread(
+                    self._release_after, self._save_answer, node_id, question, None, None, idempotency_key
+                )
+                if not created:
+                    replay = qa_pair
+        except IdempotencyKeyInProgress as e:
+            yield {"event": "error", "data": {"detail": str(e)}}
+            return
+        
+        if replay is not None:
+            yield {"event": "start", "data": {"qa_pair_id": replay["id"]}}
+            yield {"event": "done", "data": replay}
+            return
+        
+        chunks: List[str] = []
+        first_token_latency = None
+        error = None
+        started = time.perf_counter()
+        set_llm_call_info(None)
+        
+        try:
+            yield {"event": "start", "data": {"qa_pair_id": qa_pair["id"]}}
+            async for chunk in self.llm_service.stream(question, messages[:-1]):
+                if first_token_latency is None:
+                    first_token_latency = (time.perf_counter() - started) * 1000
+                chunks.append(chunk)
+                yield {"event": "token", "data": {"content": chunk}}
+        except ValueError as e:
+            error = str(e)
+            print(f"[QAPairService.ask_question_stream] 流式回答失败: {error}")
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端中途断开：生成器正在关闭，不能再等待，在后台线程中保存已收到的部分回答
+            meta_info = self._stream_meta_info(started, first_token_latency)
+            meta_info.update({"incomplete": True, "cancelled": True})
+            args = (self.db.get_bind(), qa_pair["id"], "".join(chunks), meta_info)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 事件循环已经关闭，不会再阻塞其他请求
+                self._save_cancelled_answer(*args)
+                raise
+            task = loop.create_task(asyncio.to_thread(self._save_cancelled_answer, *args))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            raise
+        
+        meta_info = self._stream_meta_info(started, first_token_latency)
+        meta_info.update(get_llm_call_info() or {})
+        answer = "".join(chunks)
+        if error:
+            meta_info["error"] = error
+            # 已经收到的部分回答仍然保存，方便用户查看
+            meta_info["incomplete"] = bool(answer)
+        # 失败或为空的回答（使用默认回复）不作为幂等结果重放
+        failed = bool(error) or not answer.strip()
+        answer = self._fallback_answer(answer, question)
+        
+        await asyncio.to_thread(self.add_message, qa_pair["id"], "assistant", answer, meta_info)
+        if failed:
+            await asyncio.to_thread(self._release_idempotency_key, qa_pair["id"])
+        
+        if error:
+            yield {"event": "error", "data": {"detail": error, "qa_pair_id": qa_pair["id"]}}
+        else:
+            result = await asyncio.to_thread(self.get_qa_pair_with_messages, qa_pair["id"])
+            self._schedule_summary(node_id, qa_pair["id"])
+            yield {"event": "done", "data": result}
+    
+    @staticmethod
+    def _save_cancelled_answer(bind: Any, qa_pair_id: str, answer: str, meta_info: Dict[str, Any]) -> None:
+        """
+        保存客户端断开时已收到的部分回答
+        
+        使用独立的数据库会话，请求的会话此时可能已经关闭。还没有收到任何内容时删除只有问题的QA对；
+        两种情况都会释放幂等键，重试时重新生成。
+        """
+        try:
+            with Session(bind) as db:
+                service = QAPairService(db)
+                if answer:
+                    service.add_message(qa_pair_id, "assistant", answer, meta_info)
+                    service._release_idempotency_key(qa_pair_id)
+                else:
+                    service.delete_qa_pair(qa_pair_id)
+        except Exception as e:
+            print(f"[QAPairService] 保存中断的流式回答失败: qa_pair_id={qa_pair_id}, error={e}")
+    
+    @staticmethod
+    def _stream_meta_info(started: float, first_token_latency: Optional[float]) -> Dict[str, Any]:
+        """生成流式回答的耗时信息（毫秒）"""
+        return {
+            "streamed": True,
+            "first_token_latency_ms": round(first_token_latency, 2) if first_token_latency is not None else None,
+            "total_latency_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+    
+    # 搜索结果允许的排序字段
+    SEARCH_SORT_FIELDS = ("created_at", "updated_at", "rating", "view_count")
+    
+    def build_search_query(self, query: Optional[str] = None, session_id: Optional[str] = None,
+                           node_ids: Optional[Iterable[str]] = None,
+                           date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                           is_favorite: Optional[bool] = None, status: Optional[str] = None,
+                           min_rating: Optional[int] = None, max_rating: Optional[int] = None,
+                           sort_by: str = "created_at", sort_order: str = "desc") -> Tuple[Select, Select]:
+        """
+        构建QA对搜索查询
+        
+        所有过滤条件都编译进同一条SQL语句，检索词不少于3个字符时使用消息全文索引（FTS5），
+        否则退化为LIKE匹配。sort_by为relevance时按BM25相关度排序。
+        
+        Args:
+            node_ids: 节点ID集合或返回节点ID的子查询，用于限定上下文范围
+            date_from: 创建时间下界（包含）
+            date_to: 创建时间上界（包含）
+        
+        Returns:
+            (已排序的查询语句, 计数语句)
+        """
+        search_term = query.strip() if query else None
+        
+        # 构建命中QA对的子查询
+        matches = None
+        if search_term:
+            if len(search_term) >= FTS_MIN_QUERY_LENGTH and fts_available(self.db.connection()):
+                matches = match_qa_pairs(search_term).subquery()
+            else:
+                matches = (
+                    select(Message.qa_pair_id.label("qa_pair_id"), literal(0.0).label("rank"))
+                    .where(func.lower(Message.content).contains(search_term.lower(), autoescape=True))
+                    .group_by(Message.qa_pair_id)
+                    .subquery()
+                )
+        
+        # 构建基本查询
+        stmt = select(QAPair)
+        if matches is not None:
+            stmt = stmt.join(matches, matches.c.qa_pair_id == QAPair.id)
+        
+        # 添加过滤条件
+        if session_id:
+            stmt = stmt.where(QAPair.session_id == session_id)
+        if node_ids is not None:
+            stmt = stmt.where(QAPair.node_id.in_(node_ids if isinstance(node_ids, Select) else list(node_ids)))
+        if date_from is not None:
+            stmt = stmt.where(QAPair.created_at >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(QAPair.created_at <= date_to)
+        if is_favorite is not None:
+            stmt = stmt.where(QAPair.is_favorite == is_favorite)
+        if status is not None:
+            stmt = stmt.where(QAPair.status == status)
+        if min_rating is not None:
+            stmt = stmt.where(QAPair.rating >= min_rating)
+        if max_rating is not None:
+            stmt = stmt.where(QAPair.rating <= max_rating)
+        
+        count_stmt = select(func.count()).select_from(stmt.subquery())
+        
+        # 添加排序
+        if sort_by == "relevance" and matches is not None:
+            stmt = stmt.order_by(matches.c.rank, QAPair.created_at.desc())
+        else:
+            column = getattr(QAPair, sort_by if sort_by in self.SEARCH_SORT_FIELDS else "created_at")
+            stmt = stmt.order_by(column.asc() if sort_order == "asc" else column.desc(), QAPair.id)
+        
+        return stmt, count_stmt
     
     def search_qa_pairs(self, query: Optional[str] = None, session_id: Optional[str] = None, 
-                       limit: int = 10, offset: int = 0) -> Dict[str, Any]:
-        """搜索QA对"""
+                       limit: int = 10, offset: int = 0, sort_by: str = "created_at",
+                       sort_order: str = "desc", node_ids: Optional[Iterable[str]] = None,
+                       date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                       is_favorite: Optional[bool] = None, status: Optional[str] = None,
+                       min_rating: Optional[int] = None, max_rating: Optional[int] = None) -> Dict[str, Any]:
+        """
+        搜索QA对
+        
+        过滤、计数和分页都在数据库中完成，过滤条件的含义见build_search_query
+        """
         try:
-            # 构建基本查询
-            stmt = select(QAPair)
+            stmt, count_stmt = self.build_search_query(
+                query=query,
+                session_id=session_id,
+                node_ids=node_ids,
+                date_from=date_from,
+                date_to=date_to,
+                is_favorite=is_favorite,
+                status=status,
+                min_rating=min_rating,
+                max_rating=max_rating,
+                sort_by=sort_by,
+                sort_order=sort_order
+            )
+            
+            # 获取总数
+            total = self.db.exec(count_stmt).one()
             
-            # 添加过滤条件
-            if session_id:
-                stmt = stmt.where(QAPair.session_id == session_id)
+            # 添加分页
+            qa_pairs = self.db.exec(stmt.offset(offset).limit(limit)).all()
             
-            # 执行查询获取QA对
-            qa_pairs = self.db.exec(stmt).all()
+            # 一次查询获取当前页所有QA对的消息
+            questions: Dict[str, str] = {}
+            answers: Dict[str, str] = {}
+            if qa_pairs:
+                msg_query = (
+                    select(Message)
+                    .where(Message.qa_pair_id.in_([qa_pair.id for qa_pair in qa_pairs]))
+                    .order_by(Message.seq, Message.timestamp)
+                )
+                for msg in self.db.exec(msg_query).all():
+                    if msg.role == "user":
+                        questions[msg.qa_pair_id] = msg.content
+                    elif msg.role == "assistant":
+                        answers[msg.qa_pair_id] = msg.content
             
             # 构建结果
             items = []
-            matched_qa_pairs = []
-            
-            # 搜索词转小写
-            search_term = query.lower() if query else None
-            
             for qa_pair in qa_pairs:
-                # 查询消息
-                msg_query = select(Message).where(Message.qa_pair_id == qa_pair.id).order_by(Message.timestamp)
-                messages = self.db.exec(msg_query).all()
-                
-                # 提取问题和回答
-                question = None
-                answer = None
-                for msg in messages:
-                    if msg.role == "user":
-                        question = msg.content
-                    elif msg.role == "assistant":
-                        answer = msg.content
-                
-                # 检查是否匹配查询
-                if search_term:
-                    question_text = (question or "").lower()
-                    answer_text = (answer or "").lower()
-                    
-                    if search_term not in question_text and search_term not in answer_text:
-                        continue  # 不匹配搜索词，跳过
-                
-                matched_qa_pairs.append(qa_pair)
+                question = questions.get(qa_pair.id)
+                answer = answers.get(qa_pair.id)
                 items.append({
                     "id": qa_pair.id,
                     "node_id": qa_pair.node_id,
@@ -296,10 +793,6 @@ class QAPairService:
                     "answer": answer[:100] + "..." if answer and len(answer) > 100 else answer
                 })
             
-            # 应用分页
-            total = len(matched_qa_pairs)
-            items = items[offset:offset+limit]
-            
             return {
                 "total": total,
                 "items": items
@@ -310,63 +803,6 @@ class QAPairService:
             print(f"搜索QA对时发生错误: {str(e)}")
             return {"total": 0, "items": [], "error": str(e)}
     
-    def _search_qa_pairs_db_only(self, session_id: Optional[str] = None, 
-                               limit: int = 10, offset: int = 0) -> Dict[str, Any]:
-        """仅使用数据库查询和分页搜索QA对"""
-        # 构建基本查询
-        stmt = select(QAPair)
-        
-        # 添加过滤条件
-        if session_id:
-            stmt = stmt.where(QAPair.session_id == session_id)
-        
-        # 获取总数
-        total_query = stmt
-        all_qa_pairs = self.db.exec(total_query).all()
-        total = len(all_qa_pairs)
-        
-        # 添加分页
-        stmt = stmt.offset(offset).limit(limit)
-        
-        # 执行查询获取QA对
-        qa_pairs = self.db.exec(stmt).all()
-        
-        # 构建结果
-        items = []
-        for qa_pair in qa_pairs:
-            # 查询消息
-            msg_query = select(Message).where(Message.qa_pair_id == qa_pair.id).order_by(Message.timestamp)
-            messages = self.db.exec(msg_query).all()
-            
-            # 提取问题和回答
-            question = None
-            answer = None
-            for msg in messages:
-                if msg.role == "user":
-                    question = msg.content
-                elif msg.role == "assistant":
-                    answer = msg.content
-            
-            items.append({
-                "id": qa_pair.id,
-                "node_id": qa_pair.node_id,
-                "session_id": qa_pair.session_id,
-                "created_at": qa_pair.created_at,
-                "updated_at": qa_pair.updated_at,
-                "tags": qa_pair.tags,
-                "is_favorite": qa_pair.is_favorite,
-                "status": qa_pair.status,
-                "rating": qa_pair.rating,
-                "view_count": qa_pair.view_count,
-                "question": question[:100] + "..." if question and len(question) > 100 else question,
-                "answer": answer[:100] + "..." if answer and len(answer) > 100 else answer
-            })
-        
-        return {
-            "total": total,
-            "items": items
-        }
-    
     def _get_qa_pair_ids_with_filters(self, session_id: Optional[str] = None) -> List[str]:
         """获取符合过滤条件的QA对ID列表"""
         # 构建基本查询
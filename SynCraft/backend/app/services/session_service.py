@@ -1,13 +1,25 @@
 # backend/app/services/session_service.py
 from sqlmodel import Session, select
+from sqlalchemy import func, delete, update
 from app.models.session import Session as SessionModel
 from app.models.node import Node
+from app.models.node_closure import NodeClosure
+from app.models.edge import Edge
 from app.models.context import Context
 from app.models.context_node import ContextNode
-from app.cache.cache_manager import cached
+from app.models.qapair import QAPair
+from app.models.message import Message
+from app.cache.cache_manager import cached, cache_manager
 from nanoid import generate
 from datetime import datetime
+from collections import OrderedDict
 from typing import List, Dict, Optional, Any
+import threading
+
+# 后台删除任务的状态，只在当前进程内有效，保留最近的任务
+MAX_DELETION_JOBS = 1000
+_deletion_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_deletion_jobs_lock = threading.Lock()
 
 class SessionService:
     def __init__(self, db: Session):
@@ -35,6 +47,8 @@ class SessionService:
                 user_id=user_id
             )
             self.db.add(session)
+            # 外键约束下按依赖顺序写入：会话 -> 根节点 -> 上下文 -> 上下文节点
+            self.db.flush()
             
             # 创建根节点
             root_node = Node(
@@ -43,6 +57,10 @@ class SessionService:
                 template_key="root"
             )
             self.db.add(root_node)
+            self.db.flush()
+            
+            # 根节点在闭包表中只有自身一行
+            self.db.add(NodeClosure(ancestor_id=root_node.id, descendant_id=root_node.id, depth=0))
             
             # 更新会话的根节点ID
             session.root_node_id = root_node.id
@@ -57,6 +75,7 @@ class SessionService:
                 active_node_id=root_node.id
             )
             self.db.add(context)
+            self.db.flush()
             
             # 创建上下文节点关系
             context_node = ContextNode(
@@ -65,14 +84,15 @@ class SessionService:
                 relation_type="root"
             )
             self.db.add(context_node)
-            
-            # 只在最后执行一次flush
             self.db.flush()
             self.db.commit()
         except Exception as e:
             # 记录错误并抛出异常
             raise ValueError(f"创建会话内部错误: {str(e)}")
         
+        # 会话列表已变化
+        cache_manager.invalidate_tags(f"user:{user_id}:sessions")
+        
         # 返回会话信息
         return {
             "id": session.id,
@@ -90,10 +110,20 @@ class SessionService:
             }
         }
     
-    @cached(ttl=60)
     def get_sessions(self, user_id: str = "local", limit: int = 10, offset: int = 0, 
                     sort_by: str = "created_at", sort_order: str = "desc") -> Dict[str, Any]:
         """获取会话列表"""
+        data = self._get_sessions_data(user_id, limit, offset, sort_by, sort_order)
+        
+        return {
+            "total": data["total"],
+            "items": [SessionModel.model_validate(item) for item in data["items"]]
+        }
+    
+    @cached(ttl=60, tags=("user:{user_id}:sessions",))
+    def _get_sessions_data(self, user_id: str, limit: int, offset: int,
+                           sort_by: str, sort_order: str) -> Dict[str, Any]:
+        """查询会话列表，返回可缓存的普通数据"""
         # 构建查询
         query = select(SessionModel).where(SessionModel.user_id == user_id)
         
@@ -104,8 +134,9 @@ class SessionService:
             query = query.order_by(getattr(SessionModel, sort_by))
         
         # 执行查询获取总数
-        total_query = query
-        total = len(self.db.exec(total_query).all())
+        total = self.db.exec(
+            select(func.count()).select_from(SessionModel).where(SessionModel.user_id == user_id)
+        ).one()
         
         # 添加分页
         query = query.offset(offset).limit(limit)
@@ -115,12 +146,23 @@ class SessionService:
         
         return {
             "total": total,
-            "items": sessions
+            "items": [session.model_dump() for session in sessions]
         }
     
-    @cached(ttl=60)
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """获取会话详情"""
+        data = self._get_session_data(session_id)
+        if not data:
+            return None
+        
+        return {
+            **data,
+            "contexts": [Context.model_validate(context) for context in data["contexts"]]
+        }
+    
+    @cached(ttl=60, tags=("session:{session_id}",))
+    def _get_session_data(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """查询会话详情，返回可缓存的普通数据"""
         # 查询会话
         session = self.db.get(SessionModel, session_id)
         if not session:
@@ -137,7 +179,7 @@ class SessionService:
             "root_node_id": session.root_node_id,
             "created_at": session.created_at,
             "updated_at": session.updated_at,
-            "contexts": contexts
+            "contexts": [context.model_dump() for context in contexts]
         }
     
     def update_session(self, session_id: str, name: Optional[str] = None) -> Optional[SessionModel]:
@@ -157,46 +199,212 @@ class SessionService:
         self.db.commit()
         self.db.refresh(session)
         
+        self._invalidate_session_cache(session_id, session.user_id)
+        
         return session
     
     def delete_session(self, session_id: str) -> bool:
-        """删除会话及其关联的节点、边、上下文等"""
-        # 查询会话
+        """删除会话及其关联的节点、边、上下文、QA对和消息"""
+        return self.delete_session_cascade(session_id) is not None
+    
+    def delete_session_cascade(self, session_id: str) -> Optional[Dict[str, int]]:
+        """
+        批量删除会话及所有依赖记录
+        
+        每张表执行一条 DELETE ... WHERE ... IN (子查询)，全部在一个事务中完成，失败时整体回滚。
+        
+        Returns:
+            各类记录的删除数量，会话不存在时返回None
+        """
         session = self.db.get(SessionModel, session_id)
         if not session:
-            return False
+            return None
+        user_id = session.user_id
         
-        # 查询上下文
-        query = select(Context).where(Context.session_id == session_id)
-        contexts = self.db.exec(query).all()
+        node_ids = select(Node.id).where(Node.session_id == session_id)
+        qa_pair_ids = select(QAPair.id).where(
+            (QAPair.session_id == session_id) | QAPair.node_id.in_(node_ids)
+        )
+        context_ids = select(Context.id).where(Context.session_id == session_id)
         
-        # 删除上下文节点关系
-        for context in contexts:
-            query = select(ContextNode).where(ContextNode.context_id == context.id)
-            context_nodes = self.db.exec(query).all()
-            for context_node in context_nodes:
-                self.db.delete(context_node)
-            
-            # 删除上下文
-            self.db.delete(context)
+        # 先删除引用节点的记录，再删除节点和会话
+        statements = [
+            ("messages", delete(Message).where(Message.qa_pair_id.in_(qa_pair_ids))),
+            ("qa_pairs", delete(QAPair).where(QAPair.id.in_(qa_pair_ids))),
+            ("edges", delete(Edge).where(Edge.session_id == session_id)),
+            ("context_nodes", delete(ContextNode).where(ContextNode.context_id.in_(context_ids))),
+            ("contexts", delete(Context).where(Context.session_id == session_id)),
+            ("closure_rows", delete(NodeClosure).where(NodeClosure.descendant_id.in_(node_ids))),
+            ("nodes", delete(Node).where(Node.session_id == session_id)),
+            ("sessions", delete(SessionModel).where(SessionModel.id == session_id)),
+        ]
         
+        counts = {}
+        try:
+            # 会话和根节点互相引用，先断开会话到根节点的引用
+            self.db.execute(
+                update(SessionModel).where(SessionModel.id == session_id).values(root_node_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            for name, statement in statements:
+                # synchronize_session="fetch" 会把会话中已加载的对应对象标记为已删除
+                result = self.db.execute(statement.execution_options(synchronize_session="fetch"))
+                counts[name] = result.rowcount
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print(f"删除会话失败: session_id={session_id}, error={e}")
+            raise
+        
+        self._invalidate_session_cache(session_id, user_id)
+        print(f"会话删除成功: session_id={session_id}, counts={counts}")
+        return counts
+    
+    def start_delete_session_job(self, session_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        创建后台删除任务，用于很大的会话：调用方立即返回任务信息，
+        随后在后台调用 run_delete_session_job 执行删除，通过 get_delete_session_job 查询结果
+        """
+        job = {
+            "job_id": generate(),
+            "session_id": session_id,
+            "user_id": user_id,
+            "status": "pending",
+            "counts": None,
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        with _deletion_jobs_lock:
+            _deletion_jobs[job["job_id"]] = job
+            while len(_deletion_jobs) > MAX_DELETION_JOBS:
+                _deletion_jobs.popitem(last=False)
+        return dict(job)
+    
+    def run_delete_session_job(self, job_id: str) -> None:
+        """
+        执行后台删除任务
+        
+        请求的数据库会话在后台任务运行前已经关闭，这里使用同一个引擎打开新的会话
+        """
+        with _deletion_jobs_lock:
+            job = _deletion_jobs.get(job_id)
+            if not job:
+                return
+            job["status"] = "running"
+        
+        try:
+            with Session(self.db.get_bind()) as db:
+                counts = SessionService(db).delete_session_cascade(job["session_id"])
+            status, error = ("completed", None) if counts is not None else ("failed", "Session not found")
+        except Exception as e:
+            counts, status, error = None, "failed", str(e)
+        
+        with _deletion_jobs_lock:
+            job.update(status=status, counts=counts, error=error, finished_at=datetime.utcnow())
+    
+    def get_delete_session_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取后台删除任务的状态"""
+        with _deletion_jobs_lock:
+            job = _deletion_jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def _invalidate_session_cache(self, session_id: str, user_id: str) -> None:
+        """会话变化后使会话详情、主上下文和会话列表缓存失效"""
+        cache_manager.invalidate_tags(f"session:{session_id}", f"user:{user_id}:sessions")
+    
+    def get_session_tree(self, session_id: str, include_qa: bool = False,
+                         preview_length: int = 100) -> Dict[str, Any]:
+        """获取会话树（节点、边以及每个节点第一个QA对的预览），查询次数与节点数量无关"""
         # 查询节点
-        query = select(Node).where(Node.session_id == session_id)
-        nodes = self.db.exec(query).all()
+        nodes = self.db.exec(select(Node).where(Node.session_id == session_id)).all()
+        
+        # 查询边
+        edges = self.db.exec(select(Edge).where(Edge.session_id == session_id)).all()
         
-        # 删除节点
+        # 一次查询取出每个节点第一个QA对的消息预览，截断在SQL中完成
+        qa_summaries: Dict[str, Dict[str, str]] = {}
+        if include_qa and nodes:
+            first_qa = (
+                select(
+                    QAPair.id.label("qa_pair_id"),
+                    QAPair.node_id.label("node_id"),
+                    func.row_number().over(
+                        partition_by=QAPair.node_id,
+                        order_by=QAPair.created_at
+                    ).label("rn")
+                )
+                .where(QAPair.node_id.in_(select(Node.id).where(Node.session_id == session_id)))
+                .subquery()
+            )
+            query = (
+                select(
+                    first_qa.c.node_id,
+                    Message.role,
+                    func.substr(Message.content, 1, preview_length),
+                    func.length(Message.content) > preview_length
+                )
+                .join(Message, Message.qa_pair_id == first_qa.c.qa_pair_id)
+                .where(first_qa.c.rn == 1)
+                .order_by(Message.seq, Message.timestamp)
+            )
+            
+            # 同一角色有多条消息时以最后一条为准
+            for node_id, role, preview, truncated in self.db.exec(query).all():
+                if not preview:
+                    continue
+                if role == "user":
+                    key = "question_preview"
+                elif role == "assistant":
+                    key = "answer_preview"
+                else:
+                    continue
+                qa_summaries.setdefault(node_id, {})[key] = preview + ("..." if truncated else "")
+        
+        # 构建节点数据
+        node_data = []
         for node in nodes:
-            self.db.delete(node)
+            node_info = {
+                "id": node.id,
+                "template_key": node.template_key,
+                "created_at": node.created_at.isoformat()
+            }
+            
+            # 如果有父节点，添加parent_id字段
+            if node.parent_id:
+                node_info["parent_id"] = node.parent_id
+            
+            if node.id in qa_summaries:
+                node_info["qa_summary"] = qa_summaries[node.id]
+            
+            node_data.append(node_info)
         
-        # 删除会话
-        self.db.delete(session)
-        self.db.commit()
+        # 构建边数据
+        edge_data = [
+            {
+                "id": edge.id,
+                "source": edge.source,
+                "target": edge.target
+            }
+            for edge in edges
+        ]
         
-        return True
+        return {
+            "nodes": node_data,
+            "edges": edge_data
+        }
     
-    @cached(ttl=300)
     def get_main_context(self, session_id: str) -> Optional[Context]:
         """获取会话的主聊天上下文"""
+        data = self._get_main_context_data(session_id)
+        if not data:
+            return None
+        
+        return Context.model_validate(data)
+    
+    @cached(ttl=300, tags=("session:{session_id}",))
+    def _get_main_context_data(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """查询主聊天上下文，返回可缓存的普通数据"""
         # 查询会话
         session = self.db.get(SessionModel, session_id)
         if not session:
@@ -209,4 +417,4 @@ class SessionService:
         )
         context = self.db.exec(query).first()
         
-        return context
+        return context.model_dump() if context else None
@@ -0,0 +1,225 @@
+# backend/app/services/summary_service.py
+"""
+节点摘要（summary_up_to_here）的增量生成
+
+每次提问得到回答后，把节点加入后台队列；工作线程以节点已有的摘要（没有时用父节点的摘要）
+加上新的问答生成新摘要，不需要重新处理整条祖先链。提示词构建时用摘要代替较早的问答。
+"""
+from os import getenv
+from typing import Any, Dict, Optional, Tuple
+import queue
+import threading
+
+from sqlmodel import Session, select
+
+from app.models.node import Node
+from app.models.message import Message
+from app.services.llm import get_llm_service
+from app.utils.prompt import clip_to_tokens, estimate_tokens
+
+# 摘要的最大token数
+SUMMARY_MAX_TOKENS = int(getenv("SUMMARY_MAX_TOKENS", "300"))
+
+# 不调用LLM时每轮问答压缩后的最大token数
+SUMMARY_TURN_TOKENS = int(getenv("SUMMARY_TURN_TOKENS", "60"))
+
+# 摘要超出长度时代替被省略条目的标记
+SUMMARY_ELISION = "…"
+
+# 句末标点，压缩回答时尽量在句子边界截断
+_SENTENCE_ENDS = "。！？!?；;."
+
+def summary_worker_enabled() -> bool:
+    """是否在提问后自动生成摘要（SUMMARY_WORKER_ENABLED，调用时读取，测试可以在导入后关闭）"""
+    return getenv("SUMMARY_WORKER_ENABLED", "true").lower() == "true"
+
+def summary_use_llm() -> bool:
+    """
+    是否调用LLM生成摘要（SUMMARY_USE_LLM，默认关闭）
+    
+    开启后每次提问都会额外调用一次LLM；关闭时把新的问答压缩为一行追加到已有摘要后。
+    """
+    return getenv("SUMMARY_USE_LLM", "false").lower() == "true"
+
+SUMMARY_PROMPT = """请把已有摘要和新的问答合并为一段简洁的摘要，保留关键事实、结论和未解决的问题，不超过{max_tokens}字。
+
+【已有摘要】
+{base}
+
+【新的问答】
+Q: {question}
+A: {answer}
+
+只输出摘要内容。"""
+
+class SummaryService:
+    def __init__(self, db: Session, use_llm: Optional[bool] = None, max_tokens: int = SUMMARY_MAX_TOKENS,
+                 turn_tokens: int = SUMMARY_TURN_TOKENS):
+        self.db = db
+        self.use_llm = summary_use_llm() if use_llm is None else use_llm
+        self.max_tokens = max_tokens
+        self.turn_tokens = min(turn_tokens, max_tokens)
+    
+    def update_node_summary(self, node_id: str, qa_pair_id: str) -> Optional[str]:
+        """
+        把一个新的问答合并进节点摘要
+        
+        以节点已有的摘要为基础；节点还没有摘要时以父节点的摘要为基础。
+        
+        Returns:
+            新的摘要，节点或问答不存在时返回None
+        """
+        node = self.db.get(Node, node_id)
+        if not node:
+            return None
+        
+        question, answer = self._get_turn(qa_pair_id)
+        if not question or not answer:
+            return None
+        
+        base = node.summary_up_to_here
+        if not base and node.parent_id:
+            parent = self.db.get(Node, node.parent_id)
+            base = parent.summary_up_to_here if parent else None
+        
+        summary = self.summarize(base, question, answer)
+        node.summary_up_to_here = summary
+        self.db.add(node)
+        self.db.commit()
+        return summary
+    
+    def summarize(self, base: Optional[str], question: str, answer: str) -> str:
+        """根据已有摘要和新的问答生成摘要，LLM调用失败时退回到追加压缩后的问答"""
+        if self.use_llm:
+            prompt = SUMMARY_PROMPT.format(
+                max_tokens=self.max_tokens, base=base or "（无）", question=question, answer=answer
+            )
+            try:
+                summary = get_llm_service().call_llm(prompt)
+                if summary and summary.strip():
+                    return clip_to_tokens(summary.strip(), self.max_tokens)
+            except ValueError as e:
+                print(f"[SummaryService] 生成摘要失败，使用追加摘要: {e}")
+        
+        return self._append_summary(base, question, answer)
+    
+    def _append_summary(self, base: Optional[str], question: str, answer: str) -> str:
+        """
+        不调用LLM的摘要：每轮问答压缩为一行追加到已有摘要后
+        
+        超出长度时保留第一行（对话的起点），从其后最早的条目开始省略；
+        最近的问答会直接放入提示词，摘要只需保留较早的内容。
+        """
+        entries = base.split("\n") if base else []
+        entries.append(self._compress_turn(question, answer))
+        while len(entries) > 2 and estimate_tokens("\n".join(entries)) > self.max_tokens:
+            if entries[1] != SUMMARY_ELISION:
+                entries[1] = SUMMARY_ELISION
+            elif len(entries) > 3:
+                del entries[2]
+            else:
+                break
+        
+        text = "\n".join(entries)
+        if estimate_tokens(text) > self.max_tokens:
+            # 第一行本身过长时截断它的末尾，保留开头和新的问答
+            rest = "\n".join(entries[1:])
+            head = clip_to_tokens(entries[0], self.max_tokens - estimate_tokens(rest) - 1)
+            text = f"{head}\n{rest}" if head and rest else head or clip_to_tokens(rest, self.max_tokens)
+        return text
+    
+    def _compress_turn(self, question: str, answer: str) -> str:
+        """把一轮问答压缩为一行：问题的开头加回答的前几句"""
+        question = " ".join(question.split())
+        answer = " ".join(answer.split())
+        question = clip_to_tokens(question, max(1, self.turn_tokens // 3))
+        answer_tokens = self.turn_tokens - estimate_tokens(question)
+        clipped = clip_to_tokens(answer, answer_tokens)
+        if clipped != answer:
+            # 尽量在句子边界截断，至少保留一半
+            end = max(clipped.rfind(mark) for mark in _SENTENCE_ENDS)
+            if end + 1 >= len(clipped) // 2:
+                clipped = clipped[:end + 1]
+        return f"Q: {question} A: {clipped}"
+    
+    def _get_turn(self, qa_pair_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """获取问答的问题和回答"""
+        query = (
+            select(Message.role, Message.content)
+            .where(Message.qa_pair_id == qa_pair_id)
+            .order_by(Message.seq, Message.timestamp)
+        )
+        question = None
+        answer = None
+        for role, content in self.db.exec(query).all():
+            if role == "user":
+                question = content
+            elif role == "assistant":
+                answer = content
+        return question, answer
+
+class SummaryWorker:
+    """
+    后台摘要队列
+    
+    单个工作线程按入队顺序处理，父节点的摘要总是先于子节点生成，同一节点的摘要更新不会并发。
+    任务携带提问时使用的数据库引擎，工作线程为每个任务打开独立的会话。
+    """
+    
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[Tuple[Any, str, str]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"processed": 0, "failed": 0}
+    
+    def enqueue(self, bind: Any, node_id: str, qa_pair_id: str) -> None:
+        """加入摘要任务，首次使用时启动工作线程"""
+        self._ensure_started()
+        self._queue.put((bind, node_id, qa_pair_id))
+    
+    def process(self, bind: Any, node_id: str, qa_pair_id: str) -> Optional[str]:
+        """处理一个摘要任务"""
+        with Session(bind) as db:
+            return SummaryService(db).update_node_summary(node_id, qa_pair_id)
+    
+    def join(self) -> None:
+        """等待队列中的任务全部完成"""
+        self._queue.join()
+    
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """处理完已入队的任务后停止工作线程"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+    
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="summary-worker", daemon=True)
+                    self._thread.start()
+    
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self.process(*job)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[SummaryWorker] 摘要任务失败: node_id={job[1]}, error={e}")
+            finally:
+                self._queue.task_done()
+
+# 全局摘要队列
+summary_worker = SummaryWorker()
+
+def schedule_summary(bind: Any, node_id: str, qa_pair_id: str) -> None:
+    """提问完成后安排更新节点摘要"""
+    if summary_worker_enabled():
+        summary_worker.enqueue(bind, node_id, qa_pair_id)
@@ -0,0 +1,131 @@
+# backend/app/testAPI/test_api_nodes.py
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.services.node_service import NodeService
+from app.services.context_service import ContextService
+from app.services.qa_pair_service import QAPairService
+from app.models.qapair import QAPair
+from app.models.message import Message
+
+def build_tree(db_session: Session, test_data, depth: int, width: int):
+    """在子节点下创建 depth 层、每个节点 width 个子节点的子树，每个节点一个QA对"""
+    node_service = NodeService(db_session)
+    frontier = [test_data["child_node"].id]
+    for _ in range(depth):
+        next_frontier = []
+        for parent_id in frontier:
+            for _ in range(width):
+                node = node_service.create_node(session_id=test_data["session"].id, parent_id=parent_id)
+                qa_pair = QAPair(node_id=node.id, session_id=test_data["session"].id)
+                db_session.add(qa_pair)
+                db_session.flush()
+                db_session.add(Message(qa_pair_id=qa_pair.id, role="user", content=f"问题 {node.id}"))
+                db_session.add(Message(qa_pair_id=qa_pair.id, role="assistant", content=f"回答 {node.id}"))
+                next_frontier.append(node.id)
+        db_session.commit()
+        frontier = next_frontier
+
+def test_get_node_children_depth_queries(client: TestClient, db_session: Session, test_data, query_log):
+    """测试展开多层子节点时查询次数只与层数有关"""
+    build_tree(db_session, test_data, depth=2, width=3)
+    query_log.clear()
+    
+    response = client.get(
+        f"/api/v1/nodes/{test_data['root_node'].id}",
+        params={"include_children": True, "children_depth": 4}
+    )
+    
+    assert response.status_code == 200
+    data = response.json()
+    child = data["children"][0]
+    assert child["id"] == test_data["child_node"].id
+    assert "qa_pairs" not in child
+    assert len(child["children"]) == 3
+    grandchild = child["children"][0]
+    assert grandchild["qa_pairs"][0]["question"] == f"问题 {grandchild['id']}"
+    assert grandchild["qa_pairs"][0]["answer"] == f"回答 {grandchild['id']}"
+    assert len(grandchild["children"]) == 3
+    assert grandchild["children"][0]["children"] == []
+    
+    # 节点 + 根节点QA对(2) + 4层子节点 + 子树QA对(2)，与节点数无关
+    assert len(query_log) <= 10
+
+def test_get_node_children_batched_qa(client: TestClient, db_session: Session, test_data, query_log):
+    """测试直接子节点列表批量加载QA对"""
+    build_tree(db_session, test_data, depth=1, width=3)
+    query_log.clear()
+    
+    response = client.get(f"/api/v1/nodes/{test_data['child_node'].id}/children")
+    
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert len(items) == 3
+    assert all(item["qa_pairs"][0]["question"] == f"问题 {item['id']}" for item in items)
+    assert len(query_log) <= 4
+
+def test_get_context_nodes_queries(client: TestClient, db_session: Session, test_data, query_log):
+    """测试上下文节点列表联表查询并批量加载QA对"""
+    build_tree(db_session, test_data, depth=1, width=3)
+    context_service = ContextService(db_session)
+    for child in NodeService(db_session).get_node_children(test_data["child_node"].id):
+        context_service.add_node_to_context(test_data["context"].id, child.id)
+    query_log.clear()
+    
+    response = client.get(f"/api/v1/contexts/{test_data['context'].id}/nodes", params={"include_qa": True})
+    
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert len(items) == 4
+    assert items[0]["node_id"] == test_data["root_node"].id
+    assert items[0]["relation_type"] == "root"
+    assert items[0]["qa_pairs"][0]["question"] == "测试问题"
+    assert all(item["qa_pairs"][0]["question"] == f"问题 {item['node_id']}" for item in items[1:])
+    # 上下文 + 联表查询 + QA对(2)
+    assert len(query_log) <= 4
+    
+    response = client.get(f"/api/v1/contexts/{test_data['context'].id}/nodes", params={"relation_type": "root"})
+    assert [item["node_id"] for item in response.json()["items"]] == [test_data["root_node"].id]
+
+def test_get_node_contexts_queries(client: TestClient, db_session: Session, test_data, query_log):
+    """测试节点所属上下文列表联表查询"""
+    context_service = ContextService(db_session)
+    for mode in ("deepdive", "explore"):
+        context = context_service.create_context(test_data["session"].id, test_data["root_node"].id, mode=mode)
+        context_service.add_node_to_context(context.id, test_data["child_node"].id)
+    query_log.clear()
+    
+    response = client.get(f"/api/v1/nodes/{test_data['child_node'].id}/contexts")
+    
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert sorted(item["context"]["mode"] for item in items) == ["deepdive", "explore"]
+    # 节点 + 联表查询
+    assert len(query_log) <= 2
+
+def test_ask_question_idempotency_key(client: TestClient, db_session: Session, test_data):
+    """测试带相同 Idempotency-Key 的重试请求返回已保存的QA对"""
+    node_id = test_data["child_node"].id
+    headers = {"Idempotency-Key": "ask-retry-1"}
+    
+    first = client.post(f"/api/v1/nodes/{node_id}/ask", json={"question": "幂等问题"}, headers=headers)
+    second = client.post(f"/api/v1/nodes/{node_id}/ask", json={"question": "幂等问题"}, headers=headers)
+    
+    assert first.status_code == second.status_code == 200
+    assert first.json()["id"] == second.json()["id"]
+    assert first.json()["answer"] == second.json()["answer"]
+    assert len(db_session.exec(select(QAPair).where(QAPair.node_id == node_id)).all()) == 1
+    
+    # 同一个键用于其他问题时拒绝
+    conflict = client.post(f"/api/v1/nodes/{node_id}/ask", json={"question": "另一个问题"}, headers=headers)
+    assert conflict.status_code == 400
+    stream = client.post(f"/api/v1/nodes/{node_id}/ask/stream", json={"question": "另一个问题"}, headers=headers)
+    assert stream.status_code == 400
+    
+    # 同一个键的流式请求还在回答时返回409
+    QAPairService(db_session).create_qa_pair(node_id, "进行中的问题", idempotency_key="ask-retry-2")
+    headers = {"Idempotency-Key": "ask-retry-2"}
+    pending = client.post(f"/api/v1/nodes/{node_id}/ask", json={"question": "进行中的问题"}, headers=headers)
+    assert pending.status_code == 409
+    stream = client.post(f"/api/v1/nodes/{node_id}/ask/stream", json={"question": "进行中的问题"}, headers=headers)
+    assert stream.status_code == 409
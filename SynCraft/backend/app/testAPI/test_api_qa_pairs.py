@@ -1,6 +1,7 @@
 # backend/app/testAPI/test_api_qa_pairs.py
 import pytest
 from fastapi.testclient import TestClient
+import json
 import os
 
 # 设置环境变量，使用模拟LLM服务而不是真实服务
@@ -339,6 +340,87 @@ def test_ask_question_invalid_node(client: TestClient):
     assert "detail" in data
     assert "Not Found" in data["detail"] or "not found" in data["detail"]
 
+def _parse_sse(text: str):
+    """解析Server-Sent Events响应为(事件, 数据)列表"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_ask_question_stream(client: TestClient, test_data):
+    """测试流式提问API"""
+    with client.stream(
+        "POST",
+        f"/api/v1/nodes/{test_data['root_node'].id}/ask/stream",
+        json={"question": "流式提问"}
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(response.read().decode("utf-8"))
+    
+    names = [name for name, _ in events]
+    assert names[0] == "start"
+    assert names[-1] == "done"
+    assert names.count("token") > 1
+    
+    # 拼接后的片段与最终保存的回答一致
+    streamed = "".join(data["content"] for name, data in events if name == "token")
+    done = events[-1][1]
+    assert done["id"] == events[0][1]["qa_pair_id"]
+    assert done["question"] == "流式提问"
+    assert done["answer"] == streamed
+    
+    meta_info = done["messages"][1]["meta_info"]
+    assert meta_info["streamed"] is True
+    assert meta_info["first_token_latency_ms"] is not None
+    assert meta_info["total_latency_ms"] >= meta_info["first_token_latency_ms"]
+
+def test_ask_question_stream_invalid_node(client: TestClient):
+    """测试使用无效的节点ID流式提问"""
+    response = client.post("/api/v1/nodes/invalid-node-id/ask/stream",
+        json={
+            "question": "流式提问"
+        }
+    )
+    
+    assert response.status_code == 404
+
+def test_search_qa_pairs_async_endpoint(client: TestClient, test_data):
+    """测试使用异步会话的全局搜索API"""
+    response = client.get("/api/v1/search/qa_pairs", params={"query": "测试回答"})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 1
+    assert data["items"][0]["id"] == test_data["qa_pair"].id
+    assert data["items"][0]["answer"] == "测试回答"
+    
+    response = client.get("/api/v1/search/qa_pairs", params={"context_id": "missing-context"})
+    assert response.status_code == 404
+
+def test_search_qa_pairs_without_async_driver(client: TestClient, test_data, monkeypatch):
+    """测试未安装异步驱动时全局搜索API退回同步只读会话"""
+    from app.main import app
+    from app.database import async_database
+    
+    monkeypatch.setattr(async_database, "find_spec", lambda name: None)
+    assert async_database.async_driver_available() is False
+    
+    async def no_async_session():
+        yield None
+    
+    app.dependency_overrides[async_database.get_optional_async_session] = no_async_session
+    response = client.get("/api/v1/search/qa_pairs", params={"query": "测试回答"})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 1
+    assert data["items"][0]["id"] == test_data["qa_pair"].id
+    
+    response = client.get("/api/v1/search/qa_pairs", params={"context_id": "missing-context"})
+    assert response.status_code == 404
+
 def test_search_qa_pairs(client: TestClient, test_data):
     """测试搜索QA对API"""
     # 搜索QA对
@@ -419,3 +501,27 @@ def test_search_qa_pairs_pagination(client: TestClient, test_data):
     assert len(data2["items"]) == 2
     assert data1["items"][0]["id"] != data2["items"][0]["id"]
     assert data1["items"][1]["id"] != data2["items"][0]["id"]
+
+def test_add_messages_bulk(client: TestClient, test_data):
+    """测试批量添加消息API"""
+    response = client.post(f"/api/v1/qa_pairs/{test_data['qa_pair'].id}/messages/bulk",
+        json={
+            "messages": [
+                {"role": "user", "content": "追问"},
+                {"role": "assistant", "content": "追答", "meta_info": {"imported": True}}
+            ]
+        }
+    )
+    
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["content"] for item in items] == ["追问", "追答"]
+    assert items[1]["meta_info"] == {"imported": True}
+    
+    response = client.get(f"/api/v1/qa_pairs/{test_data['qa_pair'].id}")
+    assert [msg["content"] for msg in response.json()["messages"]][-2:] == ["追问", "追答"]
+    
+    response = client.post("/api/v1/qa_pairs/invalid-qa-pair-id/messages/bulk",
+        json={"messages": [{"role": "user", "content": "追问"}]}
+    )
+    assert response.status_code == 404
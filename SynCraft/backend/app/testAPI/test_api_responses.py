@@ -0,0 +1,45 @@
+# backend/app/testAPI/test_api_responses.py
+import pytest
+from fastapi.testclient import TestClient
+
+from app.utils.responses import EnvelopeJSONResponse
+
+@pytest.fixture
+def envelope(monkeypatch):
+    """开启统一响应格式包装"""
+    monkeypatch.setattr(EnvelopeJSONResponse, "envelope", True)
+
+def test_response_not_wrapped_by_default(client: TestClient):
+    """测试默认不包装响应"""
+    response = client.get("/health")
+    
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+def test_response_wrapped_once(client: TestClient, envelope):
+    """测试开启后成功响应被包装，错误响应保持原样"""
+    response = client.get("/health")
+    assert response.json() == {"success": True, "data": {"status": "ok"}}
+    
+    response = client.get("/api/v1/qa_pairs/missing-id")
+    assert response.status_code == 404
+    assert "detail" in response.json()
+
+def test_enveloped_content_not_wrapped_twice(envelope):
+    """测试已经是统一格式的内容不重复包装"""
+    response = EnvelopeJSONResponse({"success": False, "error": "失败"})
+    
+    assert response.body.decode("utf-8") == '{"success":false,"error":"失败"}'
+
+def test_stream_passes_through(client: TestClient, test_data, envelope):
+    """测试流式响应不受包装影响"""
+    with client.stream(
+        "POST",
+        f"/api/v1/nodes/{test_data['root_node'].id}/ask/stream",
+        json={"question": "流式提问"}
+    ) as response:
+        body = response.read().decode("utf-8")
+    
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert body.startswith("event: start\n")
+    assert '"success"' not in body
@@ -0,0 +1,254 @@
+# backend/app/testAPI/test_cache_manager.py
+import asyncio
+import threading
+import time
+import pytest
+
+from app.cache.cache_manager import cache_manager, cached
+
+@pytest.fixture
+def cache():
+    """
+    提供一个清空的全局缓存，测试结束后恢复默认容量
+    """
+    stats = cache_manager.stats()
+    cache_manager.clear()
+    cache_manager.reset_stats()
+    yield cache_manager
+    cache_manager.clear()
+    cache_manager.reset_stats()
+    cache_manager.configure(max_entries=stats["max_entries"], max_bytes=stats["max_bytes"])
+
+def test_get_and_set(cache):
+    """测试基本读写和命中统计"""
+    cache.set("key", {"value": 1})
+    
+    assert cache.get("key") == {"value": 1}
+    assert cache.get("missing") is None
+    
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+    assert stats["bytes"] > 0
+
+def test_lru_eviction_by_entries(cache):
+    """测试超过条目上限时淘汰最久未使用的条目"""
+    cache.configure(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    
+    # 访问a，使b成为最久未使用的条目
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_eviction_by_bytes(cache):
+    """测试超过字节上限时淘汰条目，超大值不缓存"""
+    cache.configure(max_bytes=4000)
+    cache.set("a", "x" * 1500)
+    cache.set("b", "y" * 1500)
+    cache.set("c", "z" * 1500)
+    
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["bytes"] <= 4000
+    
+    cache.set("huge", "h" * 10000)
+    assert cache.get("huge") is None
+
+def test_expiration(cache):
+    """测试过期条目不再返回，并在写入时从堆中清理"""
+    cache.set("short", "value", ttl=0)
+    time.sleep(0.01)
+    
+    assert cache.get("short") is None
+    
+    cache.set("expired", "value", ttl=0)
+    time.sleep(0.01)
+    cache.set("other", "value")
+    
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["expirations"] == 2
+
+def test_overwrite_updates_size(cache):
+    """测试覆盖写入时字节计数正确"""
+    cache.set("key", "x" * 1000)
+    cache.set("key", "y")
+    
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] < 1000
+    
+    cache.delete("key")
+    assert cache.stats()["bytes"] == 0
+
+class _Service:
+    """用于测试缓存装饰器的服务类"""
+    calls = 0
+    
+    @cached(ttl=60, tags=("item:{item_id}",))
+    def get_item(self, item_id: str, verbose: bool = False):
+        _Service.calls += 1
+        return {"id": item_id, "verbose": verbose}
+
+def test_cached_ignores_self(cache):
+    """测试缓存键忽略self，并与参数传递方式无关"""
+    _Service.calls = 0
+    
+    assert _Service().get_item("a") == {"id": "a", "verbose": False}
+    assert _Service().get_item("a", False) == {"id": "a", "verbose": False}
+    assert _Service().get_item(item_id="a", verbose=False) == {"id": "a", "verbose": False}
+    assert _Service.calls == 1
+    
+    _Service().get_item("a", verbose=True)
+    assert _Service.calls == 2
+
+def test_cached_tag_invalidation(cache):
+    """测试按标签失效"""
+    _Service.calls = 0
+    _Service().get_item("a")
+    _Service().get_item("b")
+    
+    assert cache.invalidate_tags("item:a") == 1
+    
+    _Service().get_item("a")
+    _Service().get_item("b")
+    assert _Service.calls == 3
+    
+    # 淘汰后标签索引同步清理
+    cache.clear()
+    assert cache.invalidate_tags("item:a", "item:b") == 0
+
+def test_get_or_compute_coalesces_threads(cache):
+    """测试并发未命中时只计算一次"""
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+    
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"value": 42}
+    
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    leader.start()
+    started.wait(5)
+    
+    followers = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+        for _ in range(4)
+    ]
+    for thread in followers:
+        thread.start()
+    # 等待跟随者进入等待状态后再放行计算
+    while cache.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    
+    assert len(calls) == 1
+    assert results == [{"value": 42}] * 5
+
+def test_get_or_compute_propagates_errors(cache):
+    """测试计算失败时异常传递给调用方且不缓存"""
+    def fail():
+        raise RuntimeError("boom")
+    
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("k", fail)
+    assert cache.get_or_compute("k", lambda: 1) == 1
+
+def test_get_or_compute_serves_stale(cache):
+    """测试刷新期间其他调用方直接得到旧值"""
+    cache.set("k", "old", ttl=0, stale_ttl=60)
+    time.sleep(0.01)
+    
+    seen = []
+    
+    def compute():
+        # 刷新过程中的并发读取拿到旧值
+        seen.append(cache.get_or_compute("k", lambda: "unexpected"))
+        return "new"
+    
+    assert cache.get_or_compute("k", compute) == "new"
+    assert seen == ["old"]
+    assert cache.stats()["stale_hits"] == 1
+    assert cache.get("k") == "new"
+
+def test_get_or_compute_skips_set_after_invalidation(cache):
+    """测试计算期间标签被失效或键被删除时，结果返回给调用方但不写入缓存"""
+    def compute_with_invalidation():
+        # 模拟计算读取数据后、写入缓存前发生了写操作
+        cache.invalidate_tags("session:1")
+        return "computed"
+    
+    assert cache.get_or_compute("k", compute_with_invalidation, tags=["session:1"]) == "computed"
+    assert cache.get("k") is None
+    
+    def compute_with_delete():
+        cache.delete("k")
+        return "computed"
+    
+    assert cache.get_or_compute("k", compute_with_delete) == "computed"
+    assert cache.get("k") is None
+    
+    # 无关标签的失效不影响写入
+    def compute_with_other_tag():
+        cache.invalidate_tags("session:2")
+        return "computed"
+    
+    assert cache.get_or_compute("k", compute_with_other_tag, tags=["session:1"]) == "computed"
+    assert cache.get("k") == "computed"
+
+def test_aget_or_compute_skips_set_after_invalidation(cache):
+    """测试异步计算与并发的失效交错时不写入缓存"""
+    async def run():
+        started = asyncio.Event()
+        release = asyncio.Event()
+        
+        async def compute():
+            started.set()
+            await release.wait()
+            return "computed"
+        
+        task = asyncio.create_task(cache.aget_or_compute("k", compute, tags=["session:1"]))
+        await started.wait()
+        cache.invalidate_tags("session:1")
+        release.set()
+        return await task
+    
+    assert asyncio.run(run()) == "computed"
+    assert cache.get("k") is None
+    assert cache.get_or_compute("k", lambda: "fresh", tags=["session:1"]) == "fresh"
+    assert cache.get("k") == "fresh"
+
+class _AsyncService:
+    """用于测试异步缓存装饰器的服务类"""
+    calls = 0
+    
+    @cached(ttl=60)
+    async def load(self, item_id: str):
+        _AsyncService.calls += 1
+        await asyncio.sleep(0.05)
+        return {"id": item_id}
+
+def test_cached_async_coalesces(cache):
+    """测试异步函数并发调用只执行一次"""
+    _AsyncService.calls = 0
+    
+    async def run():
+        return await asyncio.gather(*[_AsyncService().load("a") for _ in range(5)])
+    
+    results = asyncio.run(run())
+    
+    assert results == [{"id": "a"}] * 5
+    assert _AsyncService.calls == 1
+    assert cache.stats()["coalesced"] == 4
@@ -0,0 +1,57 @@
+# backend/app/testAPI/test_container.py
+import pytest
+from fastapi.testclient import TestClient
+
+from app.di.container import Container, Lifetime
+
+class _Service:
+    """用于测试的服务类"""
+    def __init__(self, db=None):
+        self.db = db
+
+class _Client:
+    """用于测试的单例服务类"""
+    pass
+
+@pytest.fixture
+def container():
+    container = Container()
+    container.register(_Service, lambda scope: _Service(scope.db), Lifetime.SCOPED)
+    container.register(_Client, lambda scope: _Client(), Lifetime.SINGLETON)
+    return container
+
+def test_scoped_services(container):
+    """测试作用域内服务在同一作用域复用，不同作用域使用各自的会话"""
+    first = container.create_scope(db="session-1")
+    second = container.create_scope(db="session-2")
+    
+    assert first.resolve(_Service) is first.resolve(_Service)
+    assert first.resolve(_Service) is not second.resolve(_Service)
+    assert first.resolve(_Service).db == "session-1"
+    assert second.resolve(_Service).db == "session-2"
+    
+    # 作用域内服务不能从容器直接解析
+    with pytest.raises(ValueError):
+        container.resolve(_Service)
+
+def test_singleton_and_transient_services(container):
+    """测试单例服务跨作用域共享，临时服务每次新建"""
+    container.register(object, lambda scope: object(), Lifetime.TRANSIENT)
+    first = container.create_scope()
+    second = container.create_scope()
+    
+    assert first.resolve(_Client) is second.resolve(_Client)
+    assert first.resolve(_Client) is container.resolve(_Client)
+    assert first.resolve(object) is not first.resolve(object)
+
+def test_unregistered_service(container):
+    """测试解析未注册的服务"""
+    with pytest.raises(ValueError):
+        container.create_scope().resolve(str)
+
+def test_request_scoped_session(client: TestClient, test_data):
+    """测试通过容器注入的服务使用请求自己的数据库会话"""
+    response = client.get(f"/api/v1/nodes/{test_data['root_node'].id}/contexts")
+    
+    assert response.status_code == 200
+    assert response.json()["items"][0]["context"]["context_id"] == test_data["context"].context_id
@@ -2,7 +2,9 @@
 import pytest
 from sqlmodel import Session, select
 
+from app.cache.cache_manager import cache_manager
 from app.services.context_service import ContextService
+from app.services.session_service import SessionService
 from app.models.context import Context
 from app.models.context_node import ContextNode
 from app.models.node import Node
@@ -170,6 +172,25 @@ def test_update_context(db_session: Session, test_data):
     assert db_context is not None
     assert db_context.active_node_id == test_data["child_node"].id
 
+def test_update_context_without_commit_invalidates_after_commit(db_session: Session, test_data):
+    """测试不提交的更新在调用方提交后才使缓存失效，回滚时保留缓存"""
+    context_service = ContextService(db_session)
+    session_service = SessionService(db_session)
+    session_id = test_data["session"].id
+    assert session_service.get_main_context(session_id).active_node_id == test_data["root_node"].id
+    
+    context_service.update_context_without_commit(test_data["context"].id, test_data["child_node"].id)
+    # 提交前仍是缓存中的旧值
+    assert session_service.get_main_context(session_id).active_node_id == test_data["root_node"].id
+    db_session.commit()
+    assert session_service.get_main_context(session_id).active_node_id == test_data["child_node"].id
+    
+    context_service.update_context_without_commit(test_data["context"].id, test_data["root_node"].id)
+    db_session.rollback()
+    entries = cache_manager.stats()["entries"]
+    assert session_service.get_main_context(session_id).active_node_id == test_data["child_node"].id
+    assert cache_manager.stats()["entries"] == entries
+
 def test_update_context_not_found(db_session: Session, test_data):
     """测试更新不存在的上下文"""
     # 创建ContextService
@@ -408,6 +429,25 @@ def test_get_context_nodes(db_session: Session, test_data):
     assert nodes[1]["id"] == test_data["child_node"].id
     assert nodes[1]["relation_type"] == "member"
 
+def test_get_context_node_rows(db_session: Session, test_data):
+    """测试联表获取上下文节点关系和节点、节点所属上下文"""
+    context_service = ContextService(db_session)
+    context_service.add_node_to_context(test_data["context"].id, test_data["child_node"].id)
+    
+    rows = context_service.get_context_node_rows(test_data["context"].id)
+    assert [(context_node.relation_type, node.id) for context_node, node in rows] == [
+        ("root", test_data["root_node"].id),
+        ("member", test_data["child_node"].id),
+    ]
+    
+    rows = context_service.get_context_node_rows(test_data["context"].id, relation_type="member")
+    assert [node.id for _, node in rows] == [test_data["child_node"].id]
+    
+    rows = context_service.get_node_context_rows(test_data["root_node"].id)
+    assert [(context_node.id, context.id) for context_node, context in rows] == [
+        (test_data["context_node"].id, test_data["context"].id)
+    ]
+
 def test_get_session_contexts(db_session: Session, test_data):
     """测试获取会话的所有上下文"""
     # 创建ContextService
@@ -0,0 +1,118 @@
+# backend/app/testAPI/test_database.py
+import asyncio
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.database.database import create_sqlite_engine, ensure_added_columns
+from app.database.fts import ensure_message_fts, rebuild_message_fts, vacuum_database
+from app.database.async_database import create_db_async_engine, to_async_url
+
+def test_tuned_profile_pragmas(tmp_path):
+    """测试tuned配置在每个连接上启用WAL等PRAGMA"""
+    engine = create_sqlite_engine(str(tmp_path / "tuned.db"), profile="tuned")
+    
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL = 1
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    
+    engine.dispose()
+
+def test_read_only_engine_rejects_writes(tmp_path):
+    """测试只读引擎可以查询但不能写入"""
+    path = str(tmp_path / "read_only.db")
+    engine = create_sqlite_engine(path, profile="tuned")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO item (id) VALUES (1)"))
+    
+    read_engine = create_sqlite_engine(path, read_only=True)
+    with read_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM item")).scalar() == 1
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO item (id) VALUES (2)"))
+    
+    read_engine.dispose()
+    engine.dispose()
+
+def test_to_async_url():
+    """测试同步连接URL转换为异步驱动URL"""
+    assert to_async_url("sqlite:///./data.db") == "sqlite+aiosqlite:///./data.db"
+    assert to_async_url("postgresql://u:p@localhost:5432/db") == "postgresql+asyncpg://u:p@localhost:5432/db"
+    assert to_async_url("postgresql+psycopg2://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert to_async_url("postgresql+asyncpg://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    
+    with pytest.raises(ValueError):
+        to_async_url("mysql://u:p@db/app")
+
+def test_async_engine_read_only(tmp_path):
+    """测试异步只读引擎复用同步引擎的连接初始化逻辑"""
+    path = str(tmp_path / "async.db")
+    engine = create_sqlite_engine(path, profile="tuned")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO item (id) VALUES (1)"))
+    
+    async def run():
+        async_engine = create_db_async_engine(to_async_url(f"sqlite:///{path}"))
+        try:
+            async with async_engine.connect() as conn:
+                count = (await conn.execute(text("SELECT COUNT(*) FROM item"))).scalar()
+                busy_timeout = (await conn.execute(text("PRAGMA busy_timeout"))).scalar()
+                with pytest.raises(OperationalError):
+                    await conn.execute(text("INSERT INTO item (id) VALUES (2)"))
+            return count, busy_timeout
+        finally:
+            await async_engine.dispose()
+    
+    assert asyncio.run(run()) == (1, 5000)
+    engine.dispose()
+
+def test_ensure_added_columns(tmp_path):
+    """测试为已有数据库补建新增的列"""
+    engine = create_sqlite_engine(str(tmp_path / "old.db"))
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE message (id VARCHAR PRIMARY KEY, qa_pair_id VARCHAR, content VARCHAR)"))
+        conn.execute(text("INSERT INTO message (id, qa_pair_id, content) VALUES ('m1', 'q1', 'old')"))
+    
+    ensure_added_columns(engine)
+    # 重复执行不报错
+    ensure_added_columns(engine)
+    
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT seq FROM message WHERE id = 'm1'")).scalar() == 0
+    engine.dispose()
+
+def test_rebuild_message_fts_after_rowid_change(tmp_path):
+    """测试消息的隐式rowid变化（如VACUUM重新编号）后重建全文索引可以恢复检索"""
+    engine = create_sqlite_engine(str(tmp_path / "fts.db"))
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE message (id VARCHAR PRIMARY KEY, qa_pair_id VARCHAR, content VARCHAR)"))
+    ensure_message_fts(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO message (id, qa_pair_id, content) VALUES ('m1', 'q1', '全文检索测试')"))
+        conn.execute(text("INSERT INTO message (id, qa_pair_id, content) VALUES ('m2', 'q2', '其他内容')"))
+    
+    def search():
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT message.id FROM message_fts JOIN message ON message.rowid = message_fts.rowid "
+                "WHERE message_fts MATCH '\"全文检索\"'"
+            )).scalars().all()
+    
+    assert search() == ["m1"]
+    
+    # 模拟rowid被重新编号，触发器不会更新索引
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE message SET rowid = rowid + 100"))
+    assert search() == []
+    
+    rebuild_message_fts(engine)
+    assert search() == ["m1"]
+    
+    # VACUUM后自动重建
+    vacuum_database(engine)
+    assert search() == ["m1"]
+    engine.dispose()
@@ -1,11 +1,13 @@
 from sqlalchemy import text
 # backend/app/testAPI/test_node_service.py
 import pytest
-from sqlmodel import Session
+from sqlmodel import Session, select
 
 from app.services.node_service import NodeService
 from app.models.node import Node
+from app.models.node_closure import NodeClosure
 from app.models.edge import Edge
+from app.models.context import Context
 from app.models.qapair import QAPair
 from app.models.message import Message
 from app.models.session import Session as SessionModel
@@ -215,6 +217,10 @@ def test_delete_node_with_children(db_session: Session, test_data):
     # 创建NodeService
     node_service = NodeService(db_session)
     
+    # 批量删除后，会话中已删除的对象不能再读取属性，先记下子节点ID
+    child_id = test_data["child_node"].id
+    session_id = test_data["session"].id
+    
     # 删除根节点
     success = node_service.delete_node(test_data["root_node"].id)
     
@@ -226,13 +232,18 @@ def test_delete_node_with_children(db_session: Session, test_data):
     assert db_node is None
     
     # 验证子节点也被删除
-    db_child = db_session.get(Node, test_data["child_node"].id)
+    db_child = db_session.get(Node, child_id)
     assert db_child is None
     
     # 验证边也被删除
     query = text(f"SELECT * FROM edge WHERE source = '{test_data['root_node'].id}'")
     edges = db_session.exec(query).all()
     assert len(edges) == 0
+    
+    # 以根节点为根的上下文被删除，会话不再指向已删除的根节点
+    assert db_session.exec(select(Context).where(Context.session_id == session_id)).all() == []
+    db_session.expire_all()
+    assert db_session.get(SessionModel, session_id).root_node_id is None
 
 def test_delete_node_not_found(db_session: Session):
     """测试删除不存在的节点"""
@@ -305,3 +316,139 @@ def test_get_node_descendants(db_session: Session, test_data):
     assert len(descendants) == 2
     assert descendants[0].id == test_data["child_node"].id
     assert descendants[1].id == grandchild.id
+
+def test_node_closure_maintained_on_create(db_session: Session, test_data):
+    """测试创建节点时维护闭包表，路径、后代、深度和子树大小从闭包表查询"""
+    node_service = NodeService(db_session)
+    node_service.rebuild_node_closure()
+    
+    # 在子节点下创建一条链和一个分支
+    grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=test_data["child_node"].id)
+    great_grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=grandchild.id)
+    sibling = node_service.create_node(session_id=test_data["session"].id, parent_id=test_data["child_node"].id)
+    
+    rows = db_session.exec(select(NodeClosure).where(NodeClosure.descendant_id == great_grandchild.id)).all()
+    assert {(row.ancestor_id, row.depth) for row in rows} == {
+        (great_grandchild.id, 0),
+        (grandchild.id, 1),
+        (test_data["child_node"].id, 2),
+        (test_data["root_node"].id, 3),
+    }
+    
+    path = node_service.get_node_path(great_grandchild.id)
+    assert [node.id for node in path] == [
+        test_data["root_node"].id, test_data["child_node"].id, grandchild.id, great_grandchild.id
+    ]
+    
+    descendants = node_service.get_node_descendants(test_data["child_node"].id)
+    assert [node.id for node in descendants[:2]] == [grandchild.id, sibling.id]
+    assert descendants[2].id == great_grandchild.id
+    
+    assert node_service.get_node_depth(test_data["root_node"].id) == 0
+    assert node_service.get_node_depth(great_grandchild.id) == 3
+    assert node_service.get_node_depth("invalid-node-id") is None
+    assert node_service.get_subtree_count(test_data["root_node"].id) == 5
+    assert node_service.get_subtree_count(grandchild.id) == 2
+    assert node_service.get_subtree_count("invalid-node-id") == 0
+    
+    # 删除子树时一并删除闭包表记录
+    node_service.delete_node(grandchild.id)
+    remaining = db_session.exec(
+        select(NodeClosure).where(NodeClosure.descendant_id.in_([grandchild.id, great_grandchild.id]))
+    ).all()
+    assert remaining == []
+    assert node_service.get_subtree_count(test_data["root_node"].id) == 3
+
+def test_node_queries_without_closure_rows(db_session: Session, test_data):
+    """测试闭包表未补建时回退到父节点指针查询"""
+    node_service = NodeService(db_session)
+    
+    # test_data 中的节点直接写入数据库，没有闭包表记录；新节点的祖先记录不完整
+    grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=test_data["child_node"].id)
+    
+    path = node_service.get_node_path(grandchild.id)
+    assert [node.id for node in path] == [test_data["root_node"].id, test_data["child_node"].id, grandchild.id]
+    assert node_service.get_node_depth(grandchild.id) == 2
+    assert [node.id for node in node_service.get_node_descendants(test_data["root_node"].id)] == [
+        test_data["child_node"].id, grandchild.id
+    ]
+    assert node_service.get_subtree_count(test_data["root_node"].id) == 3
+    
+    # 补建后与逐级查询结果一致
+    assert node_service.rebuild_node_closure() == 6
+    assert node_service.get_node_depth(grandchild.id) == 2
+    assert node_service.get_subtree_count(test_data["root_node"].id) == 3
+
+def test_delete_subtree_counts(db_session: Session, test_data):
+    """测试批量删除子树并返回各类记录的删除数量"""
+    node_service = NodeService(db_session)
+    
+    # 子节点下再挂一个带QA对的孙节点
+    grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=test_data["child_node"].id)
+    qa_pair = QAPair(node_id=grandchild.id, session_id=test_data["session"].id)
+    db_session.add(qa_pair)
+    db_session.flush()
+    db_session.add(Message(qa_pair_id=qa_pair.id, role="user", content="孙节点问题"))
+    grandchild_id = grandchild.id
+    db_session.commit()
+    child_id = test_data["child_node"].id
+    
+    counts = node_service.delete_subtree(child_id)
+    
+    assert counts == {
+        "messages": 1,
+        "qa_pairs": 1,
+        "edges": 2,
+        "context_nodes": 0,
+        "contexts": 0,
+        "closure_rows": 1,
+        "nodes": 2,
+    }
+    assert db_session.get(Node, grandchild_id) is None
+    assert db_session.get(Node, child_id) is None
+    assert db_session.get(Node, test_data["root_node"].id) is not None
+    
+    # 根节点上的QA对和消息不受影响
+    assert db_session.get(QAPair, test_data["qa_pair"].id) is not None
+    remaining = db_session.exec(select(Message).where(Message.qa_pair_id == test_data["qa_pair"].id)).all()
+    assert len(remaining) == 2
+    
+    assert node_service.delete_subtree("invalid-node-id") is None
+
+def test_delete_subtree_rolls_back_on_error(db_session: Session, test_data, monkeypatch):
+    """测试删除失败时整体回滚"""
+    node_service = NodeService(db_session)
+    original_execute = db_session.execute
+    calls = []
+    
+    def failing_execute(statement, *args, **kwargs):
+        calls.append(statement)
+        if len(calls) == 3:
+            raise RuntimeError("数据库错误")
+        return original_execute(statement, *args, **kwargs)
+    
+    monkeypatch.setattr(db_session, "execute", failing_execute)
+    with pytest.raises(RuntimeError):
+        node_service.delete_subtree(test_data["root_node"].id)
+    monkeypatch.undo()
+    
+    # 前两条语句删除的QA对和消息已回滚
+    assert db_session.get(QAPair, test_data["qa_pair"].id) is not None
+    assert db_session.get(Node, test_data["child_node"].id) is not None
+
+def test_get_children_by_level(db_session: Session, test_data):
+    """测试逐层获取子树，每层一次查询"""
+    node_service = NodeService(db_session)
+    grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=test_data["child_node"].id)
+    great_grandchild = node_service.create_node(session_id=test_data["session"].id, parent_id=grandchild.id)
+    
+    children_map = node_service.get_children_by_level(test_data["root_node"].id, 2)
+    
+    assert [node.id for node in children_map[test_data["root_node"].id]] == [test_data["child_node"].id]
+    assert [node.id for node in children_map[test_data["child_node"].id]] == [grandchild.id]
+    # 只获取两层
+    assert grandchild.id not in children_map
+    
+    children_map = node_service.get_children_by_level(test_data["root_node"].id, 5)
+    assert [node.id for node in children_map[grandchild.id]] == [great_grandchild.id]
+    assert children_map[great_grandchild.id] == []
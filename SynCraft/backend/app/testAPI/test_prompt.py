@@ -0,0 +1,118 @@
+# backend/app/testAPI/test_prompt.py
+from sqlmodel import Session
+
+from app.models.node import Node
+from app.models.qapair import QAPair
+from app.models.message import Message
+from app.services.node_service import NodeService
+from app.utils.prompt import PromptBuilder, build_prompt, estimate_tokens, render_prompt, SUMMARY_PREFIX
+
+def add_turn(db_session: Session, node: Node, question: str, answer: str):
+    """在节点上添加一轮问答"""
+    qa_pair = QAPair(node_id=node.id, session_id=node.session_id)
+    db_session.add(qa_pair)
+    db_session.flush()
+    db_session.add(Message(qa_pair_id=qa_pair.id, role="user", content=question, seq=0))
+    db_session.add(Message(qa_pair_id=qa_pair.id, role="assistant", content=answer, seq=1))
+    db_session.commit()
+
+def test_estimate_tokens():
+    """测试本地token估算"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("hello world!") == 3
+    assert estimate_tokens("你好 world") == 4
+
+def test_build_messages_ancestor_chain(db_session: Session, test_data, query_log):
+    """测试一次查询获取祖先链上的问答，按时间顺序组装"""
+    add_turn(db_session, test_data["child_node"], "子节点问题", "子节点回答")
+    grandchild = NodeService(db_session).create_node(test_data["session"].id, test_data["child_node"].id)
+    query_log.clear()
+    
+    messages = PromptBuilder(db_session).build_messages(grandchild.id, "新问题")
+    
+    assert messages == [
+        {"role": "user", "content": "测试问题"},
+        {"role": "assistant", "content": "测试回答"},
+        {"role": "user", "content": "子节点问题"},
+        {"role": "assistant", "content": "子节点回答"},
+        {"role": "user", "content": "新问题"},
+    ]
+    assert len(query_log) == 1
+
+def test_build_messages_token_budget(db_session: Session, test_data):
+    """测试超出预算时保留最近的问答，较早的问答用节点摘要代替"""
+    child = test_data["child_node"]
+    add_turn(db_session, child, "子节点问题" * 20, "子节点回答" * 20)
+    add_turn(db_session, child, "最近的问题", "最近的回答")
+    root = db_session.get(Node, test_data["root_node"].id)
+    root.summary_up_to_here = "根节点讨论了测试问题和测试回答。" * 5
+    db_session.add(root)
+    db_session.commit()
+    
+    messages = PromptBuilder(db_session, token_budget=150).build_context(child.id)
+    
+    # 只有最近一轮放得下，根节点的摘要代替更早的问答
+    assert messages[0]["role"] == "system"
+    assert messages[0]["content"].startswith(SUMMARY_PREFIX)
+    assert "根节点讨论了" in messages[0]["content"]
+    assert messages[1:] == [
+        {"role": "user", "content": "最近的问题"},
+        {"role": "assistant", "content": "最近的回答"},
+    ]
+    total = sum(estimate_tokens(message["content"]) + 4 for message in messages)
+    assert total <= 150
+    
+    # 没有摘要时只保留放得下的问答
+    root.summary_up_to_here = None
+    db_session.add(root)
+    db_session.commit()
+    messages = PromptBuilder(db_session, token_budget=150).build_context(child.id)
+    assert [message["content"] for message in messages] == ["最近的问题", "最近的回答"]
+
+def test_build_prompt(db_session: Session, test_data):
+    """测试渲染为单个提示词"""
+    assert build_prompt(None, "问题", db_session) == "问题"
+    
+    prompt = build_prompt(test_data["root_node"], "后续问题", db_session)
+    assert "【之前的问答】\nQ: 测试问题\nA: 测试回答" in prompt
+    assert prompt.rstrip().endswith("【新问题】\n后续问题")
+    
+    assert render_prompt([{"role": "user", "content": "问题"}]) == "问题"
+
+def test_build_context_max_turns_constant_size(db_session: Session, test_data):
+    """测试链很深时只放入最近的几轮问答和摘要，提示词长度不随深度增长"""
+    node_service = NodeService(db_session)
+    node = test_data["child_node"]
+    sizes = []
+    for i in range(8):
+        add_turn(db_session, node, f"第{i}个问题", f"第{i}个回答")
+        node.summary_up_to_here = f"截至第{i}轮的摘要，讨论了前面所有的问题和回答。" * 2
+        db_session.add(node)
+        db_session.commit()
+        node = node_service.create_node(test_data["session"].id, node.id)
+        sizes.append(len(PromptBuilder(db_session, max_turns=3).build_context(node.id)))
+    
+    messages = PromptBuilder(db_session, max_turns=3).build_context(node.id)
+    assert messages[0]["content"] == SUMMARY_PREFIX + "截至第4轮的摘要，讨论了前面所有的问题和回答。" * 2
+    assert [m["content"] for m in messages[1:] if m["role"] == "user"] == ["第5个问题", "第6个问题", "第7个问题"]
+    assert sizes[-1] == sizes[-2] == sizes[-3] == 7
+
+def test_summary_does_not_overlap_included_turns(db_session: Session, test_data):
+    """测试直接放入的问答所在节点的摘要不会使用，只使用更早节点的摘要"""
+    child = test_data["child_node"]
+    for i in range(3):
+        add_turn(db_session, child, f"子节点第{i}个问题", f"子节点第{i}个回答")
+    root = db_session.get(Node, test_data["root_node"].id)
+    root.summary_up_to_here = "根节点的摘要，讨论了测试问题。" * 3
+    child = db_session.get(Node, child.id)
+    # 子节点的摘要包含了会直接放入提示词的问答
+    child.summary_up_to_here = "子节点的摘要，包含子节点第2个问题。" * 3
+    db_session.add_all([root, child])
+    db_session.commit()
+    
+    messages = PromptBuilder(db_session, max_turns=2).build_context(child.id)
+    
+    assert messages[0]["content"] == SUMMARY_PREFIX + "根节点的摘要，讨论了测试问题。" * 3
+    assert [m["content"] for m in messages[1:] if m["role"] == "user"] == ["子节点第1个问题", "子节点第2个问题"]
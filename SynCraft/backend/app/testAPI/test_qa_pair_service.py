@@ -1,9 +1,14 @@
 # backend/app/testAPI/test_qa_pair_service.py
+import asyncio
+import time
+from datetime import datetime, timedelta
 import pytest
 from sqlmodel import Session, select
+from sqlalchemy import func
 from unittest.mock import patch, MagicMock
 
-from app.services.qa_pair_service import QAPairService
+from app.services.qa_pair_service import IdempotencyKeyInProgress, QAPairService, _background_tasks
+from app.services.llm import set_llm_call_info
 from app.models.qapair import QAPair
 from app.models.message import Message
 from app.models.node import Node
@@ -269,6 +274,56 @@ def test_add_message(db_session: Session, test_data):
     db_qa_pair = db_session.get(QAPair, test_data["qa_pair"].id)
     assert db_qa_pair.updated_at > original_updated_at
 
+def test_create_qa_pair_single_commit(db_session: Session, test_data, monkeypatch):
+    """测试创建QA对只提交一次，消息按顺序号排列"""
+    qa_pair_service = QAPairService(db_session)
+    commits = []
+    original_commit = db_session.commit
+    monkeypatch.setattr(db_session, "commit", lambda: (commits.append(1), original_commit())[1])
+    
+    result = qa_pair_service.create_qa_pair(test_data["child_node"].id, "问题", "回答")
+    
+    assert len(commits) == 1
+    assert [msg["role"] for msg in result["messages"]] == ["user", "assistant"]
+    seqs = db_session.exec(
+        select(Message.seq).where(Message.qa_pair_id == result["id"]).order_by(Message.seq)
+    ).all()
+    assert seqs == [0, 1]
+
+def test_add_messages(db_session: Session, test_data, monkeypatch):
+    """测试批量添加消息：一个事务、顺序号连续、时间戳相同时仍按顺序返回"""
+    qa_pair_service = QAPairService(db_session)
+    qa_pair_id = test_data["qa_pair"].id
+    
+    # 已有消息没有顺序号（旧数据），新消息接在后面
+    first = qa_pair_service.add_message(qa_pair_id, "user", "第二个问题")
+    assert first.seq == 1
+    
+    commits = []
+    original_commit = db_session.commit
+    monkeypatch.setattr(db_session, "commit", lambda: (commits.append(1), original_commit())[1])
+    
+    timestamp = datetime(2024, 1, 1)
+    messages = qa_pair_service.add_messages(qa_pair_id, [
+        {"role": "assistant", "content": "第二个回答", "timestamp": timestamp},
+        {"role": "user", "content": "第三个问题", "timestamp": timestamp},
+        {"role": "assistant", "content": "第三个回答", "timestamp": timestamp, "meta_info": {"imported": True}},
+    ])
+    
+    assert len(commits) == 1
+    assert [message.seq for message in messages] == [2, 3, 4]
+    assert messages[2].meta_info == {"imported": True}
+    
+    # 同一QA对内按顺序号排序，不依赖时间戳
+    result = qa_pair_service.get_qa_pair_with_messages(qa_pair_id)
+    assert [msg["content"] for msg in result["messages"]] == [
+        "测试问题", "测试回答", "第二个问题", "第二个回答", "第三个问题", "第三个回答"
+    ]
+    
+    assert qa_pair_service.add_messages(qa_pair_id, []) == []
+    with pytest.raises(ValueError):
+        qa_pair_service.add_messages("invalid-qa-pair-id", [{"role": "user", "content": "问题"}])
+
 def test_add_message_invalid_qa_pair(db_session: Session):
     """测试向不存在的QA对添加消息"""
     # 创建QAPairService
@@ -313,6 +368,28 @@ def test_get_node_qa_pairs_empty(db_session: Session, test_data):
     # 验证结果
     assert len(result) == 0
 
+def test_get_qa_pairs_for_nodes(db_session: Session, test_data):
+    """测试批量获取多个节点的QA对"""
+    qa_pair_service = QAPairService(db_session)
+    
+    # 子节点上再加两个QA对
+    for i in range(2):
+        qa_pair = QAPair(node_id=test_data["child_node"].id, session_id=test_data["session"].id)
+        db_session.add(qa_pair)
+        db_session.flush()
+        db_session.add(Message(qa_pair_id=qa_pair.id, role="user", content=f"子节点问题{i}"))
+        db_session.commit()
+    
+    result = qa_pair_service.get_qa_pairs_for_nodes(
+        [test_data["root_node"].id, test_data["child_node"].id, "invalid-node-id"]
+    )
+    
+    assert [pair["id"] for pair in result[test_data["root_node"].id]] == [test_data["qa_pair"].id]
+    assert [msg["content"] for msg in result[test_data["root_node"].id][0]["messages"]] == ["测试问题", "测试回答"]
+    assert [pair["messages"][0]["content"] for pair in result[test_data["child_node"].id]] == ["子节点问题0", "子节点问题1"]
+    assert result["invalid-node-id"] == []
+    assert qa_pair_service.get_qa_pairs_for_nodes([]) == {}
+
 def test_increment_view_count(db_session: Session, test_data):
     """测试增加QA对的查看次数"""
     # 创建QAPairService
@@ -346,6 +423,102 @@ def test_increment_view_count_not_found(db_session: Session):
     # 验证结果
     assert qa_pair is None
 
+def test_get_message_timeline(db_session: Session, test_data):
+    """测试按时间顺序获取会话消息"""
+    # 创建QAPairService
+    qa_pair_service = QAPairService(db_session)
+    qa_pair_service.create_qa_pair(
+        node_id=test_data["child_node"].id,
+        question="子节点问题",
+        answer="子节点回答"
+    )
+    
+    # 获取会话消息
+    result = qa_pair_service.get_message_timeline(session_id=test_data["session"].id)
+    
+    # 验证结果
+    assert result["total"] == 4
+    assert result["has_more"] is False
+    assert [item["content"] for item in result["items"]] == ["测试问题", "测试回答", "子节点问题", "子节点回答"]
+    assert result["items"][2]["node_id"] == test_data["child_node"].id
+    
+    # 按节点过滤
+    result = qa_pair_service.get_message_timeline(node_ids=[test_data["root_node"].id])
+    assert result["total"] == 2
+    assert all(item["node_id"] == test_data["root_node"].id for item in result["items"])
+    
+    # 空节点集合
+    result = qa_pair_service.get_message_timeline(node_ids=[])
+    assert result["total"] == 0
+    assert result["items"] == []
+
+def test_get_message_timeline_pagination(db_session: Session, test_data):
+    """测试消息时间线的游标分页"""
+    # 创建QAPairService
+    qa_pair_service = QAPairService(db_session)
+    qa_pair_service.create_qa_pair(
+        node_id=test_data["child_node"].id,
+        question="子节点问题",
+        answer="子节点回答"
+    )
+    
+    # 第一页
+    page1 = qa_pair_service.get_message_timeline(session_id=test_data["session"].id, limit=3)
+    assert page1["total"] == 4
+    assert len(page1["items"]) == 3
+    assert page1["has_more"] is True
+    assert page1["next_after_timestamp"] == page1["items"][-1]["timestamp"]
+    assert page1["next_after_id"] == page1["items"][-1]["id"]
+    
+    # 第二页
+    page2 = qa_pair_service.get_message_timeline(
+        session_id=test_data["session"].id,
+        after_timestamp=page1["next_after_timestamp"],
+        after_seq=page1["next_after_seq"],
+        after_id=page1["next_after_id"],
+        limit=3
+    )
+    assert page2["total"] == 4
+    assert [item["content"] for item in page2["items"]] == ["子节点回答"]
+    assert page2["has_more"] is False
+    assert page2["next_after_timestamp"] is None
+    assert page2["next_after_id"] is None
+
+def test_get_message_timeline_pagination_same_timestamp(db_session: Session, test_data):
+    """测试时间戳相同的消息跨越分页边界时不会被跳过或重复"""
+    qa_pair_service = QAPairService(db_session)
+    for i in range(3):
+        qa_pair_service.create_qa_pair(
+            node_id=test_data["child_node"].id,
+            question=f"问题{i}",
+            answer=f"回答{i}"
+        )
+    # 所有消息使用同一个时间戳
+    timestamp = datetime(2024, 1, 1)
+    for message in db_session.exec(select(Message)).all():
+        message.timestamp = timestamp
+        db_session.add(message)
+    db_session.commit()
+    
+    expected = qa_pair_service.get_message_timeline(session_id=test_data["session"].id)["items"]
+    assert len(expected) == 8
+    
+    items = []
+    cursor = {}
+    while True:
+        page = qa_pair_service.get_message_timeline(session_id=test_data["session"].id, limit=3, **cursor)
+        items.extend(page["items"])
+        if not page["has_more"]:
+            break
+        assert page["next_after_timestamp"] == timestamp
+        cursor = {
+            "after_timestamp": page["next_after_timestamp"],
+            "after_seq": page["next_after_seq"],
+            "after_id": page["next_after_id"]
+        }
+    
+    assert [item["id"] for item in items] == [item["id"] for item in expected]
+
 @patch('app.services.qa_pair_service.get_llm_service')
 def test_ask_question(mock_get_llm_service, db_session: Session, test_data):
     """测试提问并获取回答"""
@@ -376,6 +549,131 @@ def test_ask_question(mock_get_llm_service, db_session: Session, test_data):
     # 验证LLM服务被调用
     mock_llm.call_llm.assert_called_once()
 
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_async_concurrent(mock_get_llm_service, db_session: Session, test_data):
+    """测试异步提问：并发等待LLM时不受线程池大小限制"""
+    delay = 0.5
+    
+    async def slow_ask(msg, context=None):
+        await asyncio.sleep(delay)
+        return f"回答：{msg}"
+    
+    mock_llm = MagicMock()
+    mock_llm.ask = slow_ask
+    mock_get_llm_service.return_value = mock_llm
+    
+    node_id = test_data["root_node"].id
+    count = 100
+    
+    async def ask_one(i):
+        # 每个并发请求使用独立的数据库会话，与请求作用域一致
+        with Session(db_session.get_bind()) as session:
+            return await QAPairService(session).ask_question_async(node_id, f"问题{i}")
+    
+    async def run():
+        return await asyncio.gather(*[ask_one(i) for i in range(count)])
+    
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    
+    assert len(results) == count
+    assert results[0]["messages"][1]["content"] == "回答：问题0"
+    # 串行或受线程池限制时耗时会是delay的数十倍
+    assert elapsed < delay * 10
+    
+    total = db_session.exec(select(func.count()).select_from(QAPair).where(QAPair.node_id == node_id)).one()
+    assert total == count + 1
+
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_stream_error_keeps_partial_answer(mock_get_llm_service, db_session: Session, test_data):
+    """测试流式回答中途失败时保存已收到的部分回答"""
+    async def failing_stream(msg, context=None):
+        yield "部分"
+        raise ValueError("连接中断")
+    
+    mock_llm = MagicMock()
+    mock_llm.stream = failing_stream
+    mock_get_llm_service.return_value = mock_llm
+    
+    qa_pair_service = QAPairService(db_session)
+    
+    async def run():
+        return [
+            event async for event in qa_pair_service.ask_question_stream(
+                node_id=test_data["root_node"].id,
+                question="流式问题"
+            )
+        ]
+    
+    events = asyncio.run(run())
+    
+    assert [event["event"] for event in events] == ["start", "token", "error"]
+    assert events[-1]["data"]["detail"] == "连接中断"
+    
+    result = qa_pair_service.get_qa_pair_with_messages(events[0]["data"]["qa_pair_id"])
+    answer = result["messages"][1]
+    assert answer["content"] == "部分"
+    assert answer["meta_info"]["incomplete"] is True
+    assert answer["meta_info"]["error"] == "连接中断"
+    assert answer["meta_info"]["first_token_latency_ms"] is not None
+
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_stream_client_disconnect(mock_get_llm_service, db_session: Session, test_data):
+    """测试客户端断开时在后台保存部分回答；还没有收到内容时删除只有问题的QA对"""
+    async def slow_stream(msg, context=None):
+        yield "部分"
+        await asyncio.sleep(10)
+        yield "不会到达"
+    
+    mock_llm = MagicMock()
+    mock_llm.stream = slow_stream
+    mock_get_llm_service.return_value = mock_llm
+    qa_pair_service = QAPairService(db_session)
+    node_id = test_data["root_node"].id
+    
+    async def disconnect_after(count, key):
+        events = []
+        stream = qa_pair_service.ask_question_stream(node_id, "流式问题", key)
+        async for event in stream:
+            events.append(event)
+            if len(events) == count:
+                break
+        # 模拟客户端断开：关闭生成器，保存在后台线程中进行
+        await stream.aclose()
+        await asyncio.gather(*_background_tasks)
+        return events[0]["data"]["qa_pair_id"]
+    
+    qa_pair_id = asyncio.run(disconnect_after(2, "disconnect-1"))
+    db_session.expire_all()
+    result = qa_pair_service.get_qa_pair_with_messages(qa_pair_id)
+    answer = result["messages"][1]
+    assert answer["content"] == "部分"
+    assert answer["meta_info"]["cancelled"] is True
+    assert db_session.get(QAPair, qa_pair_id).idempotency_key is None
+    
+    qa_pair_id = asyncio.run(disconnect_after(1, "disconnect-2"))
+    db_session.expire_all()
+    assert db_session.get(QAPair, qa_pair_id) is None
+    assert db_session.exec(select(Message).where(Message.qa_pair_id == qa_pair_id)).all() == []
+
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_records_cache_hit(mock_get_llm_service, db_session: Session, test_data):
+    """测试LLM回答来自缓存时，在助手消息的 meta_info 中标记"""
+    def cached_call_llm(prompt):
+        set_llm_call_info({"cache_hit": True, "cache_tier": "memory", "saved_latency_ms": 850.0})
+        return "缓存的回答"
+    
+    mock_llm = MagicMock()
+    mock_llm.call_llm = cached_call_llm
+    mock_get_llm_service.return_value = mock_llm
+    
+    result = QAPairService(db_session).ask_question(test_data["root_node"].id, "缓存的问题")
+    
+    meta_info = result["messages"][1]["meta_info"]
+    assert meta_info["cache_hit"] is True
+    assert meta_info["saved_latency_ms"] == 850.0
+
 def test_ask_question_invalid_node(db_session: Session):
     """测试使用无效的节点ID提问"""
     # 创建QAPairService
@@ -463,3 +761,154 @@ def test_search_qa_pairs_pagination(db_session: Session, test_data):
     assert len(result2["items"]) == 2
     assert result1["items"][0]["id"] != result2["items"][0]["id"]
     assert result1["items"][1]["id"] != result2["items"][0]["id"]
+
+def test_search_qa_pairs_full_text(db_session: Session, test_data):
+    """测试使用全文索引搜索QA对"""
+    qa_pair_service = QAPairService(db_session)
+    qa_pair_service.create_qa_pair(
+        node_id=test_data["root_node"].id,
+        question="What is SQLite FTS5?",
+        answer="A full-text search extension"
+    )
+    target = qa_pair_service.create_qa_pair(
+        node_id=test_data["child_node"].id,
+        question="全文检索如何排序",
+        answer="全文检索使用BM25排序，全文检索结果按相关度返回"
+    )
+    
+    # 大小写不敏感的子串匹配
+    result = qa_pair_service.search_qa_pairs(query="sqlite fts", session_id=test_data["session"].id)
+    assert result["total"] == 1
+    assert result["items"][0]["question"] == "What is SQLite FTS5?"
+    
+    # 按相关度排序
+    result = qa_pair_service.search_qa_pairs(query="全文检索", sort_by="relevance")
+    assert result["total"] == 1
+    assert result["items"][0]["id"] == target["id"]
+    
+    # 删除后索引同步更新
+    qa_pair_service.delete_qa_pair(target["id"])
+    result = qa_pair_service.search_qa_pairs(query="全文检索")
+    assert result["total"] == 0
+    assert "error" not in result
+
+def test_search_qa_pairs_special_characters(db_session: Session, test_data):
+    """测试检索词中的特殊字符不会破坏查询"""
+    qa_pair_service = QAPairService(db_session)
+    qa_pair_service.create_qa_pair(
+        node_id=test_data["root_node"].id,
+        question='引号"测试" AND 100%',
+        answer="回答"
+    )
+    
+    for query in ['"测试" AND', "100%", "%"]:
+        result = qa_pair_service.search_qa_pairs(query=query)
+        assert "error" not in result
+        assert result["total"] == 1
+
+def test_search_qa_pairs_filters(db_session: Session, test_data):
+    """测试搜索QA对时的过滤条件在数据库中生效"""
+    qa_pair_service = QAPairService(db_session)
+    root_id = test_data["root_node"].id
+    child_id = test_data["child_node"].id
+    
+    favorite = qa_pair_service.create_qa_pair(node_id=child_id, question="过滤测试问题 1")
+    rated = qa_pair_service.create_qa_pair(node_id=root_id, question="过滤测试问题 2", status="done")
+    qa_pair_service.update_qa_pair(rated["id"], rating=4)
+    db_qa_pair = db_session.get(QAPair, favorite["id"])
+    db_qa_pair.is_favorite = True
+    db_session.add(db_qa_pair)
+    db_session.commit()
+    
+    # 按节点过滤，总数与分页一致
+    result = qa_pair_service.search_qa_pairs(query="过滤测试", node_ids=[child_id])
+    assert result["total"] == 1
+    assert result["items"][0]["id"] == favorite["id"]
+    
+    # 按收藏、状态和评分过滤
+    assert qa_pair_service.search_qa_pairs(is_favorite=True)["items"][0]["id"] == favorite["id"]
+    assert qa_pair_service.search_qa_pairs(status="done")["items"][0]["id"] == rated["id"]
+    assert qa_pair_service.search_qa_pairs(min_rating=3)["total"] == 1
+    assert qa_pair_service.search_qa_pairs(max_rating=3)["total"] == 0
+    
+    # 按日期过滤
+    created_at = db_session.get(QAPair, rated["id"]).created_at
+    result = qa_pair_service.search_qa_pairs(query="过滤测试", date_from=created_at)
+    assert [item["id"] for item in result["items"]] == [rated["id"]]
+    result = qa_pair_service.search_qa_pairs(query="过滤测试", date_to=created_at, sort_order="asc")
+    assert [item["id"] for item in result["items"]] == [favorite["id"], rated["id"]]
+    
+    # 排序和分页
+    result = qa_pair_service.search_qa_pairs(query="过滤测试", sort_by="created_at", sort_order="desc", limit=1)
+    assert result["total"] == 2
+    assert [item["id"] for item in result["items"]] == [rated["id"]]
+
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_idempotency_key(mock_get_llm_service, db_session: Session, test_data):
+    """测试带幂等键的重复提问不再调用LLM，并发重试先保存时返回已保存的QA对"""
+    mock_llm = MagicMock()
+    mock_llm.call_llm.return_value = "模拟的LLM回答"
+    mock_get_llm_service.return_value = mock_llm
+    qa_pair_service = QAPairService(db_session)
+    node_id = test_data["root_node"].id
+    
+    first = qa_pair_service.ask_question(node_id, "幂等问题", idempotency_key="key-1")
+    second = qa_pair_service.ask_question(node_id, "幂等问题", idempotency_key="key-1")
+    
+    assert second["id"] == first["id"]
+    mock_llm.call_llm.assert_called_once()
+    with pytest.raises(ValueError):
+        qa_pair_service.ask_question(node_id, "其他问题", idempotency_key="key-1")
+    
+    # 另一个请求在调用LLM期间已经保存了相同幂等键的QA对
+    replay, created = qa_pair_service._save_answer(node_id, "幂等问题", "重复的回答", None, "key-1")
+    assert created is False
+    assert replay["id"] == first["id"]
+    total = db_session.exec(select(func.count()).select_from(QAPair).where(QAPair.idempotency_key == "key-1")).one()
+    assert total == 1
+
+@patch('app.services.qa_pair_service.get_llm_service')
+def test_ask_question_stream_idempotency_key(mock_get_llm_service, db_session: Session, test_data):
+    """测试流式提问只在成功回答后重放，失败时释放幂等键，回答中的重试被拒绝"""
+    answers = [ValueError("连接中断"), "流式回答"]
+    
+    async def stream(msg, context=None):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        yield answer
+    
+    mock_llm = MagicMock()
+    mock_llm.stream = stream
+    mock_get_llm_service.return_value = mock_llm
+    qa_pair_service = QAPairService(db_session)
+    node_id = test_data["root_node"].id
+    
+    def ask():
+        async def run():
+            return [event async for event in qa_pair_service.ask_question_stream(node_id, "流式问题", "stream-key")]
+        return asyncio.run(run())
+    
+    # 失败的回答不会被当作结果重放
+    failed = ask()
+    assert failed[-1]["event"] == "error"
+    assert db_session.get(QAPair, failed[0]["data"]["qa_pair_id"]).idempotency_key is None
+    
+    retried = ask()
+    assert [event["event"] for event in retried] == ["start", "token", "done"]
+    replayed = ask()
+    assert [event["event"] for event in replayed] == ["start", "done"]
+    assert replayed[-1]["data"]["id"] == retried[-1]["data"]["id"]
+    
+    # 预留了幂等键但还没有回答的请求视为进行中
+    pending = qa_pair_service.create_qa_pair(node_id, "进行中的问题", idempotency_key="pending-key")
+    with pytest.raises(IdempotencyKeyInProgress):
+        qa_pair_service.ask_question(node_id, "进行中的问题", idempotency_key="pending-key")
+    
+    # 超过等待时间的预留视为已中断，释放幂等键
+    qa_pair = db_session.get(QAPair, pending["id"])
+    qa_pair.created_at = datetime.utcnow() - timedelta(hours=1)
+    db_session.add(qa_pair)
+    db_session.commit()
+    assert qa_pair_service.get_idempotent_qa_pair("pending-key", node_id, "进行中的问题") is None
+    assert db_session.get(QAPair, pending["id"]).idempotency_key is None
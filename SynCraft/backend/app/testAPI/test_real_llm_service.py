@@ -0,0 +1,414 @@
+# backend/app/testAPI/test_real_llm_service.py
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.services.llm.real_llm_service import RealLLMService
+from app.services.llm.resilience import CircuitBreaker, ResiliencePolicy, parse_retry_after
+from app.services.llm.response_cache import (
+    LLMCacheBypassMiddleware, LLMResponseCache, bypass_llm_cache, cache_bypassed, cache_key, get_llm_call_info
+)
+
+def _completion_handler(requests):
+    """返回固定补全结果，并记录收到的请求"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "回答"}}]})
+    return handler
+
+@pytest.fixture
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+
+def test_call_llm_reuses_client(api_key):
+    """测试同步调用复用同一个客户端，并使用配置中的超时和请求头"""
+    requests = []
+    service = RealLLMService(transport=httpx.MockTransport(_completion_handler(requests)))
+    
+    assert service.call_llm("问题1") == "回答"
+    client = service.client
+    assert service.call_llm("问题2") == "回答"
+    
+    assert service.client is client
+    assert len(requests) == 2
+    assert requests[0].headers["Authorization"] == "Bearer test-key"
+    assert requests[0].headers["X-Title"] == "SynCraft"
+    
+    timeouts = service.llm_config["http"]["timeouts"]
+    assert client.timeout.connect == timeouts["connect"]
+    assert client.timeout.read == timeouts["read"]
+    
+    asyncio.run(service.aclose())
+    assert client.is_closed
+    assert service._client is None
+
+def test_ask_reuses_async_client(api_key):
+    """测试异步调用复用同一个客户端，关闭后释放连接池"""
+    requests = []
+    service = RealLLMService(async_transport=httpx.MockTransport(_completion_handler(requests)))
+    
+    async def run():
+        first = await service.ask("问题1")
+        client = service.async_client
+        second = await service.ask("问题2", [{"role": "system", "content": "上下文"}])
+        assert service.async_client is client
+        await service.aclose()
+        return first, second, client
+    
+    first, second, client = asyncio.run(run())
+    
+    assert first == second == "回答"
+    assert len(requests) == 2
+    assert client.is_closed
+
+def test_stream_parses_sse(api_key):
+    """测试解析OpenAI兼容的流式响应"""
+    requests = []
+    body = (
+        ": OPENROUTER PROCESSING\n\n"
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "你好"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "，世界"}}]}\n\n'
+        "data: [DONE]\n\n"
+    )
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+    
+    service = RealLLMService(async_transport=httpx.MockTransport(handler))
+    
+    async def run():
+        chunks = [chunk async for chunk in service.stream("问题")]
+        await service.aclose()
+        return chunks
+    
+    assert asyncio.run(run()) == ["你好", "，世界"]
+    assert json.loads(requests[0].content)["stream"] is True
+
+def test_stream_error_status(api_key):
+    """测试流式请求返回错误状态码时抛出ValueError"""
+    service = RealLLMService(async_transport=httpx.MockTransport(
+        lambda request: httpx.Response(429, text="rate limited")
+    ))
+    
+    async def run():
+        return [chunk async for chunk in service.stream("问题")]
+    
+    with pytest.raises(ValueError, match="429"):
+        asyncio.run(run())
+
+def test_response_cache_memory_and_disk(api_key, tmp_path):
+    """测试相同消息命中内存缓存，新的服务实例从磁盘缓存读取"""
+    requests = []
+    disk_path = str(tmp_path / "llm_cache.db")
+    service = RealLLMService(
+        transport=httpx.MockTransport(_completion_handler(requests)),
+        response_cache=LLMResponseCache(disk_path=disk_path)
+    )
+    
+    assert service.call_llm("问题") == "回答"
+    info = get_llm_call_info()
+    assert info["cache_hit"] is False
+    assert info["model"] == service.llm_config["models"]["default"]
+    # 首尾空白和换行方式不影响缓存键
+    assert service.call_llm(" 问题\r\n") == "回答"
+    info = get_llm_call_info()
+    assert info["cache_hit"] is True
+    assert info["cache_tier"] == "memory"
+    assert info["saved_latency_ms"] >= 0
+    assert len(requests) == 1
+    asyncio.run(service.aclose())
+    
+    # 新实例只有磁盘层中的记录；异步接口与同步接口的相同消息共用缓存
+    service = RealLLMService(
+        async_transport=httpx.MockTransport(_completion_handler(requests)),
+        response_cache=LLMResponseCache(disk_path=disk_path)
+    )
+    
+    async def run():
+        answer = await service.ask("问题")
+        return answer, get_llm_call_info()
+    
+    answer, info = asyncio.run(run())
+    assert answer == "回答"
+    assert info["cache_tier"] == "disk"
+    assert len(requests) == 1
+    asyncio.run(service.aclose())
+
+def test_response_cache_bypass(api_key):
+    """测试跳过缓存查找时重新请求，并用新的回答刷新缓存"""
+    requests = []
+    service = RealLLMService(
+        transport=httpx.MockTransport(_completion_handler(requests)),
+        response_cache=LLMResponseCache(disk_path=None)
+    )
+    
+    service.call_llm("问题")
+    with bypass_llm_cache():
+        service.call_llm("问题")
+        info = get_llm_call_info()
+        assert info["cache_hit"] is False
+        assert info["cache_bypassed"] is True
+    service.call_llm("问题")
+    
+    assert len(requests) == 2
+    assert get_llm_call_info()["cache_hit"] is True
+
+def test_response_cache_limits(tmp_path):
+    """测试缓存过期和容量上限"""
+    cache = LLMResponseCache(memory_max_entries=2, disk_path=str(tmp_path / "llm_cache.db"), disk_max_entries=3)
+    for i in range(5):
+        cache.set(f"key-{i}", {"content": f"回答{i}"})
+    
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["disk_entries"] == 3
+    assert cache.get("key-0") == (None, None)
+    assert cache.get("key-2") == ({"content": "回答2"}, "disk")
+    assert cache.get("key-4") == ({"content": "回答4"}, "memory")
+    
+    expired = LLMResponseCache(ttl=0, disk_path=None)
+    expired.set("key", {"content": "回答"})
+    assert expired.get("key") == (None, None)
+    cache.close()
+
+def test_response_cache_key():
+    """测试缓存键包含模型和参数，与是否流式无关"""
+    payload = {"model": "m1", "temperature": 0.7, "messages": [{"role": "user", "content": "问题"}]}
+    
+    assert cache_key(payload) == cache_key({**payload, "stream": True})
+    assert cache_key(payload) != cache_key({**payload, "model": "m2"})
+    assert cache_key(payload) != cache_key({**payload, "temperature": 0.2})
+
+def test_cache_bypass_middleware():
+    """测试请求头 X-LLM-Cache: bypass 在请求处理期间跳过缓存查找"""
+    seen = []
+    
+    async def app(scope, receive, send):
+        seen.append(cache_bypassed())
+    
+    middleware = LLMCacheBypassMiddleware(app)
+    asyncio.run(middleware({"type": "http", "headers": [(b"x-llm-cache", b"Bypass")]}, None, None))
+    asyncio.run(middleware({"type": "http", "headers": []}, None, None))
+    
+    assert seen == [True, False]
+    assert cache_bypassed() is False
+
+def test_concurrent_identical_requests_coalesced(api_key):
+    """测试相同的并发请求只请求上游一次，所有调用方得到同一个回答"""
+    requests = []
+    
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "回答"}}]})
+    
+    service = RealLLMService(async_transport=httpx.MockTransport(handler))
+    
+    async def ask(msg):
+        answer = await service.ask(msg)
+        return answer, get_llm_call_info()
+    
+    async def run():
+        results = await asyncio.gather(*[ask("问题") for _ in range(5)], ask("其他问题"))
+        await service.aclose()
+        return results
+    
+    results = asyncio.run(run())
+    
+    assert [answer for answer, _ in results] == ["回答"] * 6
+    assert len(requests) == 2
+    assert sum(1 for _, info in results if info and info.get("coalesced")) == 4
+
+def test_concurrent_identical_sync_requests_coalesced(api_key):
+    """测试同步接口在多个线程中的相同请求只请求上游一次"""
+    requests = []
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        time.sleep(0.2)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "回答"}}]})
+    
+    service = RealLLMService(transport=httpx.MockTransport(handler))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        answers = list(executor.map(lambda _: service.call_llm("问题"), range(4)))
+    
+    assert answers == ["回答"] * 4
+    assert len(requests) == 1
+    asyncio.run(service.aclose())
+
+class FaultInjectingServer:
+    """
+    本地故障注入模拟服务
+    
+    按模型依次返回预设的故障（状态码、响应头、延迟、连接失败），预设用完后返回正常回答；
+    同步和异步传输层共用同一份预设和请求记录
+    """
+    
+    def __init__(self, faults):
+        self.faults = {model: list(items) for model, items in faults.items()}
+        self.requests = []
+    
+    def _next_fault(self, request: httpx.Request):
+        body = json.loads(request.content)
+        self.requests.append(body["model"])
+        items = self.faults.get(body["model"], [])
+        return body, (items.pop(0) if items else {})
+    
+    @staticmethod
+    def _respond(request: httpx.Request, body, fault) -> httpx.Response:
+        if fault.get("connect_error"):
+            raise httpx.ConnectError("connection refused", request=request)
+        status = fault.get("status", 200)
+        if status != 200:
+            return httpx.Response(status, text="injected fault", headers=fault.get("headers", {}))
+        answer = f"{body['model']} 的回答"
+        if body.get("stream"):
+            text = f"data: {json.dumps({'choices': [{'delta': {'content': answer}}]})}\n\ndata: [DONE]\n\n"
+            return httpx.Response(200, text=text, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": answer}}]})
+    
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body, fault = self._next_fault(request)
+        time.sleep(fault.get("delay", 0))
+        return self._respond(request, body, fault)
+    
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        body, fault = self._next_fault(request)
+        await asyncio.sleep(fault.get("delay", 0))
+        return self._respond(request, body, fault)
+
+def _resilient_service(server: FaultInjectingServer, response_cache=None, **policy) -> RealLLMService:
+    """创建连接到故障注入服务的LLM服务，默认模型 primary，备选模型 backup"""
+    service = RealLLMService(
+        transport=httpx.MockTransport(server.handle),
+        async_transport=httpx.MockTransport(server.ahandle),
+        response_cache=response_cache
+    )
+    service.llm_config["models"] = {"default": "primary", "alternatives": ["backup"]}
+    service.resilience = ResiliencePolicy({"base_delay": 0.01, "max_delay": 0.05, "hedge_after": 0, **policy})
+    return service
+
+def test_retry_honors_retry_after(api_key):
+    """测试可重试的错误按退避重试，并遵守 Retry-After"""
+    server = FaultInjectingServer({"primary": [
+        {"status": 429, "headers": {"Retry-After": "0.2"}},
+        {"connect_error": True},
+    ]})
+    service = _resilient_service(server)
+    
+    started = time.perf_counter()
+    assert service.call_llm("问题") == "primary 的回答"
+    
+    assert time.perf_counter() - started >= 0.2
+    assert server.requests == ["primary"] * 3
+    info = get_llm_call_info()
+    assert info["attempts"] == 3
+    assert "fallback" not in info
+
+def test_non_retryable_error_fails_fast(api_key):
+    """测试不可重试的错误（如400）不重试也不换模型"""
+    server = FaultInjectingServer({"primary": [{"status": 400}]})
+    service = _resilient_service(server)
+    
+    with pytest.raises(ValueError, match="400"):
+        service.call_llm("问题")
+    assert server.requests == ["primary"]
+
+def test_fallback_and_circuit_breaker(api_key):
+    """测试默认模型持续失败时改用备选模型，熔断后不再请求默认模型"""
+    server = FaultInjectingServer({"primary": [{"status": 503}] * 10})
+    service = _resilient_service(server, max_attempts=2, breaker_failure_threshold=2, breaker_reset_timeout=60)
+    
+    assert service.call_llm("问题1") == "backup 的回答"
+    assert get_llm_call_info()["fallback"] is True
+    assert server.requests == ["primary", "primary", "backup"]
+    assert service._breaker("primary").state == "open"
+    
+    server.requests.clear()
+    assert service.call_llm("问题2") == "backup 的回答"
+    assert server.requests == ["backup"]
+
+def test_fallback_answer_not_cached(api_key):
+    """测试备选模型的回答不写入以默认模型计算的缓存键，默认模型恢复后重新请求"""
+    server = FaultInjectingServer({"primary": [{"status": 503}] * 2})
+    service = _resilient_service(server, response_cache=LLMResponseCache(disk_path=None), max_attempts=2)
+    
+    assert service.call_llm("问题") == "backup 的回答"
+    assert service.response_cache.stats()["memory_entries"] == 0
+    
+    # 默认模型恢复后得到默认模型的回答，并写入缓存
+    server.requests.clear()
+    assert service.call_llm("问题") == "primary 的回答"
+    assert server.requests == ["primary"]
+    assert service.call_llm("问题") == "primary 的回答"
+    assert server.requests == ["primary"]
+    assert get_llm_call_info()["cache_hit"] is True
+
+def test_hedged_request_bounds_latency(api_key):
+    """测试默认模型响应慢时并行请求备选模型，先返回的结果生效"""
+    server = FaultInjectingServer({"primary": [{"delay": 2.0}]})
+    service = _resilient_service(server, hedge_after=0.05)
+    
+    async def run():
+        answer = await service.ask("问题")
+        return answer, get_llm_call_info()
+    
+    started = time.perf_counter()
+    answer, info = asyncio.run(run())
+    
+    assert time.perf_counter() - started < 1.0
+    assert answer == "backup 的回答"
+    assert info["hedged"] is True
+    assert server.requests == ["primary", "backup"]
+
+def test_deadline_exceeded(api_key):
+    """测试所有模型都无响应时在截止时间返回504"""
+    server = FaultInjectingServer({"primary": [{"delay": 2.0}], "backup": [{"delay": 2.0}]})
+    service = _resilient_service(server, deadline=0.3)
+    
+    started = time.perf_counter()
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(service.ask("问题"))
+    
+    assert exc_info.value.status_code == 504
+    assert time.perf_counter() - started < 1.0
+
+def test_stream_falls_back_before_first_token(api_key):
+    """测试流式请求在收到内容之前失败时改用备选模型"""
+    server = FaultInjectingServer({"primary": [{"status": 502}, {"status": 502}, {"status": 502}]})
+    service = _resilient_service(server)
+    
+    async def run():
+        return [chunk async for chunk in service.stream("问题")]
+    
+    assert asyncio.run(run()) == ["backup 的回答"]
+    assert server.requests == ["primary"] * 3 + ["backup"]
+
+def test_circuit_breaker_half_open():
+    """测试熔断器在重置时间后只放行一个试探请求"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_parse_retry_after():
+    """测试解析秒数和HTTP日期格式的 Retry-After"""
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("invalid") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert ResiliencePolicy({"max_retry_after": 10}).retry_delay(1, retry_after=60) is None
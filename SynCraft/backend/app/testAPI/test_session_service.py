@@ -1,11 +1,14 @@
 # backend/app/testAPI/test_session_service.py
 import pytest
-from sqlmodel import Session
+from sqlmodel import Session, select
 
 from app.services.session_service import SessionService
 from app.models.session import Session as SessionModel
 from app.models.node import Node
+from app.models.edge import Edge
 from app.models.context import Context
+from app.models.qapair import QAPair
+from app.models.message import Message
 
 def test_create_session(db_session: Session):
     """测试创建会话"""
@@ -116,3 +119,127 @@ def test_get_main_context(db_session: Session, test_data):
     assert context.id == test_data["context"].id
     assert context.mode == "chat"
     assert context.context_root_node_id == test_data["root_node"].id
+
+def test_get_session_tree(db_session: Session, test_data):
+    """测试获取会话树（包含QA预览）"""
+    # 创建SessionService
+    session_service = SessionService(db_session)
+    
+    # 获取会话树
+    result = session_service.get_session_tree(test_data["session"].id, include_qa=True)
+    
+    # 验证节点和边
+    assert len(result["nodes"]) == 2
+    assert len(result["edges"]) == 1
+    assert result["edges"][0]["source"] == test_data["root_node"].id
+    assert result["edges"][0]["target"] == test_data["child_node"].id
+    
+    nodes = {node["id"]: node for node in result["nodes"]}
+    root_node = nodes[test_data["root_node"].id]
+    child_node = nodes[test_data["child_node"].id]
+    
+    # 验证QA预览
+    assert root_node["qa_summary"]["question_preview"] == "测试问题"
+    assert root_node["qa_summary"]["answer_preview"] == "测试回答"
+    assert "qa_summary" not in child_node
+    assert child_node["parent_id"] == test_data["root_node"].id
+    assert "parent_id" not in root_node
+
+def test_get_session_tree_truncates_preview(db_session: Session, test_data):
+    """测试会话树中的长内容预览被截断"""
+    # 为子节点添加长问题
+    qa_pair = QAPair(node_id=test_data["child_node"].id, session_id=test_data["session"].id)
+    db_session.add(qa_pair)
+    db_session.commit()
+    db_session.add(Message(qa_pair_id=qa_pair.id, role="user", content="问" * 150))
+    db_session.commit()
+    
+    # 创建SessionService
+    session_service = SessionService(db_session)
+    
+    # 获取会话树
+    result = session_service.get_session_tree(test_data["session"].id, include_qa=True)
+    
+    # 验证预览被截断
+    child_node = next(node for node in result["nodes"] if node["id"] == test_data["child_node"].id)
+    assert child_node["qa_summary"]["question_preview"] == "问" * 100 + "..."
+    assert "answer_preview" not in child_node["qa_summary"]
+
+def test_session_cache_invalidation(db_session: Session, test_data):
+    """测试会话缓存跨服务实例共享，并在修改后失效"""
+    session_id = test_data["session"].id
+    
+    # 不同的服务实例共享缓存
+    assert SessionService(db_session).get_session(session_id)["name"] == "测试会话"
+    assert SessionService(db_session).get_sessions()["total"] == 1
+    
+    # 更新后会话详情和列表都失效
+    SessionService(db_session).update_session(session_id, name="新名称")
+    assert SessionService(db_session).get_session(session_id)["name"] == "新名称"
+    assert SessionService(db_session).get_sessions()["items"][0].name == "新名称"
+    
+    # 新建会话后列表失效
+    SessionService(db_session).create_session(name="另一个会话")
+    assert SessionService(db_session).get_sessions()["total"] == 2
+    
+    # 删除后会话详情失效
+    SessionService(db_session).delete_session(session_id)
+    assert SessionService(db_session).get_session(session_id) is None
+
+def test_delete_session_cascade(db_session: Session, test_data):
+    """测试批量删除会话时删除所有依赖记录，不留下孤立数据"""
+    session_service = SessionService(db_session)
+    session_id = test_data["session"].id
+    qa_pair_id = test_data["qa_pair"].id
+    
+    # 另一个会话的数据不受影响
+    other = session_service.create_session(name="另一个会话")
+    
+    counts = session_service.delete_session_cascade(session_id)
+    
+    assert counts == {
+        "messages": 2,
+        "qa_pairs": 1,
+        "edges": 1,
+        "context_nodes": 1,
+        "contexts": 1,
+        "closure_rows": 0,
+        "nodes": 2,
+        "sessions": 1,
+    }
+    assert db_session.exec(select(Node).where(Node.session_id == session_id)).all() == []
+    assert db_session.exec(select(Edge).where(Edge.session_id == session_id)).all() == []
+    assert db_session.exec(select(Message).where(Message.qa_pair_id == qa_pair_id)).all() == []
+    assert db_session.get(SessionModel, session_id) is None
+    
+    assert db_session.get(SessionModel, other["id"]) is not None
+    assert db_session.get(Node, other["root_node_id"]) is not None
+    
+    assert session_service.delete_session_cascade(session_id) is None
+
+def test_delete_session_background_job(db_session: Session, test_data):
+    """测试后台删除会话任务"""
+    session_service = SessionService(db_session)
+    session_id = test_data["session"].id
+    
+    job = session_service.start_delete_session_job(session_id, user_id="local")
+    assert job["status"] == "pending"
+    assert db_session.get(SessionModel, session_id) is not None
+    
+    session_service.run_delete_session_job(job["job_id"])
+    
+    result = session_service.get_delete_session_job(job["job_id"])
+    assert result["status"] == "completed"
+    assert result["counts"]["nodes"] == 2
+    assert result["finished_at"] is not None
+    db_session.expire_all()
+    assert db_session.get(SessionModel, session_id) is None
+    
+    # 会话不存在时任务失败
+    job = session_service.start_delete_session_job(session_id)
+    session_service.run_delete_session_job(job["job_id"])
+    result = session_service.get_delete_session_job(job["job_id"])
+    assert result["status"] == "failed"
+    assert result["error"] == "Session not found"
+    
+    assert session_service.get_delete_session_job("invalid-job-id") is None
@@ -0,0 +1,101 @@
+# backend/app/testAPI/test_summary_service.py
+from sqlmodel import Session
+
+from app.models.node import Node
+from app.services.node_service import NodeService
+from app.services.qa_pair_service import QAPairService
+from app.utils.prompt import estimate_tokens
+from app.services.summary_service import SummaryService, SummaryWorker, schedule_summary, summary_worker
+
+def test_update_node_summary_from_parent(db_session: Session, test_data):
+    """测试节点没有摘要时以父节点摘要为基础，合并新的问答"""
+    root = db_session.get(Node, test_data["root_node"].id)
+    root.summary_up_to_here = "根节点的摘要"
+    db_session.add(root)
+    db_session.commit()
+    child_id = test_data["child_node"].id
+    qa_pair = QAPairService(db_session).create_qa_pair(child_id, "子节点问题", "子节点回答")
+    
+    summary = SummaryService(db_session, use_llm=False).update_node_summary(child_id, qa_pair["id"])
+    
+    assert summary == "根节点的摘要\nQ: 子节点问题 A: 子节点回答"
+    assert db_session.get(Node, child_id).summary_up_to_here == summary
+
+def test_update_node_summary_incremental(db_session: Session, test_data):
+    """测试同一节点的后续问答逐行追加，超出长度时保留最早的内容并省略中间的条目"""
+    child_id = test_data["child_node"].id
+    qa_service = QAPairService(db_session)
+    service = SummaryService(db_session, use_llm=False, max_tokens=32, turn_tokens=15)
+    first = qa_service.create_qa_pair(child_id, "第一个问题", "第一个回答")
+    second = qa_service.create_qa_pair(child_id, "第二个问题", "第二个回答。" + "补充说明" * 10)
+    third = qa_service.create_qa_pair(child_id, "第三个问题", "第三个回答")
+    
+    assert service.update_node_summary(child_id, first["id"]) == "Q: 第一个问题 A: 第一个回答"
+    # 过长的回答只保留开头的句子
+    assert service.update_node_summary(child_id, second["id"]) == (
+        "Q: 第一个问题 A: 第一个回答\nQ: 第二个问题 A: 第二个回答。"
+    )
+    summary = service.update_node_summary(child_id, third["id"])
+    
+    # 保留最早的一轮和最新的一轮，中间的条目被省略
+    assert summary == "Q: 第一个问题 A: 第一个回答\n…\nQ: 第三个问题 A: 第三个回答"
+    assert estimate_tokens(summary) <= 32
+    assert service.update_node_summary("missing-node-id", second["id"]) is None
+
+def test_update_node_summary_with_llm(db_session: Session, test_data):
+    """测试使用LLM生成摘要，提示词包含已有摘要和新的问答"""
+    child_id = test_data["child_node"].id
+    qa_pair = QAPairService(db_session).create_qa_pair(child_id, "子节点问题", "子节点回答")
+    
+    summary = SummaryService(db_session, use_llm=True).update_node_summary(child_id, qa_pair["id"])
+    
+    # 模拟LLM会在回答中带上提示词
+    assert "【新的问答】" in summary
+    assert "Q: 子节点问题" in summary
+
+def test_summary_worker_processes_in_order(db_session: Session, test_data):
+    """测试后台队列按顺序处理，子节点的摘要基于已生成的父节点摘要"""
+    qa_service = QAPairService(db_session)
+    child_id = test_data["child_node"].id
+    grandchild = NodeService(db_session).create_node(test_data["session"].id, child_id)
+    grandchild_id = grandchild.id
+    first = qa_service.create_qa_pair(child_id, "子节点问题", "子节点回答")
+    second = qa_service.create_qa_pair(grandchild_id, "孙节点问题", "孙节点回答")
+    
+    def process(bind, node_id, qa_pair_id):
+        with Session(bind) as db:
+            return SummaryService(db, use_llm=False).update_node_summary(node_id, qa_pair_id)
+    
+    worker = SummaryWorker()
+    worker.process = process
+    bind = db_session.get_bind()
+    worker.enqueue(bind, child_id, first["id"])
+    worker.enqueue(bind, grandchild_id, second["id"])
+    worker.join()
+    worker.stop()
+    
+    db_session.expire_all()
+    assert worker.stats == {"processed": 2, "failed": 0}
+    assert db_session.get(Node, grandchild_id).summary_up_to_here == (
+        "Q: 子节点问题 A: 子节点回答\nQ: 孙节点问题 A: 孙节点回答"
+    )
+
+def test_schedule_summary_reads_flag_at_call_time(db_session: Session, test_data, monkeypatch):
+    """测试 SUMMARY_WORKER_ENABLED 在调用时读取，导入之后修改环境变量也能生效"""
+    child_id = test_data["child_node"].id
+    qa_pair = QAPairService(db_session).create_qa_pair(child_id, "子节点问题", "子节点回答")
+    bind = db_session.get_bind()
+    
+    monkeypatch.setenv("SUMMARY_WORKER_ENABLED", "false")
+    schedule_summary(bind, child_id, qa_pair["id"])
+    summary_worker.join()
+    db_session.expire_all()
+    assert db_session.get(Node, child_id).summary_up_to_here is None
+    
+    monkeypatch.setenv("SUMMARY_WORKER_ENABLED", "true")
+    monkeypatch.delenv("SUMMARY_USE_LLM", raising=False)
+    schedule_summary(bind, child_id, qa_pair["id"])
+    summary_worker.join()
+    db_session.expire_all()
+    # 默认不调用LLM，直接追加问答
+    assert db_session.get(Node, child_id).summary_up_to_here == "Q: 子节点问题 A: 子节点回答"
@@ -1,72 +1,251 @@
 # backend/app/utils/prompt.py
 """
 Prompt 组装器
-根据父节点的信息构建提示词
+沿根节点到当前节点的祖先链收集之前的问答，在token预算内组装成对话消息列表
 """
-from app.models.node import Node
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+import math
+import re
+
 from sqlmodel import Session, select
+from sqlalchemy import literal
+
+from app.models.node import Node
 from app.models.qapair import QAPair
 from app.models.message import Message
-from app.database import get_session
 
-def build_prompt(parent: Node | None, question: str) -> str:
+# 历史上下文（摘要和之前的问答，不含当前问题）可用的token数
+PROMPT_TOKEN_BUDGET = int(getenv("PROMPT_TOKEN_BUDGET", "3000"))
+
+# 最多直接放入的最近问答数，更早的问答由节点摘要代替，使提示词长度不随对话深度增长
+PROMPT_MAX_TURNS = int(getenv("PROMPT_MAX_TURNS", "6"))
+
+# 祖先链的最大深度，防止父节点指针成环时无限递归
+MAX_CHAIN_DEPTH = 1000
+
+# 每条消息的格式开销（角色、分隔符）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# 摘要被截断到少于这个token数时不再使用
+MIN_SUMMARY_TOKENS = 32
+
+# 摘要消息的前缀
+SUMMARY_PREFIX = "之前对话的摘要：\n"
+
+# 中日韩字符和全角标点，大多数分词器中约一个字符一个token
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+def estimate_tokens(text: Optional[str]) -> int:
     """
-    构建提示词
+    快速估算文本的token数，不依赖分词器
     
-    Args:
-        parent: 父节点，可能为None
-        question: 当前问题
-        
-    Returns:
-        构建好的提示词
+    中日韩字符按每字一个token，其他字符按每4个字符一个token
     """
-    if not parent:
-        return question
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算消息列表的token数"""
+    return sum(estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """保留文本末尾不超过 max_tokens 的部分（摘要越靠后的内容越新）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    # 二分查找满足预算的最长后缀
+    while low < high:
+        mid = (low + high) // 2
+        if estimate_tokens(text[mid:]) <= max_tokens:
+            high = mid
+        else:
+            low = mid + 1
+    return "…" + text[low + 1:] if low < len(text) else ""
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """保留文本开头不超过 max_tokens 的部分（摘要越靠前的内容越早，提示词中不会重复出现）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    # 二分查找满足预算的最长前缀
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…" if low > 0 else ""
+
+class PromptBuilder:
+    """
+    根据节点的祖先链构建对话上下文
     
-    # 获取父节点的QA对
-    db = next(get_session())
-    parent_qa_pairs = []
+    用一次查询取出根节点到当前节点路径上所有节点的摘要和问答，
+    从最近的问答开始放入预算，最多 max_turns 个；其余较早的问答用已有的 summary_up_to_here 代替。
+    """
     
-    try:
-        # 查询父节点的QA对
-        query = select(QAPair).where(QAPair.node_id == parent.id).order_by(QAPair.created_at)
-        parent_qa_pairs = db.exec(query).all()
+    def __init__(self, db: Session, token_budget: int = PROMPT_TOKEN_BUDGET,
+                 max_turns: int = PROMPT_MAX_TURNS):
+        self.db = db
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+    
+    def load_chain(self, node_id: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        一次查询获取祖先链上的节点和问答
+        
+        Returns:
+            (nodes, turns)：nodes 按根节点到当前节点排序，每项包含 id 和 summary；
+            turns 按时间顺序排序，每项包含 node_id、question 和 answer
+        """
+        chain = (
+            select(Node.id.label("node_id"), Node.parent_id.label("parent_id"), literal(0).label("depth"))
+            .where(Node.id == node_id)
+            .cte("chain", recursive=True)
+        )
+        chain = chain.union_all(
+            select(Node.id, Node.parent_id, chain.c.depth + 1)
+            .join(chain, Node.id == chain.c.parent_id)
+            .where(chain.c.depth < MAX_CHAIN_DEPTH)
+        )
+        query = (
+            select(
+                chain.c.node_id,
+                Node.summary_up_to_here,
+                QAPair.id,
+                Message.role,
+                Message.content
+            )
+            .join(Node, Node.id == chain.c.node_id)
+            .outerjoin(QAPair, QAPair.node_id == chain.c.node_id)
+            .outerjoin(Message, Message.qa_pair_id == QAPair.id)
+            .order_by(chain.c.depth.desc(), QAPair.created_at, Message.seq, Message.timestamp)
+        )
         
-        if not parent_qa_pairs:
-            # 如果父节点没有QA对，直接返回问题
-            return question
+        nodes: List[Dict[str, Any]] = []
+        turns: List[Dict[str, Any]] = []
+        turns_by_pair: Dict[str, Dict[str, Any]] = {}
+        for chain_node_id, summary, qa_pair_id, role, content in self.db.exec(query).all():
+            if not nodes or nodes[-1]["id"] != chain_node_id:
+                nodes.append({"id": chain_node_id, "summary": summary})
+            if qa_pair_id is None or role is None:
+                continue
+            
+            turn = turns_by_pair.get(qa_pair_id)
+            if turn is None:
+                turn = {"node_id": chain_node_id, "question": None, "answer": None}
+                turns_by_pair[qa_pair_id] = turn
+                turns.append(turn)
+            # 同一角色有多条消息时以最后一条为准
+            if role == "user":
+                turn["question"] = content
+            elif role == "assistant":
+                turn["answer"] = content
         
-        # 获取最新的QA对
-        latest_qa_pair = parent_qa_pairs[-1]
+        # 只保留完整的问答（正在回答或回答失败的不放入上下文）
+        turns = [turn for turn in turns if turn["question"] and turn["answer"]]
+        return nodes, turns
+    
+    def build_context(self, node_id: str) -> List[Dict[str, str]]:
+        """
+        构建节点的历史上下文消息列表（OpenAI格式），不含当前问题
         
-        # 查询QA对的消息
-        msg_query = select(Message).where(Message.qa_pair_id == latest_qa_pair.id).order_by(Message.timestamp)
-        messages = db.exec(msg_query).all()
+        Returns:
+            [{"role": "system", "content": 摘要}（可选）, {"role": "user", ...}, {"role": "assistant", ...}, ...]
+        """
+        nodes, turns = self.load_chain(node_id)
         
-        # 提取问题和回答
-        parent_question = None
-        parent_answer = None
+        # 从最近的问答开始，放入预算内能容纳的部分
+        remaining = self.token_budget
+        included: List[Dict[str, Any]] = []
+        for turn in reversed(turns):
+            if len(included) >= self.max_turns:
+                break
+            cost = estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"]) + 2 * MESSAGE_TOKEN_OVERHEAD
+            if cost > remaining:
+                break
+            included.insert(0, turn)
+            remaining -= cost
         
-        for msg in messages:
-            if msg.role == "user":
-                parent_question = msg.content
-            elif msg.role == "assistant":
-                parent_answer = msg.content
+        messages: List[Dict[str, str]] = []
+        omitted = turns[:len(turns) - len(included)]
+        if omitted:
+            summary = self._summary_for(nodes, included[0]["node_id"] if included else None)
+            if summary:
+                summary = clip_to_tokens(
+                    summary, remaining - MESSAGE_TOKEN_OVERHEAD - estimate_tokens(SUMMARY_PREFIX)
+                )
+                if estimate_tokens(summary) >= MIN_SUMMARY_TOKENS:
+                    messages.append({"role": "system", "content": SUMMARY_PREFIX + summary})
         
-        # 如果没有找到问题或回答，直接返回问题
-        if not parent_question or not parent_answer:
-            return question
+        for turn in included:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+        return messages
+    
+    def build_messages(self, node_id: str, question: str) -> List[Dict[str, str]]:
+        """构建完整的消息列表：历史上下文加当前问题"""
+        return self.build_context(node_id) + [{"role": "user", "content": question}]
+    
+    @staticmethod
+    def _summary_for(nodes: List[Dict[str, Any]], first_included_node_id: Optional[str]) -> Optional[str]:
+        """
+        取只覆盖被省略问答的节点摘要
         
-        # 构建提示词
-        return f"""请在以下上下文基础上回答后续问题。
+        节点摘要包含该节点及其祖先上的问答，因此只考虑第一个直接放入的问答所在节点之前的节点，
+        取其中离它最近的摘要，避免摘要与直接放入的问答重复；没有直接放入的问答时考虑整条链
+        """
+        position = len(nodes)
+        if first_included_node_id is not None:
+            position = next(i for i, node in enumerate(nodes) if node["id"] == first_included_node_id)
+        for node in reversed(nodes[:position]):
+            if node["summary"]:
+                return node["summary"]
+        return None
 
-【之前的问答】
-Q: {parent_question}
-A: {parent_answer}
+def render_prompt(messages: List[Dict[str, str]]) -> str:
+    """把消息列表渲染为单个提示词，供只接受文本的接口使用"""
+    *context, current = messages
+    if not context:
+        return current["content"]
+    
+    lines = ["请在以下上下文基础上回答后续问题。", ""]
+    for message in context:
+        if message["role"] == "system":
+            lines.extend(["【之前对话的摘要】", message["content"].removeprefix(SUMMARY_PREFIX), ""])
+    history = [message for message in context if message["role"] != "system"]
+    if history:
+        lines.append("【之前的问答】")
+        for message in history:
+            prefix = "Q" if message["role"] == "user" else "A"
+            lines.append(f"{prefix}: {message['content']}")
+        lines.append("")
+    lines.extend(["【新问题】", current["content"], ""])
+    return "\n".join(lines)
 
-【新问题】
-{question}
-"""
+def build_prompt(parent: Node | None, question: str, db: Session,
+                 token_budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    构建提示词
+    
+    Args:
+        parent: 父节点，可能为None
+        question: 当前问题
+        db: 调用方的数据库会话
+        token_budget: 历史上下文的token预算
+    
+    Returns:
+        构建好的提示词
+    """
+    if not parent:
+        return question
+    
+    try:
+        messages = PromptBuilder(db, token_budget).build_messages(parent.id, question)
+        return render_prompt(messages)
     except Exception as e:
         # 如果出现异常，记录错误并返回原始问题
         print(f"构建提示词时出错: {str(e)}")
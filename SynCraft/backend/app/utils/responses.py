@@ -0,0 +1,55 @@
+# backend/app/utils/responses.py
+"""
+JSON响应类
+
+统一响应格式 {"success": true, "data": ...} 在序列化时一次生成，
+不再由中间件解析响应体后重新序列化；流式响应不经过这里，原样传输。
+"""
+from os import getenv
+from typing import Any
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 未安装时回退到标准库
+    orjson = None
+
+# 是否为成功响应包装统一格式，默认关闭以保持现有客户端使用的响应结构
+RESPONSE_ENVELOPE = getenv("RESPONSE_ENVELOPE", "false").lower() == "true"
+
+def is_enveloped(content: Any) -> bool:
+    """检查内容是否已经是统一响应格式"""
+    return isinstance(content, dict) and "success" in content and ("data" in content or "error" in content)
+
+def dumps(content: Any) -> bytes:
+    """序列化为JSON字节串，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """使用orjson序列化的JSON响应，不做包装"""
+    
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class EnvelopeJSONResponse(FastJSONResponse):
+    """
+    序列化时包装统一格式的JSON响应
+    
+    只包装成功响应（状态码小于400），已经是统一格式的内容不重复包装
+    """
+    envelope = RESPONSE_ENVELOPE
+    
+    def render(self, content: Any) -> bytes:
+        if self.envelope and self.status_code < 400 and not is_enveloped(content):
+            content = {"success": True, "data": content}
+        return dumps(content)